@@ -17,7 +17,7 @@ class Comm:
     def run(self, kname):
         print("RUN: "+kname)
 
-    def serve(self, rpc_map, exception_map):
+    def serve(self, rpc_map, exception_map, rpc_metrics=None):
         print("================")
         print(" RPC map")
         print("================")
@@ -1,8 +1,12 @@
 import struct
 import logging
+import hashlib
+import time
 from enum import Enum
 from fractions import Fraction
 
+import numpy
+
 from artiq.coredevice import runtime_exceptions
 from artiq.language import core as core_language
 from artiq.coredevice.rpc_wrapper import RPCWrapper
@@ -26,6 +30,12 @@ class _H2DMsgType(Enum):
     FLASH_ERASE_REQUEST = 9
     FLASH_REMOVE_REQUEST = 10
 
+    LOG_READ_REQUEST = 11
+
+    FLASH_WRITE_MANY_REQUEST = 12
+    FLASH_READ_ALL_REQUEST = 13
+    FLASH_WRITE_IMAGE_REQUEST = 14
+
 
 class _D2HMsgType(Enum):
     LOG_REPLY = 1
@@ -46,12 +56,73 @@ class _D2HMsgType(Enum):
     FLASH_OK_REPLY = 12
     FLASH_ERROR_REPLY = 13
 
+    RPC_BATCH = 14
+
+    LOG_READ_REPLY = 15
+
+    FLASH_READ_ALL_REPLY = 16
+
+
+def pack_flash_record(key, value):
+    """Returns a record of the flash storage, in the format used by the
+    runtime and by ``artiq_mkfs``."""
+    return struct.pack(">l", len(key) + len(value) + 5) + key + b"\x00" + value
+
+
+def unpack_flash_records(data):
+    """Iterates over the ``(key, value)`` pairs of a sequence of records,
+    which ends with the end of ``data`` or with an end marker."""
+    offset = 0
+    while offset + 4 <= len(data):
+        size = struct.unpack(">l", data[offset:offset+4])[0]
+        if size == -1:
+            break
+        if size < 5:
+            raise IOError("Invalid flash storage record size: {}"
+                          .format(size))
+        record = data[offset+4:offset+size]
+        key, _, value = record.partition(b"\x00")
+        yield key, value
+        offset += size
+
+
+# start of the messages from the device
+_sync = b"\x5a"*4
+
+# Size of the receive buffer, which is allocated on the first read. Larger
+# reads bypass it.
+_rx_buffer_size = 64*1024
+
+# data types of the elements of lists sent in RPCs
+_rpc_list_dtypes = {
+    "b": numpy.dtype("?"),
+    "i": numpy.dtype(">i4"),
+    "I": numpy.dtype(">i8"),
+    "f": numpy.dtype(">f8")
+}
+
 
 class UnsupportedDevice(Exception):
     pass
 
 
 class CommGeneric:
+    # Digest of the kernel loaded on the device in the current session.
+    # Derived classes must call _end_session when the session ends.
+    _loaded_digest = None
+    # Other state of the device known in the current session.
+    _ident_checked = False
+    _external_clock = None
+    _kernel_running = False
+
+    # Received data that has not been consumed yet is
+    # _rx_buffer[_rx_start:_rx_end].
+    _rx_buffer = None
+    _rx_start = 0
+    _rx_end = 0
+    # Number of bytes returned by read, for statistics.
+    _rx_total = 0
+
     # methods for derived classes to implement
     def open(self):
         """Opens the communication channel.
@@ -63,9 +134,10 @@ class CommGeneric:
         Must do nothing if already closed."""
         raise NotImplementedError
 
-    def read(self, length):
-        """Reads exactly length bytes from the communication channel.
-        The channel is assumed to be opened."""
+    def receive(self, buffer):
+        """Reads at least one byte from the communication channel into
+        ``buffer`` (a writable memoryview), and returns the number of bytes
+        read. The channel is assumed to be opened."""
         raise NotImplementedError
 
     def write(self, data):
@@ -74,16 +146,84 @@ class CommGeneric:
         raise NotImplementedError
     #
 
+    def _end_session(self):
+        self._loaded_digest = None
+        self._ident_checked = False
+        self._external_clock = None
+        self._kernel_running = False
+        self._rx_start = self._rx_end = 0
+
+    def _session_state(self):
+        # Returns the state of the device in the current session, for
+        # a connection that is reused by another session (see
+        # artiq.master.core_pool), or None if it is unknown, e.g. because
+        # the kernel was interrupted.
+        if self._kernel_running or self._rx_start != self._rx_end:
+            return None
+        if self._loaded_digest is None:
+            loaded_digest = None
+        else:
+            loaded_digest = self._loaded_digest.hex()
+        return {"ident_checked": self._ident_checked,
+                "external_clock": self._external_clock,
+                "loaded_digest": loaded_digest}
+
+    def _restore_session(self, state):
+        self._end_session()
+        if state is not None:
+            self._ident_checked = state["ident_checked"]
+            self._external_clock = state["external_clock"]
+            if state["loaded_digest"] is not None:
+                self._loaded_digest = bytes.fromhex(state["loaded_digest"])
+
+    def _receive_more(self, length=1):
+        # Receives data after the unconsumed data, which is first moved to
+        # the beginning of the buffer if there is no room after it or if it
+        # could not grow to length bytes.
+        if self._rx_buffer is None:
+            self._rx_buffer = bytearray(_rx_buffer_size)
+            self._rx_view = memoryview(self._rx_buffer)
+        if (self._rx_end == _rx_buffer_size
+                or self._rx_start + length > _rx_buffer_size):
+            data = bytes(self._rx_view[self._rx_start:self._rx_end])
+            self._rx_view[:len(data)] = data
+            self._rx_start, self._rx_end = 0, len(data)
+        self._rx_end += self.receive(self._rx_view[self._rx_end:])
+
+    def read(self, length):
+        """Reads exactly length bytes from the communication channel.
+        The channel is assumed to be opened."""
+        self._rx_total += length
+        available = self._rx_end - self._rx_start
+        if length > _rx_buffer_size:
+            r = bytearray(length)
+            view = memoryview(r)
+            if available:
+                view[:available] = self._rx_view[self._rx_start:self._rx_end]
+                self._rx_start = self._rx_end = 0
+            while available < length:
+                available += self.receive(view[available:])
+            return bytes(r)
+        while self._rx_end - self._rx_start < length:
+            self._receive_more(length)
+        r = bytes(self._rx_view[self._rx_start:self._rx_start+length])
+        self._rx_start += length
+        return r
+
     def _read_header(self):
         self.open()
 
-        sync_count = 0
-        while sync_count < 4:
-            (c, ) = struct.unpack("B", self.read(1))
-            if c == 0x5a:
-                sync_count += 1
-            else:
-                sync_count = 0
+        # skip everything up to the sync pattern
+        while True:
+            if self._rx_buffer is not None:
+                i = self._rx_buffer.find(_sync, self._rx_start, self._rx_end)
+                if i >= 0:
+                    self._rx_start = i + len(_sync)
+                    break
+                # the end of the buffer may be the beginning of the pattern
+                self._rx_start = max(self._rx_start,
+                                     self._rx_end - len(_sync) + 1)
+            self._receive_more()
         length = struct.unpack(">l", self.read(4))[0]
         if not length:  # inband connection close
             raise OSError("Connection closed")
@@ -100,39 +240,59 @@ class CommGeneric:
             self.write(struct.pack("B", ty.value))
 
     def reset_session(self):
+        self._loaded_digest = None
+        self._ident_checked = False
+        self._external_clock = None
+        self._kernel_running = False
         self._write_header(0, None)
 
     def check_ident(self):
+        # opening the channel may restore the state of a previous session
+        self.open()
+        if self._ident_checked:
+            return
         self._write_header(9, _H2DMsgType.IDENT_REQUEST)
         _, ty = self._read_header()
         if ty != _D2HMsgType.IDENT_REPLY:
             raise IOError("Incorrect reply from device: {}".format(ty))
-        (reply, ) = struct.unpack("B", self.read(1))
-        runtime_id = chr(reply)
-        for i in range(3):
-            (reply, ) = struct.unpack("B", self.read(1))
-            runtime_id += chr(reply)
+        runtime_id = self.read(4).decode("latin-1")
         if runtime_id != "AROR":
             raise UnsupportedDevice("Unsupported runtime ID: {}"
                                     .format(runtime_id))
+        self._ident_checked = True
 
     def switch_clock(self, external):
+        self.open()
+        if external == self._external_clock:
+            return
+        self._external_clock = None
         self._write_header(10, _H2DMsgType.SWITCH_CLOCK)
         self.write(struct.pack("B", int(external)))
         _, ty = self._read_header()
         if ty != _D2HMsgType.CLOCK_SWITCH_COMPLETED:
             raise IOError("Incorrect reply from device: {}".format(ty))
+        self._external_clock = bool(external)
 
     def load(self, kcode):
+        # The device keeps the kernel loaded after it has run, so that it
+        # can be started again with RUN_KERNEL without uploading it.
+        digest = hashlib.sha1(kcode).digest()
+        self.open()
+        if digest == self._loaded_digest:
+            logger.debug("kernel already loaded")
+            return
+        self._loaded_digest = None
         self._write_header(len(kcode) + 9, _H2DMsgType.LOAD_OBJECT)
         self.write(kcode)
         _, ty = self._read_header()
         if ty != _D2HMsgType.LOAD_COMPLETED:
             raise IOError("Incorrect reply from device: "+str(ty))
+        self._loaded_digest = digest
 
     def run(self, kname):
         self._write_header(len(kname) + 9, _H2DMsgType.RUN_KERNEL)
         self.write(bytes(kname, "ascii"))
+        self._kernel_running = True
         logger.debug("running kernel: %s", kname)
 
     def flash_storage_read(self, key):
@@ -170,6 +330,53 @@ class CommGeneric:
         if ty != _D2HMsgType.FLASH_OK_REPLY:
             raise IOError("Incorrect reply from device: {}".format(ty))
 
+    def _flash_storage_request(self, ty, payload):
+        self._write_header(9+len(payload), ty)
+        self.write(payload)
+        _, ty = self._read_header()
+        if ty != _D2HMsgType.FLASH_OK_REPLY:
+            if ty == _D2HMsgType.FLASH_ERROR_REPLY:
+                raise IOError("Flash storage is full or the records are "
+                              "invalid")
+            else:
+                raise IOError("Incorrect reply from device: {}".format(ty))
+
+    def flash_storage_write_many(self, items):
+        """Writes several key-value records with a single request.
+
+        :param items: dictionary or iterable of ``(key, value)`` pairs of
+            bytes. An empty value removes the key.
+        """
+        if hasattr(items, "items"):
+            items = items.items()
+        self._flash_storage_request(
+            _H2DMsgType.FLASH_WRITE_MANY_REQUEST,
+            b"".join(pack_flash_record(key, value) for key, value in items))
+
+    def flash_storage_remove_many(self, keys):
+        self.flash_storage_write_many((key, b"") for key in keys)
+
+    def flash_storage_read_all(self):
+        """Returns all the records of the flash storage, as a dictionary of
+        bytes. The storage is small (one flash sector), and is transferred
+        with a single request."""
+        self._write_header(9, _H2DMsgType.FLASH_READ_ALL_REQUEST)
+        length, ty = self._read_header()
+        if ty != _D2HMsgType.FLASH_READ_ALL_REPLY:
+            raise IOError("Incorrect reply from device: {}".format(ty))
+        return dict(unpack_flash_records(self.read(length - 9)))
+
+    def flash_storage_list(self):
+        """Returns the sorted list of the keys of the flash storage."""
+        return sorted(self.flash_storage_read_all().keys())
+
+    def flash_storage_write_image(self, image):
+        """Replaces the content of the flash storage with an image generated
+        by ``artiq_mkfs``, transferred in a single message. The device
+        checks the image before erasing the storage."""
+        self._flash_storage_request(_H2DMsgType.FLASH_WRITE_IMAGE_REQUEST,
+                                    image)
+
     def _receive_rpc_value(self, type_tag):
         if type_tag == "n":
             return None
@@ -185,7 +392,23 @@ class CommGeneric:
             n, d = struct.unpack(">qq", self.read(16))
             return Fraction(n, d)
 
-    def _receive_rpc_values(self):
+    def _receive_rpc_list(self, elt_type_tag, length, arrays):
+        # The elements are read and decoded all at once.
+        if elt_type_tag == "n":
+            return [None]*length
+        if elt_type_tag == "F":
+            return [Fraction(n, d)
+                    for n, d in struct.iter_unpack(">qq",
+                                                   self.read(16*length))]
+        dtype = _rpc_list_dtypes[elt_type_tag]
+        elts = numpy.frombuffer(self.read(dtype.itemsize*length), dtype)
+        if arrays:
+            # copy in native byte order, which also makes it writable
+            return elts.astype(dtype.newbyteorder("="))
+        else:
+            return elts.tolist()
+
+    def _receive_rpc_values(self, arrays=False):
         r = []
         while True:
             type_tag = chr(struct.unpack("B", self.read(1))[0])
@@ -194,22 +417,45 @@ class CommGeneric:
             elif type_tag == "l":
                 elt_type_tag = chr(struct.unpack("B", self.read(1))[0])
                 length = struct.unpack(">l", self.read(4))[0]
-                r.append([self._receive_rpc_value(elt_type_tag)
-                          for i in range(length)])
+                r.append(self._receive_rpc_list(elt_type_tag, length,
+                                                arrays))
             else:
                 r.append(self._receive_rpc_value(type_tag))
 
     def _serve_rpc(self, rpc_wrapper, rpc_map, user_exception_map):
+        t0 = time.monotonic()
+        rx_start = self._rx_total
         rpc_num = struct.unpack(">l", self.read(4))[0]
-        args = self._receive_rpc_values()
+        fn = rpc_map[rpc_num]
+        args = self._receive_rpc_values(getattr(fn, "numpy_rpc", False))
         logger.debug("rpc service: %d %r", rpc_num, args)
-        eid, r = rpc_wrapper.run_rpc(
-            user_exception_map, rpc_map[rpc_num], args)
+        t1 = time.monotonic()
+        eid, r = rpc_wrapper.run_rpc(user_exception_map, fn, args)
+        t2 = time.monotonic()
         self._write_header(9+2*4, _H2DMsgType.RPC_REPLY)
         self.write(struct.pack(">ll", eid, r))
+        if rpc_wrapper.metrics is not None:
+            rpc_wrapper.metrics.record(rpc_num, fn, self._rx_total - rx_start,
+                                       t2 - t1, time.monotonic() - t0)
         logger.debug("rpc service: %d %r == %r (eid %d)", rpc_num, args,
                      r, eid)
 
+    def _serve_rpc_batch(self, rpc_wrapper, rpc_map):
+        # asynchronous RPCs, which have no reply
+        count = struct.unpack(">l", self.read(4))[0]
+        rpcs = []
+        for i in range(count):
+            rx_start = self._rx_total
+            rpc_num = struct.unpack(">l", self.read(4))[0]
+            fn = rpc_map[rpc_num]
+            args = self._receive_rpc_values(getattr(fn, "numpy_rpc", False))
+            logger.debug("async rpc service: %d %r", rpc_num, args)
+            if rpc_wrapper.metrics is not None:
+                rpc_wrapper.metrics.record(rpc_num, fn,
+                                           self._rx_total - rx_start)
+            rpcs.append((rpc_num, fn, args))
+        rpc_wrapper.run_async_rpcs(rpcs)
+
     def _serve_exception(self, rpc_wrapper, user_exception_map):
         eid, p0, p1, p2 = struct.unpack(">lqqq", self.read(4+3*8))
         rpc_wrapper.filter_rpc_exception(eid)
@@ -220,27 +466,65 @@ class CommGeneric:
             exception = user_exception_map[eid]
             raise exception
 
-    def serve(self, rpc_map, user_exception_map):
-        rpc_wrapper = RPCWrapper()
-        while True:
-            _, ty = self._read_header()
-            if ty == _D2HMsgType.RPC_REQUEST:
-                self._serve_rpc(rpc_wrapper, rpc_map, user_exception_map)
-            elif ty == _D2HMsgType.KERNEL_EXCEPTION:
-                self._serve_exception(rpc_wrapper, user_exception_map)
-            elif ty == _D2HMsgType.KERNEL_FINISHED:
-                return
-            else:
-                raise IOError("Incorrect request from device: "+str(ty))
+    def serve(self, rpc_map, user_exception_map, rpc_metrics=None):
+        """Serves the requests of the running kernel until it finishes.
+
+        :param rpc_metrics: if not None, an ``RPCMetrics`` object that is
+            updated with the statistics of the RPCs."""
+        rpc_wrapper = RPCWrapper(rpc_metrics)
+        try:
+            while True:
+                _, ty = self._read_header()
+                if ty == _D2HMsgType.RPC_REQUEST:
+                    self._serve_rpc(rpc_wrapper, rpc_map, user_exception_map)
+                elif ty == _D2HMsgType.RPC_BATCH:
+                    self._serve_rpc_batch(rpc_wrapper, rpc_map)
+                elif ty == _D2HMsgType.KERNEL_EXCEPTION:
+                    self._kernel_running = False
+                    self._serve_exception(rpc_wrapper, user_exception_map)
+                elif ty == _D2HMsgType.KERNEL_FINISHED:
+                    self._kernel_running = False
+                    break
+                else:
+                    raise IOError("Incorrect request from device: "+str(ty))
+        except:
+            # The state of the device is unknown (e.g. the kernel was
+            # interrupted), upload the kernel again next time.
+            self._loaded_digest = None
+            rpc_wrapper.close()
+            raise
+        try:
+            rpc_wrapper.wait_async_rpcs()
+        finally:
+            rpc_wrapper.close()
 
     def get_log(self):
         self._write_header(9, _H2DMsgType.LOG_REQUEST)
         length, ty = self._read_header()
         if ty != _D2HMsgType.LOG_REPLY:
             raise IOError("Incorrect request from device: "+str(ty))
-        r = ""
-        for i in range(length - 9):
-            c = struct.unpack("B", self.read(1))[0]
-            if c:
-                r += chr(c)
-        return r
+        return self.read(length - 9).replace(b"\x00", b"").decode("latin-1")
+
+    def read_log(self, offset=None):
+        """Reads the log written since ``offset``, counted in characters
+        from the start of the log, and returns ``(text, offset)``. The
+        returned offset is the one to pass to the next call, which only
+        transfers the characters logged in the meantime. If ``offset`` is
+        None, the whole content of the ring buffer is returned.
+
+        Characters that have been overwritten in the ring buffer since
+        ``offset`` are skipped, and a warning is logged."""
+        self._write_header(13, _H2DMsgType.LOG_READ_REQUEST)
+        self.write(struct.pack(">L", (offset or 0) & 0xffffffff))
+        length, ty = self._read_header()
+        if ty != _D2HMsgType.LOG_READ_REPLY:
+            raise IOError("Incorrect reply from device: {}".format(ty))
+        start = struct.unpack(">L", self.read(4))[0]
+        text = self.read(length - 13)
+        if offset is not None:
+            lost = (start - offset) & 0xffffffff
+            if lost >= 1 << 31:
+                logger.warning("core device log restarted")
+            elif lost:
+                logger.warning("core device log: %d characters lost", lost)
+        return text.decode("latin-1"), (start + len(text)) & 0xffffffff
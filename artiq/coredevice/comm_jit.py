@@ -0,0 +1,610 @@
+"""Execution of kernels on the host, for simulation and benchmarking.
+
+When this communication device is used instead of ``comm_tcp`` or
+``comm_serial``, the core device driver compiles kernels to native code for
+the host (with the LLVM MCJIT engine) instead of the core device CPU, and
+they are executed in the process that runs the experiment. The system calls
+that program the RTIO core are recorded into a simulated RTIO timeline, and
+RPCs are ordinary calls into the Python interpreter.
+
+This is much faster than interpreting kernels with the ``artiq.sim``
+devices, and exercises the same compiler as the hardware. It is meant for
+benchmarking experiments and for regression tests that compare the
+generated RTIO events against a reference, without a core device.
+
+Only POSIX systems are supported, as exceptions are implemented with the
+``_setjmp`` and ``_longjmp`` functions of the C library.
+"""
+
+import ctypes
+import hashlib
+import logging
+import time
+from fractions import Fraction
+
+import numpy
+import llvmlite_artiq.ir as ll
+import llvmlite_artiq.binding as llvm
+
+from artiq.py2llvm import base_types
+from artiq.language import core as core_language
+from artiq.coredevice import runtime_exceptions
+from artiq.coredevice.runtime import LinkInterface, _syscalls, _value_to_str
+from artiq.coredevice.rpc_wrapper import RPCWrapper
+
+
+logger = logging.getLogger(__name__)
+
+
+# Size of the exception context stack and of each context, which must be
+# larger than the jmp_buf of the C library.
+_max_exception_contexts = 64
+_exception_context_words = 64
+
+
+class HostRuntime(LinkInterface):
+    """Link interface for kernels executed on the host.
+
+    Compared to the core device runtime, the exception handling functions
+    are implemented in the generated module, RPCs pass their arguments as
+    arrays to a function with a fixed signature, and the host functions
+    report exceptions through a global variable that the generated code
+    checks after each call.
+    """
+    def __init__(self):
+        self.cpu_type = "host"
+
+    def init_module(self, module):
+        LinkInterface.init_module(self, module)
+        llvm_module = self.module.llvm_module
+
+        i32 = ll.IntType(32)
+        i8p = ll.PointerType(ll.IntType(8))
+
+        self.pending_eid = ll.GlobalVariable(llvm_module, i32,
+                                             "__host_pending_eid")
+        func_type = ll.FunctionType(i32, [i32, i32, ll.PointerType(i32),
+                                          ll.PointerType(i8p)])
+        self.host_rpc = ll.Function(llvm_module, func_type, "__host_rpc")
+        func_type = ll.FunctionType(ll.VoidType(), func_type.args)
+        self.host_rpc_async = ll.Function(llvm_module, func_type,
+                                          "__host_rpc_async")
+        func_type = ll.FunctionType(ll.VoidType(), [i8p, i32])
+        longjmp = ll.Function(llvm_module, func_type, "__host_longjmp")
+        longjmp.attributes.add("noreturn")
+
+        context_type = ll.ArrayType(ll.IntType(64), _exception_context_words)
+        contexts_type = ll.ArrayType(context_type, _max_exception_contexts)
+        contexts = ll.GlobalVariable(llvm_module, contexts_type,
+                                     "__host_eh_contexts")
+        contexts.initializer = ll.Constant(contexts_type, None)
+        contexts.linkage = "internal"
+        top = ll.GlobalVariable(llvm_module, i32, "__host_eh_top")
+        top.initializer = ll.Constant(i32, 0)
+        top.linkage = "internal"
+        stored_id = ll.GlobalVariable(llvm_module, i32, "__host_eh_id")
+        stored_id.initializer = ll.Constant(i32, 0)
+        stored_id.linkage = "internal"
+
+        def context_ptr(builder, index):
+            ptr = builder.gep(contexts, [ll.Constant(i32, 0), index])
+            return builder.bitcast(ptr, i8p)
+
+        # __eh_push: returns the next context, raises InternalError when
+        # the stack is full
+        builder = ll.IRBuilder(self.eh_push.append_basic_block("entry"))
+        index = builder.load(top)
+        full = builder.icmp_signed(">=", index,
+                                   ll.Constant(i32, _max_exception_contexts))
+        with builder.if_then(full):
+            builder.call(self.eh_raise, [ll.Constant(
+                i32, runtime_exceptions.InternalError.eid)])
+            builder.unreachable()
+        builder.store(builder.add(index, ll.Constant(i32, 1)), top)
+        builder.ret(context_ptr(builder, index))
+
+        # __eh_pop
+        builder = ll.IRBuilder(self.eh_pop.append_basic_block("entry"))
+        builder.store(builder.sub(builder.load(top), self.eh_pop.args[0]),
+                      top)
+        builder.ret_void()
+
+        # __eh_getid
+        builder = ll.IRBuilder(self.eh_getid.append_basic_block("entry"))
+        builder.ret(builder.load(stored_id))
+
+        # __eh_raise: jumps to the top context, and pops it. The execution
+        # wrapper below ensures that there is always one.
+        builder = ll.IRBuilder(self.eh_raise.append_basic_block("entry"))
+        builder.store(self.eh_raise.args[0], stored_id)
+        index = builder.sub(builder.load(top), ll.Constant(i32, 1))
+        builder.store(index, top)
+        builder.call(longjmp, [context_ptr(builder, index),
+                               ll.Constant(i32, 1)])
+        builder.unreachable()
+
+        # __host_run: runs a kernel and returns the ID of its uncaught
+        # exception, or 0
+        func_type = ll.FunctionType(i32, [ll.PointerType(
+            ll.FunctionType(ll.VoidType(), []))])
+        run = ll.Function(llvm_module, func_type, "__host_run")
+        builder = ll.IRBuilder(run.append_basic_block("entry"))
+        builder.store(ll.Constant(i32, 0), top)
+        jmpbuf = builder.call(self.eh_push, [])
+        exception_occured = builder.call(self.eh_setjmp, [jmpbuf])
+        exception_occured = builder.icmp_signed("!=", exception_occured,
+                                                ll.Constant(i32, 0))
+        with builder.if_then(exception_occured):
+            builder.ret(builder.load(stored_id))
+        builder.call(run.args[0], [])
+        builder.call(self.eh_pop, [ll.Constant(i32, 1)])
+        builder.ret(ll.Constant(i32, 0))
+
+    def _build_check_pending(self, builder):
+        eid = builder.load(self.pending_eid)
+        pending = builder.icmp_signed("!=", eid, ll.Constant(ll.IntType(32),
+                                                             0))
+        with builder.if_then(pending):
+            builder.store(ll.Constant(ll.IntType(32), 0), self.pending_eid)
+            builder.call(self.eh_raise, [eid])
+
+    def _build_rpc(self, args, builder, asynchronous=False):
+        if asynchronous:
+            r = base_types.VNone()
+        else:
+            r = base_types.VInt()
+        if builder is not None:
+            i32 = ll.IntType(32)
+            i8p = ll.PointerType(ll.IntType(8))
+            nargs = len(args) - 1
+            tags = builder.alloca(ll.ArrayType(i32, max(nargs, 1)))
+            ptrs = builder.alloca(ll.ArrayType(i8p, max(nargs, 1)))
+            for i, arg in enumerate(args[1:]):
+                index = [ll.Constant(i32, 0), ll.Constant(i32, i)]
+                arg_type_int = 0
+                for c in reversed(_value_to_str(arg)):
+                    arg_type_int <<= 8
+                    arg_type_int |= ord(c)
+                builder.store(ll.Constant(i32, arg_type_int),
+                              builder.gep(tags, index))
+                if isinstance(arg, base_types.VNone):
+                    ptr = ll.Constant(i8p, None)
+                elif isinstance(arg.llvm_value.type, ll.PointerType):
+                    ptr = builder.bitcast(arg.llvm_value, i8p)
+                else:
+                    arg_ptr = arg.new()
+                    arg_ptr.alloca(builder)
+                    arg_ptr.auto_store(builder, arg.llvm_value)
+                    ptr = builder.bitcast(arg_ptr.llvm_value, i8p)
+                builder.store(ptr, builder.gep(ptrs, index))
+            zero = [ll.Constant(i32, 0), ll.Constant(i32, 0)]
+            call_args = [args[0].auto_load(builder), ll.Constant(i32, nargs),
+                         builder.gep(tags, zero), builder.gep(ptrs, zero)]
+            if asynchronous:
+                builder.call(self.host_rpc_async, call_args)
+            else:
+                value = builder.call(self.host_rpc, call_args)
+                self._build_check_pending(builder)
+                r.auto_store(builder, value)
+        return r
+
+    def _build_regular_syscall(self, syscall_name, args, builder):
+        r = LinkInterface._build_regular_syscall(self, syscall_name, args,
+                                                 builder)
+        if builder is not None:
+            self._build_check_pending(builder)
+        return r
+
+    def emit_object(self):
+        # The optimized module is JIT-compiled when it is loaded.
+        return str(self.module.llvm_module_ref).encode()
+
+    def __repr__(self):
+        return "<Runtime {}>".format(self.cpu_type)
+
+
+class SimulatedRTIO:
+    """Simulated RTIO core and timeline.
+
+    Output events are appended to ``events`` as ``(timestamp, channel,
+    name, value)`` tuples, e.g. ``(1000, 3, "ttl_o", True)``. The RTIO
+    counter only advances when a kernel waits for input events. Input
+    events are provided by ``inject_input``, and are registered when the
+    input gate of the channel is open (regardless of the edge type).
+
+    Underflows (events in the past of the RTIO counter) and sequence errors
+    (events earlier than the previous event of the same channel) raise the
+    same exceptions as the hardware.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counter = 0
+        self.now = -1
+        self.events = []
+        self._inputs = dict()
+        self._last_timestamps = dict()
+        self._sensitivity = dict()
+
+    def inject_input(self, channel, timestamps):
+        """Adds input events (e.g. TTL edges) to a channel."""
+        inputs = self._inputs.setdefault(channel, [])
+        inputs += timestamps
+        inputs.sort()
+
+    def output(self, timestamp, channel, name, value):
+        if timestamp < self.counter:
+            raise runtime_exceptions.RTIOUnderflow(
+                None, timestamp, channel, self.counter)
+        if timestamp < self._last_timestamps.get(channel, timestamp):
+            raise runtime_exceptions.RTIOSequenceError(
+                None, timestamp, channel, 0)
+        self._last_timestamps[channel] = timestamp
+        self.events.append((timestamp, channel, name, value))
+
+    def _gate_open(self, channel, timestamp):
+        sensitivity = 0
+        for change_timestamp, value in self._sensitivity.get(channel, []):
+            if change_timestamp > timestamp:
+                break
+            sensitivity = value
+        return sensitivity != 0
+
+    def get_input(self, channel, time_limit):
+        inputs = self._inputs.get(channel, [])
+        while inputs and inputs[0] <= time_limit:
+            timestamp = inputs.pop(0)
+            if self._gate_open(channel, timestamp):
+                self.counter = max(self.counter, timestamp)
+                return timestamp
+        self.counter = max(self.counter, time_limit)
+        return -1
+
+    # system calls
+    def now_init(self):
+        if self.now < 0:
+            self.now = self.counter + 125000
+        return self.now
+
+    def now_save(self, now):
+        self.now = now
+
+    def watchdog_set(self, ms):
+        return 0
+
+    def watchdog_clear(self, id):
+        pass
+
+    def rtio_get_counter(self):
+        return self.counter
+
+    def ttl_set_o(self, timestamp, channel, value):
+        self.output(timestamp, channel, "ttl_o", bool(value & 1))
+
+    def ttl_set_oe(self, timestamp, channel, oe):
+        self.output(timestamp, channel, "ttl_oe", bool(oe & 1))
+
+    def ttl_set_sensitivity(self, timestamp, channel, sensitivity):
+        self.output(timestamp, channel, "ttl_sensitivity", sensitivity)
+        self._sensitivity.setdefault(channel, []).append(
+            (timestamp, sensitivity))
+
+    def ttl_get(self, channel, time_limit):
+        return self.get_input(channel, time_limit)
+
+    def ttl_count(self, channel, time_limit):
+        count = 0
+        while self.get_input(channel, time_limit) >= 0:
+            count += 1
+        return count
+
+    def ttl_get_many(self, channel, time_limit, reference, offsets):
+        count = 0
+        while count < len(offsets):
+            timestamp = self.get_input(channel, time_limit)
+            if timestamp < 0:
+                break
+            offsets[count] = timestamp - reference
+            count += 1
+        return count
+
+    def ttl_histogram(self, channel, time_limit, reference, bin_width,
+                      histogram):
+        count = 0
+        while True:
+            timestamp = self.get_input(channel, time_limit)
+            if timestamp < 0:
+                return count
+            count += 1
+            offset = timestamp - reference
+            if 0 <= offset < bin_width*len(histogram):
+                histogram[offset//bin_width] += 1
+
+    def ttl_clock_set(self, timestamp, channel, ftw):
+        self.output(timestamp, channel, "ttl_clock", ftw)
+
+    def dds_init(self, timestamp, channel):
+        self.output(timestamp, channel, "dds_init", None)
+
+    def dds_batch_enter(self, timestamp):
+        pass
+
+    def dds_batch_exit(self):
+        pass
+
+    def dds_set(self, timestamp, channel, ftw, pow, phase_mode, amplitude):
+        self.output(timestamp, channel, "dds",
+                    (ftw, pow, phase_mode, amplitude))
+
+    def dds_set_many(self, timestamp, channels, ftws, pows, phase_mode,
+                     amplitudes):
+        if (not (len(channels) == len(ftws) == len(pows) == len(amplitudes))
+                or len(set(channels.tolist())) != len(channels)):
+            raise runtime_exceptions.DDSBatchError(None, 0, 0, 0)
+        for channel, ftw, pow, amplitude in zip(
+                channels.tolist(), ftws.tolist(), pows.tolist(),
+                amplitudes.tolist()):
+            self.dds_set(timestamp, channel, ftw, pow, phase_mode, amplitude)
+
+
+_ctypes = {
+    "n": None,
+    "b": ctypes.c_uint8,
+    "i": ctypes.c_int32,
+    "I": ctypes.c_int64,
+    "l": ctypes.POINTER(ctypes.c_int32)
+}
+
+_rpc_ctypes = {
+    "b": ctypes.c_uint8,
+    "i": ctypes.c_int32,
+    "I": ctypes.c_int64,
+    "f": ctypes.c_double,
+    "F": ctypes.c_int64*2
+}
+
+
+def _decode_rpc_value(type_tag, ptr, arrays):
+    if type_tag == "n":
+        return None
+    if type_tag[0] == "l":
+        elt_type = _rpc_ctypes[type_tag[1]]
+        count = ctypes.cast(ptr, ctypes.POINTER(ctypes.c_int32))[0]
+
+        class _List(ctypes.Structure):
+            _fields_ = [("count", ctypes.c_int32),
+                        ("elts", elt_type*count)]
+        elts = ctypes.cast(ptr, ctypes.POINTER(_List))[0].elts
+        if arrays and type_tag[1] != "F":
+            elts = numpy.ctypeslib.as_array(elts).copy()
+            if type_tag[1] == "b":
+                elts = elts.astype(bool)
+            return elts
+        return [_convert_rpc_value(type_tag[1], elt) for elt in elts]
+    value = ctypes.cast(ptr, ctypes.POINTER(_rpc_ctypes[type_tag]))[0]
+    return _convert_rpc_value(type_tag, value)
+
+
+def _convert_rpc_value(type_tag, value):
+    if type_tag == "b":
+        return bool(value & 1)
+    if type_tag == "F":
+        return Fraction(value[0], value[1])
+    return value
+
+
+# The host functions called by the generated code are process-wide symbols,
+# they are dispatched to the communication device that is running a kernel.
+_active_comm = None
+_pending_eid = ctypes.c_int32(0)
+_callbacks = []
+
+
+def _list_view(ptr):
+    # Returns an array that shares the memory of the elements of a list
+    # of 32-bit integers passed to a system call.
+    length = ptr[0]
+    if not length:
+        return numpy.zeros(0, numpy.int32)
+    elts = ctypes.cast(ctypes.addressof(ptr.contents)
+                       + ctypes.sizeof(ctypes.c_int32),
+                       ctypes.POINTER(ctypes.c_int32))
+    return numpy.ctypeslib.as_array(elts, (length, ))
+
+
+def _make_syscall_callback(name):
+    type_str = _syscalls[name]
+    restype = _ctypes[type_str[-1]]
+    arg_chrs = [c for c in type_str[:-2] if c != "n"]
+    argtypes = [_ctypes[c] for c in arg_chrs]
+
+    def callback(*args):
+        try:
+            args = [_list_view(arg) if c == "l" else arg
+                    for arg, c in zip(args, arg_chrs)]
+            r = getattr(_active_comm.rtio, name)(*args)
+        except Exception as e:
+            _active_comm._set_exception(e)
+            r = None
+        if restype is not None:
+            return 0 if r is None else r
+    return ctypes.CFUNCTYPE(restype, *argtypes)(callback)
+
+
+def _decode_rpc_args(fn, nargs, tags, ptrs):
+    arrays = getattr(fn, "numpy_rpc", False)
+    args = []
+    for i in range(nargs):
+        tag = tags[i]
+        type_tag = ""
+        while tag:
+            type_tag += chr(tag & 0xff)
+            tag >>= 8
+        args.append(_decode_rpc_value(type_tag, ptrs[i], arrays))
+    return args
+
+
+def _host_rpc(rpc_num, nargs, tags, ptrs):
+    try:
+        t0 = time.monotonic()
+        fn = _active_comm._rpc_map[rpc_num]
+        args = _decode_rpc_args(fn, nargs, tags, ptrs)
+        return _active_comm._run_rpc(rpc_num, fn, args, t0)
+    except Exception as e:
+        _active_comm._set_exception(e)
+        return 0
+
+
+def _host_rpc_async(rpc_num, nargs, tags, ptrs):
+    try:
+        fn = _active_comm._rpc_map[rpc_num]
+        args = _decode_rpc_args(fn, nargs, tags, ptrs)
+        logger.debug("async rpc service: %d %r", rpc_num, args)
+        rpc_wrapper = _active_comm._rpc_wrapper
+        if rpc_wrapper.metrics is not None:
+            rpc_wrapper.metrics.record(rpc_num, fn, 0)
+        rpc_wrapper.run_async_rpcs([(rpc_num, fn, args)])
+    except Exception as e:
+        _active_comm._set_exception(e)
+
+
+_symbols_registered = False
+
+
+def _register_symbols():
+    global _symbols_registered
+    if _symbols_registered:
+        return
+    libc = ctypes.CDLL(None)
+    llvm.add_symbol("__eh_setjmp",
+                    ctypes.cast(libc._setjmp, ctypes.c_void_p).value)
+    llvm.add_symbol("__host_longjmp",
+                    ctypes.cast(libc._longjmp, ctypes.c_void_p).value)
+    llvm.add_symbol("__host_pending_eid", ctypes.addressof(_pending_eid))
+    for name in _syscalls.keys():
+        callback = _make_syscall_callback(name)
+        _callbacks.append(callback)
+        llvm.add_symbol("__syscall_" + name,
+                        ctypes.cast(callback, ctypes.c_void_p).value)
+    rpc_argtypes = [ctypes.c_int32, ctypes.c_int32,
+                    ctypes.POINTER(ctypes.c_int32),
+                    ctypes.POINTER(ctypes.c_void_p)]
+    for name, restype, function in (
+            ("__host_rpc", ctypes.c_int32, _host_rpc),
+            ("__host_rpc_async", None, _host_rpc_async)):
+        callback = ctypes.CFUNCTYPE(restype, *rpc_argtypes)(function)
+        _callbacks.append(callback)
+        llvm.add_symbol(name, ctypes.cast(callback, ctypes.c_void_p).value)
+    llvm.initialize_native_target()
+    llvm.initialize_native_asmprinter()
+    _symbols_registered = True
+
+
+class Comm:
+    """Communication device that executes kernels on the host.
+
+    :param max_modules: number of JIT-compiled kernels that are kept, so
+        that running the same kernel again does not compile it again.
+    """
+    runtime_class = HostRuntime
+
+    def __init__(self, dmgr, max_modules=16):
+        _register_symbols()
+        self.rtio = SimulatedRTIO()
+        self.max_modules = max_modules
+        self._modules = []
+        self._loaded = None
+        self._kernel_name = None
+        self._log = ""
+
+    def close(self):
+        self._modules = []
+        self._loaded = None
+
+    def check_ident(self):
+        pass
+
+    def switch_clock(self, external):
+        pass
+
+    def load(self, kcode):
+        digest = hashlib.sha1(kcode).digest()
+        for i, (module_digest, module) in enumerate(self._modules):
+            if module_digest == digest:
+                del self._modules[i]
+                break
+        else:
+            llvm_module = llvm.parse_assembly(kcode.decode())
+            llvm_module.triple = llvm.get_default_triple()
+            tm = llvm.Target.from_default_triple().create_target_machine()
+            ee = llvm.create_mcjit_compiler(llvm_module, tm)
+            ee.finalize_object()
+            module = llvm_module, ee
+        self._modules.insert(0, (digest, module))
+        del self._modules[self.max_modules:]
+        self._loaded = module
+
+    def run(self, kname):
+        self._kernel_name = kname
+
+    def _run_rpc(self, rpc_num, fn, args, t0):
+        logger.debug("rpc service: %d %r", rpc_num, args)
+        t1 = time.monotonic()
+        eid, r = self._rpc_wrapper.run_rpc(self._user_exception_map, fn, args)
+        if self._rpc_wrapper.metrics is not None:
+            t2 = time.monotonic()
+            self._rpc_wrapper.metrics.record(rpc_num, fn, 0, t2 - t1, t2 - t0)
+        if eid:
+            _pending_eid.value = eid
+            self._exception_params = (0, 0, 0)
+        return r
+
+    def _set_exception(self, e):
+        if isinstance(e, core_language.RuntimeException):
+            _pending_eid.value = e.eid
+            self._exception_params = (e.p0, e.p1, e.p2)
+        else:
+            logger.error("host function of simulated kernel failed",
+                         exc_info=True)
+            _pending_eid.value = runtime_exceptions.InternalError.eid
+            self._exception_params = (0, 0, 0)
+
+    def serve(self, rpc_map, user_exception_map, rpc_metrics=None):
+        global _active_comm
+
+        if _active_comm is not None:
+            raise RuntimeError("A kernel is already running")
+        llvm_module, ee = self._loaded
+        run = ctypes.CFUNCTYPE(ctypes.c_int32, ctypes.c_void_p)(
+            ee.get_pointer_to_global(llvm_module.get_function("__host_run")))
+        kernel = ee.get_pointer_to_global(
+            llvm_module.get_function(self._kernel_name))
+
+        self._rpc_wrapper = RPCWrapper(rpc_metrics)
+        self._rpc_map = rpc_map
+        self._user_exception_map = user_exception_map
+        self._exception_params = (0, 0, 0)
+        _active_comm = self
+        _pending_eid.value = 0
+        try:
+            eid = run(kernel)
+            if not eid:
+                self._rpc_wrapper.wait_async_rpcs()
+        finally:
+            _active_comm = None
+            self._rpc_wrapper.close()
+
+        if eid:
+            self._rpc_wrapper.filter_rpc_exception(eid)
+            if eid < core_language.first_user_eid:
+                exception = runtime_exceptions.exception_map[eid]
+                raise exception(self.core, *self._exception_params)
+            else:
+                raise user_exception_map[eid]
+
+    def get_log(self):
+        return self._log
+
+    def read_log(self, offset=None):
+        return self._log[offset:], len(self._log)
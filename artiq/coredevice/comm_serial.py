@@ -25,12 +25,15 @@ class Comm(CommGeneric):
             return
         self.port.close()
         del self.port
-
-    def read(self, length):
-        r = bytes()
-        while len(r) < length:
-            r += self.port.read(length - len(r))
-        return r
+        self._end_session()
+
+    def receive(self, buffer):
+        # block until data is available, then take everything that is
+        # buffered by the driver
+        data = self.port.read(1)
+        data += self.port.read(min(self.port.inWaiting(), len(buffer) - 1))
+        buffer[:len(data)] = data
+        return len(data)
 
     def write(self, data):
         remaining = len(data)
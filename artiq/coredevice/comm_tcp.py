@@ -24,35 +24,65 @@ def set_keepalive(sock, after_idle, interval, max_fails):
                        sys.platform)
 
 
+def initialize_connection(host, port):
+    sock = socket.create_connection((host, port), 5.0)
+    sock.settimeout(None)
+    set_keepalive(sock, 3, 2, 3)
+    logger.debug("connected to host %s on port %d", host, port)
+    sock.sendall(b"ARTIQ coredev\n")
+    return sock
+
+
 class Comm(CommGeneric):
+    """Core device driver communicating over TCP.
+
+    When running in a worker of a master that keeps the connections to the
+    core devices open (``core_connection_pool`` virtual device, see
+    ``artiq.master.core_pool``), the connection is borrowed from the master
+    and given back when the driver is closed.
+    """
     def __init__(self, dmgr, host, port=1381):
         self.host = host
         self.port = port
+        try:
+            self.pool = dmgr.get("core_connection_pool")
+        except KeyError:
+            self.pool = None
+        self._borrowed = False
 
     def open(self):
         if hasattr(self, "socket"):
             return
-        self.socket = socket.create_connection((self.host, self.port), 5.0)
-        self.socket.settimeout(None)
-        set_keepalive(self.socket, 3, 2, 3)
-        logger.debug("connected to host %s on port %d", self.host, self.port)
-        self.write(b"ARTIQ coredev\n")
+        if self.pool is not None:
+            borrowed = self.pool.borrow(self, self.host, self.port)
+            if borrowed is not None:
+                self.socket, state = borrowed
+                self._borrowed = True
+                self._restore_session(state)
+                logger.debug("borrowed connection to host %s on port %d",
+                             self.host, self.port)
+                return
+        self.socket = initialize_connection(self.host, self.port)
 
     def close(self):
         if not hasattr(self, "socket"):
             return
-        self.socket.close()
-        del self.socket
-        logger.debug("disconnected")
-
-    def read(self, length):
-        r = bytes()
-        while len(r) < length:
-            rn = self.socket.recv(min(8192, length - len(r)))
-            if not rn:
-                raise IOError("Connection closed")
-            r += rn
-        return r
+        try:
+            if self._borrowed:
+                self._borrowed = False
+                self.pool.give_back(self, self.host, self.port,
+                                    self._session_state())
+        finally:
+            self.socket.close()
+            del self.socket
+            self._end_session()
+            logger.debug("disconnected")
+
+    def receive(self, buffer):
+        n = self.socket.recv_into(buffer)
+        if not n:
+            raise IOError("Connection closed")
+        return n
 
     def write(self, data):
         self.socket.sendall(data)
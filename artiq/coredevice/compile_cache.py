@@ -0,0 +1,113 @@
+import os
+import ast
+import hashlib
+import tempfile
+import logging
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+# Compiler sources whose modification invalidates the on-disk cache.
+# core.py defines the transform pipeline, and comm_jit.py the runtime of
+# the kernels executed on the host.
+_compiler_sources = ["transforms", "py2llvm", "coredevice/core.py",
+                     "coredevice/runtime.py", "coredevice/comm_jit.py",
+                     "coredevice/compile_cache.py"]
+_compiler_digest = None
+
+
+def _get_compiler_digest():
+    global _compiler_digest
+    if _compiler_digest is None:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        h = hashlib.sha256()
+        for source in _compiler_sources:
+            path = os.path.join(root, source)
+            if os.path.isdir(path):
+                filenames = sorted(os.path.join(path, f)
+                                   for f in os.listdir(path)
+                                   if f.endswith(".py"))
+            else:
+                filenames = [path]
+            for filename in filenames:
+                with open(filename, "rb") as f:
+                    h.update(f.read())
+        _compiler_digest = h.digest()
+    return _compiler_digest
+
+
+class CompileCache:
+    """Cache of compiled kernels.
+
+    Kernels are identified by their AST after inlining, which contains the
+    source of all the inlined functions and the values of the host object
+    attributes and arguments they use, together with the parameters of the
+    compiler (reference period and target).
+
+    :param directory: if not None, compiled kernels are also stored in this
+        directory so that they can be reused by other processes.
+    :param max_entries: number of kernels kept in memory.
+    """
+    def __init__(self, directory=None, max_entries=64):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(func_def, ref_period, target):
+        h = hashlib.sha256()
+        h.update(_get_compiler_digest())
+        h.update(ast.dump(func_def).encode())
+        h.update(repr(ref_period).encode())
+        h.update(repr(target).encode())
+        return h.hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + ".elf")
+
+    def get(self, key):
+        """Returns the binary of a compiled kernel, or None if it is not in
+        the cache."""
+        try:
+            binary = self._entries[key]
+        except KeyError:
+            binary = None
+            if self.directory is not None:
+                try:
+                    with open(self._filename(key), "rb") as f:
+                        binary = f.read()
+                except FileNotFoundError:
+                    pass
+                else:
+                    self._add_entry(key, binary)
+        else:
+            self._entries.move_to_end(key)
+        if binary is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return binary
+
+    def _add_entry(self, key, binary):
+        self._entries[key] = binary
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key, binary):
+        self._add_entry(key, binary)
+        if self.directory is not None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                # write to a temporary file first so that other processes
+                # never see incomplete binaries
+                fd, tmpname = tempfile.mkstemp(dir=self.directory)
+                with open(fd, "wb") as f:
+                    f.write(binary)
+                os.replace(tmpname, self._filename(key))
+            except OSError:
+                logger.warning("failed to store compiled kernel in %s",
+                               self.directory, exc_info=True)
@@ -1,4 +1,12 @@
 import os
+import sys
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from collections import OrderedDict
+
+import numpy
 
 from artiq.language.core import *
 from artiq.language.units import ns
@@ -12,12 +20,18 @@ from artiq.transforms.unroll_loops import unroll_loops
 from artiq.transforms.interleave import interleave
 from artiq.transforms.lower_time import lower_time
 from artiq.transforms.unparse import unparse
+from artiq.transforms.tools import count_all_nodes
 
 from artiq.coredevice.runtime import Runtime
+from artiq.coredevice.compile_cache import CompileCache
+from artiq.coredevice.rpc_wrapper import RPCMetrics
 
 from artiq.py2llvm import get_runtime_binary
 
 
+logger = logging.getLogger(__name__)
+
+
 def _announce_unparse(label, node):
     print("*** Unparsing: "+label)
     print(unparse(node))
@@ -45,6 +59,147 @@ def _no_debug_unparse(label, node):
     pass
 
 
+# Passes run until a fixed point is reached after lower_time. They return
+# True when they have changed the tree.
+_simplification_passes = [
+    ("remove_inter_assigns", remove_inter_assigns),
+    ("fold_constants", fold_constants),
+    ("remove_dead_code", remove_dead_code)
+]
+# Passes to run again when a pass has changed the tree. fold_constants folds
+# bottom-up, so running it again immediately would not change anything, and
+# removing dead code does not create new constant expressions.
+_simplification_reruns = {
+    "remove_inter_assigns": ["remove_inter_assigns", "fold_constants",
+                             "remove_dead_code"],
+    "fold_constants": ["remove_inter_assigns", "remove_dead_code"],
+    "remove_dead_code": ["remove_inter_assigns", "remove_dead_code"]
+}
+_max_simplification_runs = 60
+
+
+def _log_compile_stats(name, stats):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug("kernel %s: inlined %d functions, %d from the parse "
+                 "cache, saving %.1fms", name,
+                 stats["parse_cache_hits"] + stats["parse_cache_misses"],
+                 stats["parse_cache_hits"], stats["parse_time_saved"]*1e3)
+    if stats["cache_hit"]:
+        logger.debug("kernel %s: compile cache hit, inline %.1fms, "
+                     "%d bytes", name, stats["inline_time"]*1e3,
+                     stats["object_size"])
+        return
+    for pass_stats in stats["passes"]:
+        if "nodes_before" in pass_stats:
+            logger.debug("kernel %s: %s %.1fms, %d -> %d nodes", name,
+                         pass_stats["name"], pass_stats["time"]*1e3,
+                         pass_stats["nodes_before"], pass_stats["nodes_after"])
+        else:
+            logger.debug("kernel %s: %s %.1fms", name,
+                         pass_stats["name"], pass_stats["time"]*1e3)
+    logger.debug("kernel %s: inline %.1fms, transforms %.1fms, "
+                 "codegen %.1fms, LLVM optimization %.1fms, emit %.1fms, "
+                 "total %.1fms, %d bytes", name,
+                 stats["inline_time"]*1e3,
+                 sum(p["time"] for p in stats["passes"])*1e3,
+                 stats["codegen_time"]*1e3, stats["opt_time"]*1e3,
+                 stats["emit_time"]*1e3, stats["total_time"]*1e3,
+                 stats["object_size"])
+
+
+def _transform_stack(func_def, ref_period, debug_unparse=_no_debug_unparse,
+                     stats=None, count_nodes=False):
+    count_nodes = stats is not None and count_nodes
+    if count_nodes:
+        node_count = count_all_nodes(func_def)
+
+    def run_pass(label, transform):
+        nonlocal node_count
+        t0 = time.monotonic()
+        changed = transform(func_def)
+        t = time.monotonic() - t0
+        debug_unparse(label, func_def)
+        if stats is not None:
+            pass_stats = {"name": label, "time": t}
+            if changed is not None:
+                pass_stats["changed"] = changed
+            if count_nodes:
+                pass_stats["nodes_before"] = node_count
+                node_count = count_all_nodes(func_def)
+                pass_stats["nodes_after"] = node_count
+            stats.append(pass_stats)
+        return changed
+
+    run_pass("remove_inter_assigns_1", remove_inter_assigns)
+    run_pass("quantize_time", partial(quantize_time, ref_period=ref_period))
+    run_pass("fold_constants_1", fold_constants)
+    run_pass("unroll_loops", unroll_loops)
+    run_pass("interleave", interleave)
+    run_pass("lower_time", lower_time)
+
+    # Run the simplification passes until none of them changes the tree.
+    # Each pass that changes the tree schedules again the passes that may
+    # then find something to simplify.
+    passes = OrderedDict(_simplification_passes)
+    # numbering of the ARTIQ_UNPARSE labels continues from above
+    runs = {"remove_inter_assigns": 1, "fold_constants": 1,
+            "remove_dead_code": 0}
+    worklist = list(passes.keys())
+    total_runs = 0
+    while worklist:
+        if total_runs == _max_simplification_runs:
+            logger.warning("simplification passes did not converge "
+                           "after %d runs", total_runs)
+            break
+        name = worklist.pop(0)
+        runs[name] += 1
+        total_runs += 1
+        if run_pass("{}_{}".format(name, runs[name]), passes[name]):
+            for other in _simplification_reruns[name]:
+                if other not in worklist:
+                    worklist.append(other)
+    debug_unparse("simplified", func_def)
+
+
+_compile_process_initialized = False
+
+
+def _init_compile_process():
+    # The processes of Core.precompile are forked from the experiment
+    # worker, whose standard output and logging handlers forward to the
+    # master over the IPC pipe, which only the worker may use. Send all
+    # output to the standard error instead.
+    # (ProcessPoolExecutor has no initializer argument before Python 3.7.)
+    global _compile_process_initialized
+    if _compile_process_initialized:
+        return
+    _compile_process_initialized = True
+
+    os.dup2(sys.__stderr__.fileno(), sys.__stdout__.fileno())
+    sys.stdout = sys.stderr = sys.__stderr__
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.StreamHandler(sys.__stderr__))
+
+
+def _compile_inlined(func_def, ref_period, runtime_class, count_nodes):
+    stats = {"passes": []}
+    t0 = time.monotonic()
+    _transform_stack(func_def, ref_period, stats=stats["passes"],
+                     count_nodes=count_nodes)
+    binary = get_runtime_binary(runtime_class(), func_def, stats)
+    stats["total_time"] = time.monotonic() - t0
+    return binary, stats
+
+
+def _compile_in_process(func_def, ref_period, runtime_class, count_nodes):
+    # Executed in the processes of Core.precompile.
+    _init_compile_process()
+    return _compile_inlined(func_def, ref_period, runtime_class, count_nodes)
+
+
 class Core:
     """Core device driver.
 
@@ -57,79 +212,243 @@ class Core:
     :param external_clock: whether the core device should switch to its
         external RTIO clock input instead of using its internal oscillator.
     :param comm_device: name of the device used for communications.
+    :param compile_cache_dir: directory where compiled kernels are stored
+        so that they can be reused by later experiments. Compiled kernels are
+        always cached in memory during the lifetime of the driver.
+    :param rpc_latency_budget: if not None, a warning is logged when the
+        time spent on the host to serve an RPC exceeds this duration (in
+        seconds). This helps finding the RPCs that cause underflows.
+
+    After each kernel run, the ``rpc_metrics`` attribute contains the
+    statistics of its RPCs, as a
+    :class:`artiq.coredevice.rpc_wrapper.RPCMetrics` object. The statistics
+    of all the kernels run by the driver are stored in the results of the
+    experiment.
     """
-    def __init__(self, dmgr, ref_period=8*ns, external_clock=False, comm_device="comm"):
+    def __init__(self, dmgr, ref_period=8*ns, external_clock=False,
+                 comm_device="comm", compile_cache_dir=None,
+                 rpc_latency_budget=None):
         self.ref_period = ref_period
         self.external_clock = external_clock
         self.comm = dmgr.get(comm_device)
+        self.rpc_latency_budget = rpc_latency_budget
+        self.rpc_metrics = None
+        # (kernel, host function) -> totals of the RPCMetrics entries
+        self._rpc_metrics_totals = OrderedDict()
 
         self.first_run = True
         self.core = self
         self.comm.core = self
-        self.runtime = Runtime()
+        # Communication devices that execute kernels elsewhere than on the
+        # core device CPU (e.g. comm_jit) define the matching runtime.
+        self.runtime = getattr(self.comm, "runtime_class", Runtime)()
+        self.compile_cache = CompileCache(compile_cache_dir)
+        # process pool of precompile, and its max_workers
+        self._compile_pool = None
+        self._compile_pool_workers = None
+
+    def close(self):
+        if self._compile_pool is not None:
+            self._compile_pool.shutdown()
+            self._compile_pool = None
+
+    def _get_compile_pool(self, max_workers):
+        if (self._compile_pool is not None
+                and self._compile_pool_workers != max_workers):
+            self.close()
+        if self._compile_pool is None:
+            self._compile_pool = ProcessPoolExecutor(max_workers)
+            self._compile_pool_workers = max_workers
+        return self._compile_pool
 
     def transform_stack(self, func_def, rpc_map, exception_map,
-                        debug_unparse=_no_debug_unparse):
-        remove_inter_assigns(func_def)
-        debug_unparse("remove_inter_assigns_1", func_def)
-
-        quantize_time(func_def, self.ref_period)
-        debug_unparse("quantize_time", func_def)
-
-        fold_constants(func_def)
-        debug_unparse("fold_constants_1", func_def)
-
-        unroll_loops(func_def, 500)
-        debug_unparse("unroll_loops", func_def)
-
-        interleave(func_def)
-        debug_unparse("interleave", func_def)
-
-        lower_time(func_def)
-        debug_unparse("lower_time", func_def)
-
-        remove_inter_assigns(func_def)
-        debug_unparse("remove_inter_assigns_2", func_def)
-
-        fold_constants(func_def)
-        debug_unparse("fold_constants_2", func_def)
-
-        remove_dead_code(func_def)
-        debug_unparse("remove_dead_code_1", func_def)
-
-        remove_inter_assigns(func_def)
-        debug_unparse("remove_inter_assigns_3", func_def)
-
-        fold_constants(func_def)
-        debug_unparse("fold_constants_3", func_def)
-
-        remove_dead_code(func_def)
-        debug_unparse("remove_dead_code_2", func_def)
-
-    def compile(self, k_function, k_args, k_kwargs, with_attr_writeback=True):
-        debug_unparse = _make_debug_unparse("remove_dead_code_2")
-
+                        debug_unparse=_no_debug_unparse, stats=None,
+                        count_nodes=False):
+        _transform_stack(func_def, self.ref_period, debug_unparse, stats,
+                         count_nodes)
+
+    def compile(self, k_function, k_args, k_kwargs, with_attr_writeback=True,
+                count_nodes=False):
+        """Compiles a kernel.
+
+        Returns a tuple ``(binary, rpc_map, exception_map, stats)``.
+        ``stats`` is a dictionary describing the cost of the compilation:
+        the duration of inlining (``inline_time``) and of each transform
+        (``passes``), the number of inlined functions whose source was
+        found in the parse cache or not (``parse_cache_hits``,
+        ``parse_cache_misses``) and the time saved by this cache
+        (``parse_time_saved``), LLVM code generation, optimization and
+        object emission times (``codegen_time``, ``opt_time``,
+        ``emit_time``), the size of the object (``object_size``), whether the object was found in the
+        compile cache (``cache_hit``) and the total duration
+        (``total_time``). If ``count_nodes`` is set, the AST node counts
+        before and after each transform are also recorded
+        (``nodes_before``, ``nodes_after``), which takes additional time.
+        The statistics are also logged at the debug level.
+        """
+        debug_unparse = _make_debug_unparse("simplified")
+        stats = {"passes": []}
+
+        t0 = time.monotonic()
         func_def, rpc_map, exception_map = inline(
-            self, k_function, k_args, k_kwargs, with_attr_writeback)
+            self, k_function, k_args, k_kwargs, with_attr_writeback, stats)
+        stats["inline_time"] = time.monotonic() - t0
         debug_unparse("inline", func_def)
-        self.transform_stack(func_def, rpc_map, exception_map, debug_unparse)
 
-        binary = get_runtime_binary(self.runtime, func_def)
-
-        return binary, rpc_map, exception_map
+        # The inlined AST determines the binary; the RPC and exception maps
+        # refer to the current host objects and are always taken from
+        # inline(). Bypass the cache when the compiler is being debugged.
+        if "ARTIQ_UNPARSE" in os.environ or "ARTIQ_DUMP_OBJECT" in os.environ:
+            key = None
+            binary = None
+        else:
+            key = self.compile_cache.key(func_def, self.ref_period,
+                                         self.runtime)
+            binary = self.compile_cache.get(key)
+        stats["cache_hit"] = binary is not None
+        if binary is None:
+            self.transform_stack(func_def, rpc_map, exception_map,
+                                 debug_unparse, stats["passes"], count_nodes)
+            binary = get_runtime_binary(self.runtime, func_def, stats)
+            if key is not None:
+                self.compile_cache.put(key, binary)
+        stats["object_size"] = len(binary)
+        stats["total_time"] = time.monotonic() - t0
+
+        _log_compile_stats(k_function.__name__, stats)
+        return binary, rpc_map, exception_map, stats
+
+    def precompile(self, kernels, max_workers=None, count_nodes=False):
+        """Compiles several kernels concurrently and stores them in the
+        compile cache, so that running them later does not incur the
+        compilation latency. This is typically called from the ``prepare``
+        stage of an experiment, which the scheduler executes while the
+        previous experiment is still running.
+
+        Each element of ``kernels`` is either a bound kernel method, or a
+        tuple ``(method, args)`` or ``(method, args, kwargs)`` giving the
+        arguments it will be called with. The kernels are inlined in this
+        process using the current values of the host object attributes;
+        if those values change before the kernel is run, it is compiled
+        again.
+
+        The transforms and LLVM compilation run in a pool of
+        ``max_workers`` processes (by default, one per CPU), which is kept
+        for the next calls until ``close`` is called.
+
+        Returns the list of the compile statistics of the kernels, in the
+        format of ``compile`` (with the same ``count_nodes`` option).
+        """
+        if "ARTIQ_UNPARSE" in os.environ or "ARTIQ_DUMP_OBJECT" in os.environ:
+            logger.debug("compiler is being debugged, not precompiling")
+            return []
+
+        all_stats = []
+        pending = OrderedDict()
+        for kernel in kernels:
+            if isinstance(kernel, tuple):
+                method, args, kwargs = (kernel + (dict(), ))[:3]
+            else:
+                method, args, kwargs = kernel, (), dict()
+            k_function_info = getattr(method, "k_function_info", None)
+            if k_function_info is None or not k_function_info.core_name:
+                raise ValueError("{!r} is not a kernel".format(method))
+            exp = method.__self__
+            if getattr(exp, k_function_info.core_name) is not self:
+                raise ValueError("kernel {} does not run on this core device"
+                                 .format(method.__name__))
+
+            stats = {"passes": []}
+            t0 = time.monotonic()
+            func_def, rpc_map, exception_map = inline(
+                self, k_function_info.k_function, (exp,) + tuple(args),
+                kwargs, True, stats)
+            stats["inline_time"] = time.monotonic() - t0
+            key = self.compile_cache.key(func_def, self.ref_period,
+                                         self.runtime)
+            binary = self.compile_cache.get(key)
+            stats["cache_hit"] = binary is not None
+            if binary is None:
+                pending.setdefault(key, (func_def, []))[1].append(stats)
+            else:
+                stats["object_size"] = len(binary)
+                stats["total_time"] = stats["inline_time"]
+            all_stats.append(stats)
+
+        if len(pending) > 1 and max_workers != 1:
+            executor = self._get_compile_pool(max_workers)
+            futures = [(key, executor.submit(_compile_in_process, func_def,
+                                             self.ref_period,
+                                             type(self.runtime),
+                                             count_nodes))
+                       for key, (func_def, _) in pending.items()]
+            results = [(key, future.result()) for key, future in futures]
+        else:
+            results = [(key, _compile_inlined(func_def, self.ref_period,
+                                              type(self.runtime),
+                                              count_nodes))
+                       for key, (func_def, _) in pending.items()]
+
+        for key, (binary, compile_stats) in results:
+            self.compile_cache.put(key, binary)
+            for stats in pending[key][1]:
+                inline_time = stats["inline_time"]
+                stats.update(compile_stats)
+                stats["object_size"] = len(binary)
+                stats["total_time"] += inline_time
+        return all_stats
 
     def run(self, k_function, k_args, k_kwargs):
         if self.first_run:
             self.comm.check_ident()
             self.comm.switch_clock(self.external_clock)
 
-        binary, rpc_map, exception_map = self.compile(
+        binary, rpc_map, exception_map, _ = self.compile(
             k_function, k_args, k_kwargs)
         self.comm.load(binary)
         self.comm.run(k_function.__name__)
-        self.comm.serve(rpc_map, exception_map)
+        self.rpc_metrics = RPCMetrics(self.rpc_latency_budget)
+        try:
+            self.comm.serve(rpc_map, exception_map, self.rpc_metrics)
+        finally:
+            self._add_rpc_metrics(k_function.__qualname__, self.rpc_metrics)
         self.first_run = False
 
+    def _add_rpc_metrics(self, kernel, metrics):
+        for entry in metrics.entries.values():
+            key = (kernel, entry["function"])
+            try:
+                totals = self._rpc_metrics_totals[key]
+            except KeyError:
+                self._rpc_metrics_totals[key] = dict(entry)
+            else:
+                for k, v in entry.items():
+                    if k == "max_round_trip_time":
+                        totals[k] = max(totals[k], v)
+                    elif k != "function":
+                        totals[k] += v
+
+    def write_hdf5(self, group):
+        """Stores the RPC statistics of all the kernels run by the driver
+        into the ``rpc_metrics`` dataset of a HDF5 group, with one row per
+        kernel and host function."""
+        fields = ["count", "bytes", "host_time", "round_trip_time",
+                  "max_round_trip_time", "over_budget"]
+        rows = [(kernel.encode(), function.encode())
+                + tuple(totals[field] for field in fields)
+                for (kernel, function), totals
+                in self._rpc_metrics_totals.items()]
+        name_size = max([len(name) for row in rows for name in row[:2]],
+                        default=1)
+        dtype = [("kernel", "S{}".format(name_size)),
+                 ("function", "S{}".format(name_size)),
+                 ("count", numpy.int64), ("bytes", numpy.int64),
+                 ("host_time", numpy.float64),
+                 ("round_trip_time", numpy.float64),
+                 ("max_round_trip_time", numpy.float64),
+                 ("over_budget", numpy.int64)]
+        group["rpc_metrics"] = numpy.array(rows, dtype)
+
     @kernel
     def get_rtio_counter_mu(self):
         """Return the current value of the hardware RTIO counter."""
@@ -1,3 +1,5 @@
+import numpy
+
 from artiq.language.core import *
 from artiq.language.units import *
 
@@ -45,6 +47,64 @@ class DDSBus:
         on the bus."""
         syscall("dds_batch_exit")
 
+    @kernel
+    def set_many_mu(self, channels, ftws, pows, amplitudes,
+                    phase_mode=PHASE_MODE_CONTINUOUS):
+        """Sets several DDS channels of the bus with one system call, e.g.
+        with the lists of a ``DDSTable``.
+
+        The arguments are lists of integers of the same length, in machine
+        units (see ``_DDSGeneric.set_mu``), except ``phase_mode`` which
+        applies to all the channels. Each channel may appear only once.
+        The new settings take effect at the current time position.
+
+        Compared to calling ``set_mu`` for each channel in a batch, the
+        configuration register is only written for the channels whose
+        phase mode changes, and when the channels are selected one-hot, a
+        single frequency update pulse is issued for all of them (see
+        ``programming_cost``). Cannot be used inside a batch.
+        """
+        syscall("dds_set_many", now_mu(), channels, ftws, pows, phase_mode,
+                amplitudes)
+
+
+def programming_cost(dds_class, n, method="set", onehot_sel=False,
+                     phase_mode_changes=0):
+    """Returns the number of system calls and of DDS bus writes the runtime
+    makes to program ``n`` channels, according to its implementation of
+    the DDS functions.
+
+    Each bus write is an RTIO event that takes 5 coarse RTIO clock cycles,
+    which sets how long before the update the programming starts (and
+    must be covered by slack).
+
+    :param dds_class: ``AD9858`` or ``AD9914``.
+    :param method: ``"set"`` for one call to ``set``/``set_mu`` per channel
+        (a batch adds two system calls), ``"set_many"`` for one call to
+        ``DDSBus.set_many_mu``.
+    :param onehot_sel: whether the gateware selects the channels one-hot
+        (``DDS_ONEHOT_SEL``).
+    :param phase_mode_changes: for ``set_many``, number of channels whose
+        phase mode changes (which is unknown after ``init``).
+    :returns: ``(syscalls, writes)``.
+    """
+    # channel selection, frequency/phase/amplitude and frequency update
+    writes_per_channel = 1 + dds_class.program_writes + 1
+    if method == "set":
+        return n, n*writes_per_channel
+    elif method == "set_many":
+        if not n:
+            return 1, 0
+        writes = n*(writes_per_channel - 1) - (n - phase_mode_changes)
+        if onehot_sel:
+            # selection of all the channels, and a single update
+            writes += 2
+        else:
+            writes += n
+        return 1, writes
+    else:
+        raise ValueError("Unknown programming method: " + method)
+
 
 class _DDSGeneric:
     """Core device Direct Digital Synthesis (DDS) driver.
@@ -100,6 +160,27 @@ class _DDSGeneric:
            factor."""
         return round(amplitude*0x0fff)
 
+    def frequency_to_ftw_array(self, frequencies):
+        """Vectorized version of ``frequency_to_ftw`` for host code.
+
+        Returns a numpy array of 32-bit signed integers, the type with
+        which the tuning words are passed to the runtime (tuning words of
+        frequencies above half the system frequency wrap around)."""
+        ftw = numpy.rint(2**32*numpy.asarray(frequencies)/self.sysclk)
+        return ftw.astype(numpy.int64).astype(numpy.int32)
+
+    def turns_to_pow_array(self, turns):
+        """Vectorized version of ``turns_to_pow`` for host code. Returns a
+        numpy array of 32-bit integers."""
+        pow = numpy.rint(numpy.asarray(turns)*2**self.pow_width)
+        return pow.astype(numpy.int32)
+
+    def amplitude_to_asf_array(self, amplitudes):
+        """Vectorized version of ``amplitude_to_asf`` for host code. Returns
+        a numpy array of 32-bit integers."""
+        asf = numpy.rint(numpy.asarray(amplitudes)*0x0fff)
+        return asf.astype(numpy.int32)
+
     @kernel
     def init(self):
         """Resets and initializes the DDS channel.
@@ -160,9 +241,49 @@ class AD9858(_DDSGeneric):
     """Driver for AD9858 DDS chips. See ``_DDSGeneric`` for a description
     of the functionality."""
     pow_width = 14
+    # bus writes for frequency, configuration and phase (8-bit bus)
+    program_writes = 7
 
 
 class AD9914(_DDSGeneric):
     """Driver for AD9914 DDS chips. See ``_DDSGeneric`` for a description
     of the functionality."""
     pow_width = 16
+    # bus writes for frequency, configuration, phase and amplitude
+    # (16-bit bus)
+    program_writes = 5
+
+
+class DDSTable:
+    """Precomputed table of DDS settings, e.g. the points of a frequency
+    sweep.
+
+    The settings are converted to machine units on the host when the table
+    is created, and are embedded in the kernels that use the table, so that
+    ``set`` only indexes lists.
+
+    :param dds: DDS driver (``AD9858`` or ``AD9914``).
+    :param frequencies: sequence of frequencies.
+    :param phases: sequence of phase offsets in turns, or a single value
+        used for all the entries.
+    :param amplitudes: sequence of amplitudes, or a single value used for
+        all the entries.
+    """
+    def __init__(self, dds, frequencies, phases=0.0, amplitudes=1.0):
+        self.core = dds.core
+        self.dds = dds
+        n = len(frequencies)
+        self.ftw = dds.frequency_to_ftw_array(frequencies).tolist()
+        self.pow = dds.turns_to_pow_array(
+            numpy.broadcast_to(phases, (n, ))).tolist()
+        self.asf = dds.amplitude_to_asf_array(
+            numpy.broadcast_to(amplitudes, (n, ))).tolist()
+
+    def __len__(self):
+        return len(self.ftw)
+
+    @kernel
+    def set(self, i, phase_mode=_PHASE_MODE_DEFAULT):
+        """Sets the DDS channel to the settings of entry ``i`` of the
+        table."""
+        self.dds.set_mu(self.ftw[i], self.pow[i], phase_mode, self.asf[i])
@@ -0,0 +1,144 @@
+"""Accumulation of statistics in kernels.
+
+The values are accumulated in fixed-size lists on the core device, without
+any RPC. ``send`` transfers them to the host with a single RPC that takes
+numpy arrays (see ``numpy_rpc``), and stores them into a dataset.
+
+The state of the accumulators is kept in host attributes between kernels,
+and embedded into the kernels that use them: ``send`` must be called before
+the kernel that accumulates values returns, otherwise they are lost.
+
+The methods are portable, and can also be used on the host.
+"""
+
+import numpy
+
+from artiq.language.core import *
+
+
+class Accumulator:
+    """Accumulates the number, mean and variance of values.
+
+    The dataset is an array containing the number of values, their mean
+    and their variance.
+
+    :param environment: object whose ``set_dataset`` method stores the
+        results (e.g. the experiment).
+    :param key: name of the dataset.
+    :param broadcast: see ``HasEnvironment.set_dataset``.
+    :param persist: see ``HasEnvironment.set_dataset``.
+    :param save: see ``HasEnvironment.set_dataset``.
+    """
+    def __init__(self, environment, key,
+                 broadcast=False, persist=False, save=True):
+        self.environment = environment
+        self.key = key
+        self.dataset_options = dict(broadcast=broadcast, persist=persist,
+                                    save=save)
+        self.reset()
+
+    def reset(self):
+        """Clears the accumulated values (on the host)."""
+        # number of values, sum, sum of the squares
+        self.moments = numpy.zeros(3)
+
+    @portable
+    def add(self, value):
+        """Accumulates a value."""
+        self._add_moments(value)
+
+    @portable
+    def _add_moments(self, value):
+        x = float(value)
+        self.moments[0] += 1.0
+        self.moments[1] += x
+        self.moments[2] += x*x
+
+    @property
+    def n(self):
+        return int(self.moments[0])
+
+    @property
+    def mean(self):
+        n, total, _ = self.moments
+        return total/n if n else float("nan")
+
+    @property
+    def variance(self):
+        n, total, total_squares = self.moments
+        if not n:
+            return float("nan")
+        mean = total/n
+        return max(total_squares/n - mean*mean, 0.0)
+
+    @portable
+    def send(self):
+        """Transfers the state of the accumulator to the host and stores the
+        dataset."""
+        self._receive_moments(self.moments)
+
+    @numpy_rpc
+    def _receive_moments(self, moments):
+        self.moments = moments
+        self.environment.set_dataset(
+            self.key, numpy.array([self.n, self.mean, self.variance]),
+            **self.dataset_options)
+
+
+class Histogram(Accumulator):
+    """Histogram of integer values (e.g. photon counts or timestamps in
+    machine units), with the moments of an ``Accumulator``.
+
+    Bin ``i`` counts the values ``v`` that verify
+    ``lower + i*bin_width <= v < lower + (i+1)*bin_width``. The dataset is
+    the array of the counts of the bins.
+
+    :param nbins: number of bins.
+    :param lower: lower limit of the first bin.
+    :param bin_width: width of the bins.
+    :param clamp: if True, the values below the first bin are counted in
+        the first bin, and the values above the last bin in the last bin.
+        Otherwise, they are only taken into account in the moments.
+
+    See ``Accumulator`` for the other parameters.
+    """
+    def __init__(self, environment, key, nbins, lower=0, bin_width=1,
+                 clamp=False, **kwargs):
+        if nbins < 1 or bin_width < 1:
+            raise ValueError("Histograms must have at least one bin of "
+                             "positive width")
+        self.nbins = nbins
+        self.lower = lower
+        self.bin_width = bin_width
+        self.clamp = clamp
+        Accumulator.__init__(self, environment, key, **kwargs)
+
+    def reset(self):
+        Accumulator.reset(self)
+        self.counts = numpy.zeros(self.nbins, numpy.int32)
+
+    @portable
+    def add(self, value):
+        """Adds a value to the histogram."""
+        self._add_moments(value)
+        if value < self.lower:
+            if self.clamp:
+                self.counts[0] += 1
+        else:
+            i = (value - self.lower)//self.bin_width
+            if i < self.nbins:
+                self.counts[i] += 1
+            elif self.clamp:
+                self.counts[self.nbins - 1] += 1
+
+    @portable
+    def send(self):
+        """Transfers the histogram to the host and stores the dataset."""
+        self._receive_histogram(self.counts, self.moments)
+
+    @numpy_rpc
+    def _receive_histogram(self, counts, moments):
+        self.counts = counts
+        self.moments = moments
+        self.environment.set_dataset(self.key, counts,
+                                     **self.dataset_options)
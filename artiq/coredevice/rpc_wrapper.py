@@ -1,6 +1,14 @@
+import threading
+import queue
+import logging
+import time
+
 from artiq.coredevice.runtime_exceptions import exception_map, _RPCException
 
 
+logger = logging.getLogger(__name__)
+
+
 def _lookup_exception(d, e):
     for eid, exception in d.items():
         if isinstance(e, exception):
@@ -8,15 +16,84 @@ def _lookup_exception(d, e):
     return 0
 
 
+class RPCMetrics:
+    """Statistics of the RPCs made by a kernel, per RPC number.
+
+    ``entries`` maps RPC numbers to dictionaries with the keys:
+
+    * ``function``: name of the host function.
+    * ``count``: number of calls.
+    * ``bytes``: total size of the requests (RPC number and arguments).
+    * ``host_time``: total execution time of the host function, in seconds.
+    * ``round_trip_time`` and ``max_round_trip_time``: total and maximum
+      time between the reception of a request and the transmission of the
+      reply, in seconds. This is the part of the RPC latency seen by the
+      kernel that is spent on the host. Asynchronous RPCs have no reply, and
+      these values stay at 0.
+    * ``over_budget``: number of calls whose round-trip time exceeded the
+      latency budget.
+
+    :param latency_budget: if not None, a warning is logged the first time
+        the round-trip time of each RPC exceeds this duration (in seconds).
+    """
+    def __init__(self, latency_budget=None):
+        self.latency_budget = latency_budget
+        self.entries = dict()
+
+    def _entry(self, rpc_num, fn):
+        try:
+            return self.entries[rpc_num]
+        except KeyError:
+            entry = {
+                "function": getattr(fn, "__qualname__", repr(fn)),
+                "count": 0,
+                "bytes": 0,
+                "host_time": 0.0,
+                "round_trip_time": 0.0,
+                "max_round_trip_time": 0.0,
+                "over_budget": 0
+            }
+            self.entries[rpc_num] = entry
+            return entry
+
+    def record(self, rpc_num, fn, nbytes, host_time=0.0,
+               round_trip_time=0.0):
+        entry = self._entry(rpc_num, fn)
+        entry["count"] += 1
+        entry["bytes"] += nbytes
+        entry["host_time"] += host_time
+        entry["round_trip_time"] += round_trip_time
+        entry["max_round_trip_time"] = max(entry["max_round_trip_time"],
+                                           round_trip_time)
+        if (self.latency_budget is not None
+                and round_trip_time > self.latency_budget):
+            if not entry["over_budget"]:
+                logger.warning("RPC to %s took %.3fms, which exceeds the "
+                               "latency budget of %.3fms",
+                               entry["function"], round_trip_time*1e3,
+                               self.latency_budget*1e3)
+            entry["over_budget"] += 1
+
+    def record_host_time(self, rpc_num, fn, host_time):
+        self._entry(rpc_num, fn)["host_time"] += host_time
+
+
 class RPCWrapper:
-    def __init__(self):
+    def __init__(self, metrics=None):
+        self.metrics = metrics
         self.last_exception = None
+        self._async_queue = None
+        self._async_thread = None
+        self._async_exception = None
 
     def run_rpc(self, user_exception_map, fn, args):
         eid = 0
         r = None
 
         try:
+            # asynchronous RPCs made before this one are executed first,
+            # and report their exceptions to the kernel through this one
+            self.wait_async_rpcs()
             r = fn(*args)
         except Exception as e:
             eid = _lookup_exception(user_exception_map, e)
@@ -38,3 +115,56 @@ class RPCWrapper:
     def filter_rpc_exception(self, eid):
         if eid == _RPCException.eid:
             raise self.last_exception
+
+    def _async_worker(self):
+        while True:
+            rpcs = self._async_queue.get()
+            try:
+                if rpcs is None:
+                    return
+                for rpc_num, fn, args in rpcs:
+                    # after an exception, the remaining RPCs are dropped
+                    # until it has been reported
+                    if self._async_exception is not None:
+                        break
+                    t0 = time.monotonic()
+                    try:
+                        fn(*args)
+                    except Exception as e:
+                        self._async_exception = e
+                    if self.metrics is not None:
+                        self.metrics.record_host_time(
+                            rpc_num, fn, time.monotonic() - t0)
+            finally:
+                self._async_queue.task_done()
+
+    def run_async_rpcs(self, rpcs):
+        """Queues a list of ``(rpc_num, function, arguments)`` tuples for
+        execution in the background thread."""
+        if self._async_thread is None:
+            self._async_queue = queue.Queue()
+            self._async_thread = threading.Thread(target=self._async_worker,
+                                                  daemon=True)
+            self._async_thread.start()
+        self._async_queue.put(rpcs)
+
+    def wait_async_rpcs(self):
+        """Waits until all the queued asynchronous RPCs have been executed,
+        and raises the first exception they raised, if any."""
+        if self._async_thread is not None:
+            self._async_queue.join()
+            if self._async_exception is not None:
+                e, self._async_exception = self._async_exception, None
+                raise e
+
+    def close(self):
+        """Waits for the queued asynchronous RPCs and stops the background
+        thread. Exceptions that have not been reported are logged."""
+        if self._async_thread is not None:
+            self._async_queue.put(None)
+            self._async_thread.join()
+            self._async_thread = None
+            if self._async_exception is not None:
+                logger.error("asynchronous RPC failed",
+                             exc_info=self._async_exception)
+                self._async_exception = None
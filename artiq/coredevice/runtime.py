@@ -21,12 +21,18 @@ _syscalls = {
     "ttl_set_oe": "Iib:n",
     "ttl_set_sensitivity": "Iii:n",
     "ttl_get": "iI:I",
+    "ttl_count": "iI:i",
+    "ttl_get_many": "iIIl:i",
+    "ttl_histogram": "iIIil:i",
     "ttl_clock_set": "Iii:n",
     "dds_init": "Ii:n",
     "dds_batch_enter": "I:n",
     "dds_batch_exit": "n:n",
     "dds_set": "Iiiiii:n",
+    "dds_set_many": "Illlil:n",
 }
+# In the syscall type strings, "l" is a list of 32-bit integers, passed as
+# a pointer to its length followed by its elements.
 
 
 def _chr_to_type(c):
@@ -38,6 +44,8 @@ def _chr_to_type(c):
         return ll.IntType(32)
     if c == "I":
         return ll.IntType(64)
+    if c == "l":
+        return ll.PointerType(ll.IntType(32))
     raise ValueError
 
 
@@ -89,6 +97,10 @@ class LinkInterface:
         func_type = ll.FunctionType(ll.IntType(32), [ll.IntType(32)],
                                     var_arg=1)
         self.rpc = ll.Function(llvm_module, func_type, "__syscall_rpc")
+        func_type = ll.FunctionType(ll.VoidType(), [ll.IntType(32)],
+                                    var_arg=1)
+        self.rpc_async = ll.Function(llvm_module, func_type,
+                                     "__syscall_rpc_async")
 
         # syscalls
         self.syscalls = dict()
@@ -118,8 +130,11 @@ class LinkInterface:
         self.eh_raise = ll.Function(llvm_module, func_type, "__eh_raise")
         self.eh_raise.attributes.add("noreturn")
 
-    def _build_rpc(self, args, builder):
-        r = base_types.VInt()
+    def _build_rpc(self, args, builder, asynchronous=False):
+        if asynchronous:
+            r = base_types.VNone()
+        else:
+            r = base_types.VInt()
         if builder is not None:
             new_args = []
             new_args.append(args[0].auto_load(builder))  # RPC number
@@ -143,13 +158,37 @@ class LinkInterface:
                         new_args.append(arg_ptr.llvm_value)
             # end marker
             new_args.append(ll.Constant(ll.IntType(32), 0))
-            r.auto_store(builder, builder.call(self.rpc, new_args))
+            if asynchronous:
+                builder.call(self.rpc_async, new_args)
+            else:
+                r.auto_store(builder, builder.call(self.rpc, new_args))
         return r
 
+    def _build_syscall_arg(self, arg, arg_type, builder):
+        if arg_type != "l":
+            return arg.auto_load(builder)
+        if isinstance(arg.llvm_value.type, ll.PointerType):
+            arg_ptr = arg.llvm_value
+        else:
+            arg_ptr = arg.new()
+            arg_ptr.alloca(builder)
+            arg_ptr.auto_store(builder, arg.llvm_value)
+            arg_ptr = arg_ptr.llvm_value
+        return builder.bitcast(arg_ptr, ll.PointerType(ll.IntType(32)))
+
     def _build_regular_syscall(self, syscall_name, args, builder):
         r = _chr_to_value(_syscalls[syscall_name][-1])
         if builder is not None:
-            args = [arg.auto_load(builder) for arg in args]
+            arg_types = _syscalls[syscall_name][:-2]
+            for arg, arg_type in zip(args, arg_types):
+                if arg_type == "l" and not (
+                        isinstance(arg, lists.VList)
+                        and isinstance(arg.el_type, base_types.VInt)
+                        and arg.el_type.nbits == 32):
+                    raise TypeError("Argument of {} must be a list of "
+                                    "integers".format(syscall_name))
+            args = [self._build_syscall_arg(arg, arg_type, builder)
+                    for arg, arg_type in zip(args, arg_types)]
             r.auto_store(builder, builder.call(self.syscalls[syscall_name],
                                                args))
         return r
@@ -157,6 +196,8 @@ class LinkInterface:
     def build_syscall(self, syscall_name, args, builder):
         if syscall_name == "rpc":
             return self._build_rpc(args, builder)
+        elif syscall_name == "rpc_async":
+            return self._build_rpc(args, builder, asynchronous=True)
         else:
             return self._build_regular_syscall(syscall_name, args, builder)
 
@@ -74,7 +74,8 @@ class RTIOOverflow(RuntimeException):
 
 class DDSBatchError(RuntimeException):
     """Raised when attempting to start a DDS batch while already in a batch,
-    or when too many commands are batched.
+    when too many commands are batched, or when the lists given to
+    ``DDSBus.set_many_mu`` have different lengths or list a channel twice.
     """
     eid = 7
 
@@ -1,3 +1,5 @@
+import numpy
+
 from artiq.language.core import *
 
 
@@ -192,11 +194,7 @@ class TTLInOut:
     def count(self):
         """Poll the RTIO input during all the previously programmed gate
         openings, and returns the number of registered events."""
-        count = 0
-        while syscall("ttl_get", self.channel,
-                      self.i_previous_timestamp) >= 0:
-            count += 1
-        return count
+        return syscall("ttl_count", self.channel, self.i_previous_timestamp)
 
     @kernel
     def timestamp_mu(self):
@@ -207,6 +205,39 @@ class TTLInOut:
         """
         return syscall("ttl_get", self.channel, self.i_previous_timestamp)
 
+    @kernel
+    def timestamps_mu(self, offsets, reference):
+        """Poll the RTIO input during all the previously programmed gate
+        openings, and stores the timestamps of the registered events into
+        the list ``offsets``, as offsets (in machine units) from the time
+        ``reference`` (e.g. the time of the opening of the gate).
+
+        The events are read with a single system call. At most
+        ``len(offsets)`` events are read, the following ones can be read
+        by another call to this method or to ``count``.
+
+        Returns the number of events stored into ``offsets``.
+        """
+        return syscall("ttl_get_many", self.channel,
+                       self.i_previous_timestamp, reference, offsets)
+
+    @kernel
+    def histogram_mu(self, histogram, reference, bin_width):
+        """Poll the RTIO input during all the previously programmed gate
+        openings, and accumulates the times of the registered events in
+        ``histogram``, a list of integers, without storing the timestamps.
+
+        Bin ``i`` counts the events whose timestamp ``t`` verifies
+        ``reference + i*bin_width <= t < reference + (i+1)*bin_width``
+        (in machine units). Events outside of the histogram are only
+        counted in the return value.
+
+        Returns the number of registered events.
+        """
+        return syscall("ttl_histogram", self.channel,
+                       self.i_previous_timestamp, reference, bin_width,
+                       histogram)
+
 
 class TTLClockGen:
     """RTIO TTL clock generator driver.
@@ -238,6 +269,13 @@ class TTLClockGen:
         """
         return ftw/self.core.ref_period/2**self.acc_width
 
+    def frequency_to_ftw_array(self, frequencies):
+        """Vectorized version of ``frequency_to_ftw`` for host code. Returns
+        a numpy array of 32-bit integers."""
+        ftw = numpy.rint(2**self.acc_width*numpy.asarray(frequencies)
+                         *self.core.ref_period)
+        return ftw.astype(numpy.int32)
+
     @kernel
     def set_mu(self, frequency):
         """Set the frequency of the clock, in machine units.
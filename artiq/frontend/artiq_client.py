@@ -56,6 +56,10 @@ def get_argparser():
                             help="increase logging level of the experiment")
     parser_add.add_argument("-q", "--quiet", default=0, action="count",
                             help="decrease logging level of the experiment")
+    parser_add.add_argument("--profile", default=False, action="store_true",
+                            help="record the time spent in each stage of "
+                                 "the experiment, with cProfile and "
+                                 "tracemalloc data, in the results")
     parser_add.add_argument("file",
                             help="file containing the experiment to run")
     parser_add.add_argument("arguments", nargs="*",
@@ -122,6 +126,8 @@ def _action_submit(remote, args):
     }
     if args.repository:
         expid["repo_rev"] = args.revision
+    if args.profile:
+        expid["profile"] = True
     if args.timed is None:
         due_date = None
     else:
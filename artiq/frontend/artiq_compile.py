@@ -51,9 +51,9 @@ def main():
         core_name = exp.run.k_function_info.core_name
         core = getattr(exp_inst, core_name)
 
-        binary, rpc_map, _ = core.compile(exp.run.k_function_info.k_function,
-                                          [exp_inst], {},
-                                          with_attr_writeback=False)
+        binary, rpc_map, _, _ = core.compile(
+            exp.run.k_function_info.k_function, [exp_inst], {},
+            with_attr_writeback=False)
     finally:
         device_mgr.close_devices()
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
+import time
 
 from artiq.master.databases import DeviceDB
 from artiq.master.worker_db import DeviceManager
@@ -20,8 +21,14 @@ def get_argparser():
     subparsers.required = True
 
     # Log Read command
-    subparsers.add_parser("log",
-                          help="read from the core device log ring buffer")
+    p_log = subparsers.add_parser("log",
+                                  help="read from the core device log ring "
+                                       "buffer")
+    p_log.add_argument("-f", "--follow", default=False, action="store_true",
+                       help="keep printing the new log messages")
+    p_log.add_argument("--interval", default=0.5, type=float,
+                       help="polling interval in seconds when following the "
+                            "log (default: %(default)s)")
 
     # Configuration Read command
     p_read = subparsers.add_parser("cfg-read",
@@ -53,6 +60,16 @@ def get_argparser():
     # Configuration Erase command
     subparsers.add_parser("cfg-erase", help="erase core device config")
 
+    # Configuration List command
+    subparsers.add_parser("cfg-list", help="list the keys of core device "
+                                           "config")
+
+    # Configuration Upload command
+    p_upload = subparsers.add_parser("cfg-upload",
+                                     help="replace core device config with "
+                                          "an image generated by artiq_mkfs")
+    p_upload.add_argument("image", help="flash storage image file")
+
     return parser
 
 
@@ -63,7 +80,14 @@ def main():
         comm = device_mgr.get("comm")
 
         if args.action == "log":
-          print(comm.get_log())
+            if args.follow:
+                offset = None
+                while True:
+                    text, offset = comm.read_log(offset)
+                    print(text, end="", flush=True)
+                    time.sleep(args.interval)
+            else:
+                print(comm.get_log())
         elif args.action == "cfg-read":
             value = comm.flash_storage_read(args.key)
             if not value:
@@ -71,16 +95,21 @@ def main():
             else:
                 print(value)
         elif args.action == "cfg-write":
-            for key, value in args.string:
-                comm.flash_storage_write(key, value)
+            records = list(args.string)
             for key, filename in args.file:
                 with open(filename, "rb") as fi:
-                    comm.flash_storage_write(key, fi.read())
+                    records.append((key, fi.read()))
+            comm.flash_storage_write_many(records)
         elif args.action == "cfg-delete":
-            for key in args.key:
-                comm.flash_storage_remove(key)
+            comm.flash_storage_remove_many(args.key)
         elif args.action == "cfg-erase":
                 comm.flash_storage_erase()
+        elif args.action == "cfg-list":
+            for key in comm.flash_storage_list():
+                print(key.decode("latin-1"))
+        elif args.action == "cfg-upload":
+            with open(args.image, "rb") as fi:
+                comm.flash_storage_write_image(fi.read())
     finally:
         device_mgr.close_devices()
 
@@ -11,6 +11,13 @@ from artiq.protocols.logging import Server as LoggingServer
 from artiq.master.log import log_args, init_log, log_worker
 from artiq.master.databases import DeviceDB, DatasetDB
 from artiq.master.scheduler import Scheduler
+from artiq.master.shm import SharedDatasets
+from artiq.master import core_pool
+from artiq.master.metrics import (Metrics, MetricsServer,
+                                  add_publisher_metrics,
+                                  add_rpc_server_metrics,
+                                  add_scheduler_metrics,
+                                  add_dataset_db_metrics)
 from artiq.master.worker_db import get_last_rid
 from artiq.master.repository import FilesystemBackend, GitBackend, Repository
 
@@ -31,6 +38,9 @@ def get_argparser():
     group.add_argument(
         "--port-logging", default=1066, type=int,
         help="TCP port to listen to for remote logging (default: %(default)d)")
+    group.add_argument(
+        "--port-metrics", default=3257, type=int,
+        help="TCP port to serve metrics over HTTP on (default: %(default)d)")
 
     group = parser.add_argument_group("databases")
     group.add_argument("--device-db", default="device_db.pyon",
@@ -75,18 +85,35 @@ def main():
     atexit.register(repository.close)
     repository.scan_async()
 
+    shared_datasets = SharedDatasets(dataset_db)
+    atexit.register(shared_datasets.close)
+
     worker_handlers = {
         "get_device_db": device_db.get_device_db,
         "get_device": device_db.get,
         "get_dataset": dataset_db.get,
         "update_dataset": dataset_db.update,
+        "get_dataset_shm": shared_datasets.get,
+        "update_dataset_shm": shared_datasets.update,
+        "make_dataset_shm_directory": shared_datasets.make_worker_directory,
         "log": log_worker
     }
-    scheduler = Scheduler(get_last_rid() + 1, worker_handlers, repo_backend)
+    if core_pool.is_supported():
+        core_connection_pool = core_pool.CoreConnectionPool()
+        atexit.register(core_connection_pool.close)
+        worker_handlers["lend_core_connection"] = core_connection_pool.lend
+        worker_handlers["give_back_core_connection"] = \
+            core_connection_pool.give_back
+    scheduler = Scheduler(get_last_rid() + 1, worker_handlers, repo_backend,
+                          dataset_db)
     worker_handlers["scheduler_submit"] = scheduler.submit
     scheduler.start()
     atexit.register(lambda: loop.run_until_complete(scheduler.stop()))
 
+    metrics = Metrics()
+    add_scheduler_metrics(metrics, scheduler)
+    add_dataset_db_metrics(metrics, dataset_db)
+
     server_control = RPCServer({
         "master_device_db": device_db,
         "master_dataset_db": dataset_db,
@@ -96,23 +123,33 @@ def main():
     loop.run_until_complete(server_control.start(
         args.bind, args.port_control))
     atexit.register(lambda: loop.run_until_complete(server_control.stop()))
+    add_rpc_server_metrics(metrics, server_control)
 
     server_notify = Publisher({
         "schedule": scheduler.notifier,
         "devices": device_db.data,
         "datasets": dataset_db.data,
         "explist": repository.explist,
-        "log": log_buffer.data
+        "log": log_buffer.data,
+        "metrics": metrics.notifier
     })
     loop.run_until_complete(server_notify.start(
         args.bind, args.port_notify))
     atexit.register(lambda: loop.run_until_complete(server_notify.stop()))
+    add_publisher_metrics(metrics, server_notify)
 
     server_logging = LoggingServer()
     loop.run_until_complete(server_logging.start(
         args.bind, args.port_logging))
     atexit.register(lambda: loop.run_until_complete(server_logging.stop()))
 
+    metrics.start()
+    atexit.register(lambda: loop.run_until_complete(metrics.stop()))
+    server_metrics = MetricsServer(metrics)
+    loop.run_until_complete(server_metrics.start(
+        args.bind, args.port_metrics))
+    atexit.register(lambda: loop.run_until_complete(server_metrics.stop()))
+
     loop.run_forever()
 
 if __name__ == "__main__":
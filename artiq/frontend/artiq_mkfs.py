@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
 import argparse
-import struct
+
+from artiq.coredevice.comm_generic import pack_flash_record
 
 
 def get_argparser():
@@ -20,13 +21,7 @@ def get_argparser():
 
 
 def write_record(f, key, value):
-    key_size = len(key) + 1
-    value_size = len(value)
-    record_size = key_size + value_size + 4
-    f.write(struct.pack(">l", record_size))
-    f.write(key.encode())
-    f.write(b"\x00")
-    f.write(value)
+    f.write(pack_flash_record(key.encode(), value))
 
 
 def write_end_marker(f):
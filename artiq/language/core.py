@@ -7,7 +7,7 @@ from functools import wraps
 
 
 __all__ = ["int64", "round64", "TerminationRequested",
-           "kernel", "portable",
+           "kernel", "portable", "numpy_rpc", "async_rpc", "unroll",
            "set_time_manager", "set_syscall_manager", "set_watchdog_factory",
            "RuntimeException", "EncodedException"]
 
@@ -137,6 +137,61 @@ def portable(f):
     return f
 
 
+def numpy_rpc(f):
+    """This decorator marks a method or function called from kernels as
+    accepting numpy arrays as arguments.
+
+    By default, the lists sent by the kernel in RPCs are converted into
+    Python lists. With this decorator, the lists of booleans, integers and
+    floating-point numbers are passed as numpy arrays instead, which avoids
+    creating a Python object for each element of large lists.
+    """
+    f.numpy_rpc = True
+    return f
+
+
+def async_rpc(f):
+    """This decorator marks a method or function called from kernels as an
+    asynchronous RPC.
+
+    Asynchronous RPCs do not return a value to the kernel, which continues
+    its execution as soon as the arguments have been sent, without waiting
+    for the host. The host executes them in a background thread, in the
+    order they were made, before the next regular RPC and before the kernel
+    is considered finished. Exceptions raised by asynchronous RPCs are
+    reported by the next regular RPC (which then raises the exception in the
+    kernel) or when the kernel finishes.
+
+    Consecutive asynchronous RPCs are sent to the host in batches. This
+    decorator is meant for methods that receive results from kernels, e.g.
+    to store them in datasets.
+    """
+    f.async_rpc = True
+    return f
+
+
+def unroll(iterable, factor=None):
+    """Overrides the loop unrolling decision of the compiler for the ``for``
+    loop that iterates over the result of this function.
+
+    By default, the compiler decides by itself which loops to unroll: loops
+    that advance the timeline inside ``parallel`` blocks are unrolled so that
+    their events can be interleaved with the other statements of the block,
+    and other loops are unrolled only if the generated code stays small.
+
+    Usage: ``for i in unroll(range(100), 4):``
+
+    :param iterable: the iterable of the loop, whose value must be known at
+        compile time.
+    :param factor: if None, the loop is fully unrolled. If 1, the loop is not
+        unrolled. Otherwise, the body of the loop is repeated ``factor`` times
+        in each iteration (only supported for ``range`` iterables).
+
+    In the interpreter, this function simply returns ``iterable``.
+    """
+    return iterable
+
+
 class _DummyTimeManager:
     def _not_implemented(self, *args, **kwargs):
         raise NotImplementedError(
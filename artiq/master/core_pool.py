@@ -0,0 +1,233 @@
+"""Connections to the core devices kept open by the master and lent to the
+workers.
+
+Opening a connection and bringing the session to a known state (checking
+the identifier of the runtime and switching the clock) takes a significant
+time compared to short experiments. The master keeps one connection per
+core device, together with what is known about the state of its session,
+and lends it to the worker that needs it. The socket is passed to the
+worker over a UNIX domain socket (``SCM_RIGHTS``): only the address of this
+socket, and the session state, go through the PYON IPC channel.
+
+The UNIX domain socket stays open while the connection is lent, so that the
+master detects workers that terminate without giving the connection back.
+Such connections are closed, since the state of the device is unknown.
+
+The runtime of the core device only starts its idle kernel when the
+session ends, i.e. when the connection is closed. Connections that are not
+lent for ``idle_timeout`` seconds are therefore closed, so that the idle
+kernel runs while no experiment uses the core device. Experiments submitted
+back to back keep reusing the connection.
+
+This is only supported on POSIX systems.
+"""
+
+import os
+import asyncio
+import array
+import select
+import socket
+import tempfile
+import shutil
+import logging
+
+from artiq.coredevice.comm_tcp import initialize_connection
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_supported():
+    return hasattr(socket, "AF_UNIX") and hasattr(socket, "SCM_RIGHTS")
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.socket = sock
+        # session state, as returned by CommGeneric._session_state
+        self.state = None
+        # UNIX domain socket to the worker the connection is lent to
+        self.channel = None
+        # closes the connection when it has not been lent for a while
+        self.idle_timer = None
+
+
+def _readable(sock):
+    return bool(select.select([sock], [], [], 0)[0])
+
+
+class CoreConnectionPool:
+    """Worker handlers lending the connections to the core devices
+    (``lend_core_connection`` and ``give_back_core_connection``).
+
+    :param idle_timeout: time in seconds after which connections that are
+        not lent are closed.
+    """
+    def __init__(self, idle_timeout=2.0):
+        self.idle_timeout = idle_timeout
+        self._connections = dict()
+        # keys of the connections being opened
+        self._connecting = set()
+
+    def close(self):
+        for key in list(self._connections.keys()):
+            self._discard(key)
+
+    def _discard(self, key):
+        connection = self._connections.pop(key)
+        if connection.idle_timer is not None:
+            connection.idle_timer.cancel()
+        if connection.channel is not None:
+            connection.channel.close()
+        connection.socket.close()
+
+    async def lend(self, host, port, path):
+        """Sends the connection to ``host:port`` to the worker listening on
+        the UNIX domain socket ``path``, and returns ``(family, state)``.
+        Returns None if the connection is already lent or being opened.
+
+        New connections are opened in the default executor, so that the
+        event loop of the master is not blocked by slow core devices."""
+        key = host, port
+        if key in self._connecting:
+            return None
+        connection = self._connections.get(key)
+        if connection is not None and connection.channel is not None:
+            # The worker never writes to the channel, it becomes readable
+            # when the worker closes it.
+            if not _readable(connection.channel):
+                return None
+            logger.warning("worker terminated without giving back the "
+                           "connection to %s:%d", host, port)
+            self._discard(key)
+            connection = None
+        if connection is not None and _readable(connection.socket):
+            # The device closed the connection (or sent unexpected data)
+            # while it was idle.
+            logger.debug("connection to %s:%d lost", host, port)
+            self._discard(key)
+            connection = None
+        if connection is None:
+            self._connecting.add(key)
+            try:
+                sock = await asyncio.get_event_loop().run_in_executor(
+                    None, initialize_connection, host, port)
+            finally:
+                self._connecting.discard(key)
+            connection = _Connection(sock)
+            self._connections[key] = connection
+        elif connection.idle_timer is not None:
+            connection.idle_timer.cancel()
+            connection.idle_timer = None
+
+        channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            channel.connect(path)
+            fds = array.array("i", [connection.socket.fileno()])
+            channel.sendmsg([b"\x00"],
+                            [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+        except:
+            channel.close()
+            raise
+        connection.channel = channel
+        return connection.socket.family, connection.state
+
+    def give_back(self, host, port, state):
+        """Ends the loan of the connection to ``host:port``. If ``state``
+        is None, the session is in an unknown state and the connection is
+        closed."""
+        key = host, port
+        connection = self._connections[key]
+        connection.channel.close()
+        connection.channel = None
+        if state is None:
+            self._discard(key)
+        else:
+            connection.state = state
+            connection.idle_timer = asyncio.get_event_loop().call_later(
+                self.idle_timeout, self._idle_expired, key, connection)
+
+    def _idle_expired(self, key, connection):
+        if self._connections.get(key) is connection:
+            logger.debug("closing idle connection to %s:%d", *key)
+            self._discard(key)
+
+
+class _Receiver:
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="artiq_core_")
+        self.path = os.path.join(self.directory, "socket")
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.listener.bind(self.path)
+            self.listener.listen(1)
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        self.listener.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def receive(self, family):
+        channel, _ = self.listener.accept()
+        try:
+            fds = array.array("i")
+            _, ancdata, _, _ = channel.recvmsg(
+                1, socket.CMSG_LEN(fds.itemsize))
+            for level, ty, data in ancdata:
+                if level == socket.SOL_SOCKET and ty == socket.SCM_RIGHTS:
+                    fds.frombytes(data[:fds.itemsize])
+            if not fds:
+                raise IOError("No file descriptor received from master")
+        except:
+            channel.close()
+            raise
+        return socket.socket(family, socket.SOCK_STREAM, fileno=fds[0]), \
+            channel
+
+
+class BorrowedConnections:
+    """Worker side of the pool, available to the drivers as the
+    ``core_connection_pool`` virtual device.
+
+    :param lend: function calling the ``lend_core_connection`` handler.
+    :param give_back: function calling the ``give_back_core_connection``
+        handler.
+    """
+    def __init__(self, lend, give_back):
+        self._lend = lend
+        self._give_back = give_back
+        # comm -> channel
+        self._borrowers = dict()
+
+    def borrow(self, comm, host, port):
+        """Returns ``(socket, state)`` for a connection to ``host:port``,
+        or None if the connection is not available. ``comm`` must call
+        ``give_back`` before closing the socket, and have a ``close``
+        method."""
+        receiver = _Receiver()
+        try:
+            lent = self._lend(host, port, receiver.path)
+            if lent is None:
+                return None
+            family, state = lent
+            sock, channel = receiver.receive(family)
+        finally:
+            receiver.close()
+        self._borrowers[comm] = channel
+        return sock, state
+
+    def give_back(self, comm, host, port, state):
+        channel = self._borrowers.pop(comm)
+        try:
+            self._give_back(host, port, state)
+        finally:
+            channel.close()
+
+    def release_all(self):
+        """Closes the communication channels of the drivers that have
+        borrowed a connection, giving it back to the master. The drivers
+        borrow it again the next time they are used."""
+        for comm in list(self._borrowers.keys()):
+            comm.close()
@@ -1,10 +1,15 @@
 import asyncio
+import logging
+import os
 
 from artiq.protocols.sync_struct import Notifier, process_mod
 from artiq.protocols import pyon
 from artiq.tools import TaskObject
 
 
+logger = logging.getLogger(__name__)
+
+
 class DeviceDB:
     def __init__(self, backing_file):
         self.backing_file = backing_file
@@ -28,19 +33,107 @@ class DeviceDB:
 
 
 class DatasetDB(TaskObject):
-    def __init__(self, persist_file, autosave_period=30):
+    """Holds the datasets of the master and persists those marked as such.
+
+    Persistent datasets are stored in a PYON snapshot file, complemented by
+    an append-only journal (``persist_file`` + ``".journal"``). Each save only
+    appends the persistent datasets that changed since the previous save to
+    the journal, which is replayed on top of the snapshot upon startup.
+    Once the journal grows larger than the snapshot (and at least
+    ``compact_threshold`` bytes), it is merged into a new snapshot.
+
+    Journal records are top-level ``setitem``/``delitem`` mods, so replaying
+    them several times (e.g. after a crash during compaction) is harmless.
+    """
+    def __init__(self, persist_file, autosave_period=30,
+                 compact_threshold=1024*1024):
         self.persist_file = persist_file
+        self.journal_file = persist_file + ".journal"
         self.autosave_period = autosave_period
+        self.compact_threshold = compact_threshold
 
         try:
             file_data = pyon.load_file(self.persist_file)
         except FileNotFoundError:
             file_data = dict()
+        self._replay_journal(file_data)
         self.data = Notifier({k: (True, v) for k, v in file_data.items()})
 
-    def save(self):
+        # keys of persistent datasets modified since the last save
+        self._dirty = set()
+        # total number of mods applied since startup
+        self.mod_count = 0
+        # callables invoked with the key of each modified dataset
+        self.watchers = set()
+
+    def _replay_journal(self, file_data):
+        # The journal is handled in bytes: records are only separated by
+        # "\n" (escaped by pyon), while strings may contain other line
+        # separators, and sizes must match the file offsets.
+        try:
+            with open(self.journal_file, "rb") as f:
+                journal = f.read()
+        except FileNotFoundError:
+            journal = b""
+        complete = journal[:journal.rfind(b"\n") + 1]
+        if len(complete) != len(journal):
+            # Incomplete last record, e.g. the master was killed while
+            # writing it. Drop it so that new records can be appended.
+            logger.warning("dropping incomplete record at the end of "
+                           "dataset journal '%s'", self.journal_file)
+            with open(self.journal_file, "r+b") as f:
+                f.truncate(len(complete))
+        for line in complete.split(b"\n")[:-1]:
+            mod = pyon.decode(line.decode("utf-8"))
+            if mod["action"] == "setitem":
+                file_data[mod["key"]] = mod["value"]
+            elif mod["action"] == "delitem":
+                file_data.pop(mod["key"], None)
+            else:
+                raise ValueError("Unsupported action in dataset journal: "
+                                 + mod["action"])
+        self._journal_size = len(complete)
+
+    def _compact(self):
         data = {k: v[1] for k, v in self.data.read.items() if v[0]}
         pyon.store_file(self.persist_file, data)
+        # If we crash before the journal is deleted, it is simply replayed
+        # on top of the new snapshot, which yields the same data.
+        try:
+            os.remove(self.journal_file)
+        except FileNotFoundError:
+            pass
+        self._journal_size = 0
+        self._dirty.clear()
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            snapshot_size = os.path.getsize(self.persist_file)
+        except FileNotFoundError:
+            snapshot_size = 0
+        if self._journal_size > max(snapshot_size, self.compact_threshold):
+            self._compact()
+            return
+
+        lines = []
+        for key in self._dirty:
+            try:
+                persist, value = self.data.read[key]
+            except KeyError:
+                persist = False
+            if persist:
+                mod = {"action": "setitem", "key": key, "value": value}
+            else:
+                mod = {"action": "delitem", "key": key}
+            lines.append((pyon.encode(mod) + "\n").encode("utf-8"))
+        with open(self.journal_file, "ab") as f:
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+            self._journal_size = f.tell()
+        self._dirty.clear()
 
     async def _do(self):
         try:
@@ -50,16 +143,39 @@ class DatasetDB(TaskObject):
         finally:
             self.save()
 
+    def _is_persistent(self, key):
+        try:
+            return self.data.read[key][0]
+        except KeyError:
+            return False
+
+    def _track(self, key, was_persistent):
+        self.mod_count += 1
+        if was_persistent or self._is_persistent(key):
+            self._dirty.add(key)
+        for watcher in self.watchers:
+            watcher(key)
+
     def get(self, key):
         return self.data.read[key][1]
 
     def update(self, mod):
+        if mod["path"]:
+            key = mod["path"][0]
+        else:
+            key = mod["key"]
+        was_persistent = self._is_persistent(key)
         process_mod(self.data, mod)
+        self._track(key, was_persistent)
 
     # convenience functions (update() can be used instead)
     def set(self, key, value, persist=False):
+        was_persistent = self._is_persistent(key)
         self.data[key] = (persist, value)
+        self._track(key, was_persistent)
 
     def delete(self, key):
+        was_persistent = self._is_persistent(key)
         del self.data[key]
+        self._track(key, was_persistent)
     #
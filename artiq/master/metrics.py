@@ -0,0 +1,212 @@
+"""Load metrics of the master.
+
+Metrics are gathered on demand from counters maintained by the various
+master components, so that keeping track of them costs little more than a
+few additions on each operation. They are exposed as a sync_struct notifier
+(refreshed periodically) and over HTTP in the Prometheus text format.
+"""
+
+import asyncio
+import logging
+import time
+
+from artiq.protocols.sync_struct import Notifier
+from artiq.protocols.asyncio_server import AsyncioServer
+from artiq.tools import TaskObject
+
+
+logger = logging.getLogger(__name__)
+
+
+def _escape_label(value):
+    return (str(value).replace("\\", "\\\\")
+                      .replace("\"", "\\\"")
+                      .replace("\n", "\\n"))
+
+
+def _sample_name(name, labels):
+    if labels:
+        return name + "{" + ",".join(
+            "{}=\"{}\"".format(k, _escape_label(v))
+            for k, v in sorted(labels.items())) + "}"
+    else:
+        return name
+
+
+class Metrics(TaskObject):
+    """Registry of metric families.
+
+    Each family is declared with ``add_family`` together with a function
+    that returns its current samples, as a list of ``(suffix, labels,
+    value)`` tuples. The suffix is appended to the family name (e.g.
+    ``"_sum"`` and ``"_count"`` for summaries) and labels is a dictionary.
+
+    When started, the ``notifier`` attribute is refreshed every
+    ``update_period`` seconds with the flattened samples. For counters, the
+    rate of change over the last period is also published, under the name
+    of the sample with ``_rate`` appended to the family name.
+    """
+    def __init__(self, update_period=5.0):
+        self.update_period = update_period
+        self.notifier = Notifier(dict())
+        self._families = []
+        self._last_update = None
+        self._last_counters = dict()
+
+    def add_family(self, name, type, help, collect):
+        if type not in ("counter", "gauge", "summary"):
+            raise ValueError("Unsupported metric type: " + type)
+        self._families.append((name, type, help, collect))
+
+    def collect(self):
+        """Returns the list of ``(family, type, help, samples)`` of all
+        families."""
+        r = []
+        for name, type, help, collect in self._families:
+            try:
+                samples = list(collect())
+            except:
+                logger.warning("failed to collect metric %s", name,
+                               exc_info=True)
+                samples = []
+            r.append((name, type, help, samples))
+        return r
+
+    def format_prometheus(self):
+        lines = []
+        for name, type, help, samples in self.collect():
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} {}".format(name, type))
+            for suffix, labels, value in samples:
+                lines.append("{} {}".format(
+                    _sample_name(name + suffix, labels), repr(float(value))))
+        return "\n".join(lines) + "\n"
+
+    def update_notifier(self):
+        now = time.monotonic()
+        values = dict()
+        counters = dict()
+        for name, type, help, samples in self.collect():
+            for suffix, labels, value in samples:
+                values[_sample_name(name + suffix, labels)] = value
+                if type == "counter":
+                    counters[_sample_name(name + "_rate", labels)] = value
+        if self._last_update is not None:
+            dt = now - self._last_update
+            for k, v in counters.items():
+                if k in self._last_counters and dt > 0:
+                    values[k] = (v - self._last_counters[k])/dt
+        self._last_update = now
+        self._last_counters = counters
+
+        for k in list(self.notifier.read.keys()):
+            if k not in values:
+                del self.notifier[k]
+        for k, v in values.items():
+            if self.notifier.read.get(k) != v:
+                self.notifier[k] = v
+
+    async def _do(self):
+        while True:
+            self.update_notifier()
+            await asyncio.sleep(self.update_period)
+
+
+def add_publisher_metrics(metrics, publisher):
+    """Registers the subscriber counts, queue depths and amount of data sent
+    of each notifier of a ``sync_struct.Publisher``."""
+    def subscribers():
+        return [("", {"notifier": k}, len(v))
+                for k, v in publisher.get_queue_depths().items()]
+    def queue_depth():
+        return [("", {"notifier": k}, max(v, default=0))
+                for k, v in publisher.get_queue_depths().items()]
+    def bytes_sent():
+        return [("", {"notifier": k}, v)
+                for k, v in publisher.bytes_sent.items()]
+    metrics.add_family("artiq_publisher_subscribers", "gauge",
+                       "Number of subscribers of a notifier.", subscribers)
+    metrics.add_family("artiq_publisher_queue_depth", "gauge",
+                       "Largest number of mods waiting to be sent to a "
+                       "subscriber of a notifier.", queue_depth)
+    metrics.add_family("artiq_publisher_bytes_total", "counter",
+                       "Data queued for the subscribers of a notifier.",
+                       bytes_sent)
+
+
+def add_rpc_server_metrics(metrics, server):
+    """Registers the call counts and latencies of each target of a
+    ``pc_rpc.Server``."""
+    def call_seconds():
+        r = []
+        for k, v in server.call_stats.items():
+            r.append(("_count", {"target": k}, v["calls"]))
+            r.append(("_sum", {"target": k}, v["time"]))
+        return r
+    def failures():
+        return [("", {"target": k}, v["failures"])
+                for k, v in server.call_stats.items()]
+    metrics.add_family("artiq_rpc_call_seconds", "summary",
+                       "Execution time of RPC calls.", call_seconds)
+    metrics.add_family("artiq_rpc_failures_total", "counter",
+                       "RPC calls that raised an exception.", failures)
+
+
+def add_scheduler_metrics(metrics, scheduler):
+    """Registers the worker spawn times and experiment stage latencies of a
+    ``Scheduler``."""
+    stats = scheduler.stats
+    def spawn_seconds():
+        return [("_count", dict(), stats.spawn_count),
+                ("_sum", dict(), stats.spawn_time)]
+    def stage_seconds():
+        r = []
+        for k, (count, total) in sorted(stats.stages.items()):
+            r.append(("_count", {"stage": k}, count))
+            r.append(("_sum", {"stage": k}, total))
+        return r
+    metrics.add_family("artiq_worker_spawn_seconds", "summary",
+                       "Time taken to spawn worker processes.", spawn_seconds)
+    metrics.add_family("artiq_scheduler_stage_seconds", "summary",
+                       "Duration of the experiment stages.", stage_seconds)
+
+
+def add_dataset_db_metrics(metrics, dataset_db):
+    """Registers the number of dataset mods applied by a ``DatasetDB``."""
+    metrics.add_family("artiq_dataset_mods_total", "counter",
+                       "Mods applied to the datasets.",
+                       lambda: [("", dict(), dataset_db.mod_count)])
+
+
+class MetricsServer(AsyncioServer):
+    """Minimal HTTP server answering GET requests with the metrics in the
+    Prometheus text format."""
+    def __init__(self, metrics):
+        AsyncioServer.__init__(self)
+        self.metrics = metrics
+
+    async def _handle_connection_cr(self, reader, writer):
+        try:
+            request = (await reader.readline()).split()
+            while True:
+                line = await reader.readline()
+                if line in (b"", b"\n", b"\r\n"):
+                    break
+            if (len(request) >= 2 and request[0] == b"GET"
+                    and request[1] in (b"/", b"/metrics")):
+                status = "200 OK"
+                body = self.metrics.format_prometheus().encode()
+            else:
+                status = "404 Not Found"
+                body = b"not found\n"
+            writer.write("HTTP/1.0 {}\r\n"
+                         "Content-Type: text/plain; version=0.0.4\r\n"
+                         "Content-Length: {}\r\n"
+                         "\r\n".format(status, len(body)).encode())
+            writer.write(body)
+            await writer.drain()
+        except (ConnectionResetError, ConnectionAbortedError,
+                BrokenPipeError):
+            pass
+        finally:
+            writer.close()
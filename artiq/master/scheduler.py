@@ -1,7 +1,7 @@
 import asyncio
 import logging
 from enum import Enum
-from time import time
+from time import time, monotonic
 
 from artiq.master.worker import Worker
 from artiq.tools import asyncio_wait_or_cancel, TaskObject, Condition
@@ -28,8 +28,9 @@ def _mk_worker_method(name):
         if self.worker.closed.is_set():
             return True
         m = getattr(self.worker, name)
+        t0 = monotonic()
         try:
-            return await m(*args, **kwargs)
+            r = await m(*args, **kwargs)
         except Exception as e:
             if isinstance(e, asyncio.CancelledError):
                 raise
@@ -40,6 +41,10 @@ def _mk_worker_method(name):
                 return True
             else:
                 raise
+        finally:
+            self._stats.add_stage_time(name, monotonic() - t0)
+        self._publish_profile()
+        return r
     return worker_method
 
 
@@ -56,7 +61,8 @@ class Run:
         self.due_date = due_date
         self.flush = flush
 
-        self.worker = Worker(pool.worker_handlers)
+        self.worker = Worker(pool.worker_handlers,
+                             dataset_db=pool.dataset_db)
         self.termination_requested = False
 
         self._status = RunStatus.pending
@@ -73,6 +79,7 @@ class Run:
         self._notifier = pool.notifier
         self._notifier[self.rid] = notification
         self._state_changed = pool.state_changed
+        self._stats = pool.stats
 
     @property
     def status(self):
@@ -85,6 +92,12 @@ class Run:
             self._notifier[self.rid]["status"] = self._status.name
         self._state_changed.notify()
 
+    def _publish_profile(self):
+        profile = self.worker.profile
+        if profile is not None and not self.worker.closed.is_set():
+            self._notifier[self.rid]["profile"] = {
+                stage: r["wall"] for stage, r in profile.items()}
+
     # The run with the largest priority_key is to be scheduled first
     def priority_key(self, now=None):
         if self.due_date is None:
@@ -105,9 +118,13 @@ class Run:
     _build = _mk_worker_method("build")
 
     async def build(self):
-        await self._build(self.rid, self.pipeline_name,
-                          self.wd, self.expid,
-                          self.priority)
+        try:
+            await self._build(self.rid, self.pipeline_name,
+                              self.wd, self.expid,
+                              self.priority)
+        finally:
+            if self.worker.spawn_time is not None:
+                self._stats.add_spawn_time(self.worker.spawn_time)
 
     prepare = _mk_worker_method("prepare")
     run = _mk_worker_method("run")
@@ -126,8 +143,28 @@ class RIDCounter:
         return rid
 
 
+class SchedulerStats:
+    """Latencies of worker process creation and of the experiment stages,
+    accumulated over all pipelines."""
+    def __init__(self):
+        self.spawn_count = 0
+        self.spawn_time = 0.0
+        # worker method name -> [number of calls, total time]
+        self.stages = dict()
+
+    def add_spawn_time(self, t):
+        self.spawn_count += 1
+        self.spawn_time += t
+
+    def add_stage_time(self, name, t):
+        stage = self.stages.setdefault(name, [0, 0.0])
+        stage[0] += 1
+        stage[1] += t
+
+
 class RunPool:
-    def __init__(self, ridc, worker_handlers, notifier, repo_backend):
+    def __init__(self, ridc, worker_handlers, notifier, repo_backend, stats,
+                 dataset_db):
         self.runs = dict()
         self.state_changed = Condition()
 
@@ -135,6 +172,8 @@ class RunPool:
         self.worker_handlers = worker_handlers
         self.notifier = notifier
         self.repo_backend = repo_backend
+        self.stats = stats
+        self.dataset_db = dataset_db
 
     def submit(self, expid, priority, due_date, flush, pipeline_name):
         # mutates expid to insert head repository revision if None.
@@ -325,8 +364,10 @@ class AnalyzeStage(TaskObject):
 
 
 class Pipeline:
-    def __init__(self, ridc, deleter, worker_handlers, notifier, repo_backend):
-        self.pool = RunPool(ridc, worker_handlers, notifier, repo_backend)
+    def __init__(self, ridc, deleter, worker_handlers, notifier, repo_backend,
+                 stats, dataset_db):
+        self.pool = RunPool(ridc, worker_handlers, notifier, repo_backend,
+                            stats, dataset_db)
         self._prepare = PrepareStage(self.pool, deleter.delete)
         self._run = RunStage(self.pool, deleter.delete)
         self._analyze = AnalyzeStage(self.pool, deleter.delete)
@@ -386,12 +427,15 @@ class Deleter(TaskObject):
 
 
 class Scheduler:
-    def __init__(self, next_rid, worker_handlers, repo_backend):
+    def __init__(self, next_rid, worker_handlers, repo_backend,
+                 dataset_db=None):
         self.notifier = Notifier(dict())
+        self.stats = SchedulerStats()
 
         self._pipelines = dict()
         self._worker_handlers = worker_handlers
         self._repo_backend = repo_backend
+        self._dataset_db = dataset_db
         self._terminated = False
 
         self._ridc = RIDCounter(next_rid)
@@ -421,7 +465,8 @@ class Scheduler:
             logger.debug("creating pipeline '%s'", pipeline_name)
             pipeline = Pipeline(self._ridc, self._deleter,
                                 self._worker_handlers, self.notifier,
-                                self._repo_backend)
+                                self._repo_backend, self.stats,
+                                self._dataset_db)
             self._pipelines[pipeline_name] = pipeline
             pipeline.start()
         return pipeline.pool.submit(expid, priority, due_date, flush, pipeline_name)
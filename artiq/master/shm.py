@@ -0,0 +1,161 @@
+"""Transfer of large numpy arrays between the master and the workers through
+shared memory.
+
+An array is stored in a file (in ``/dev/shm`` when available, i.e. in
+memory) and mapped by the processes that use it. Only a small handle
+describing the file, the data type and the shape of the array goes through
+the PYON IPC channel. Segments are never modified: they are mapped
+copy-on-write, and when the dataset changes, a new segment is created and
+the old one is unlinked, so that the processes that have opened it keep
+seeing the previous value.
+"""
+
+import os
+import tempfile
+import shutil
+import logging
+
+import numpy
+
+
+logger = logging.getLogger(__name__)
+
+
+# smallest array, in bytes, transferred through shared memory
+threshold = 64*1024
+
+
+def is_shareable(value):
+    return (isinstance(value, numpy.ndarray)
+            and not value.dtype.hasobject
+            and value.dtype.fields is None
+            and value.nbytes >= threshold)
+
+
+def make_directory():
+    if os.path.isdir("/dev/shm"):
+        parent = "/dev/shm"
+    else:
+        parent = None
+    return tempfile.mkdtemp(prefix="artiq_shm_", dir=parent)
+
+
+def store(directory, array):
+    """Copies an array into a new segment of ``directory`` and returns its
+    handle."""
+    fd, filename = tempfile.mkstemp(dir=directory)
+    with open(fd, "wb") as f:
+        f.write(numpy.ascontiguousarray(array).data)
+    return {"file": filename,
+            "dtype": array.dtype.str,
+            "shape": array.shape}
+
+
+def open_segment(handle):
+    """Opens the file of a segment, which remains available through the
+    returned file object after it has been unlinked. Raises
+    ``FileNotFoundError`` if the segment has already been unlinked."""
+    return open(handle["file"], "rb")
+
+
+def map_copy_on_write(f, handle):
+    """Maps a segment opened with ``open_segment`` and returns it as an
+    array. Modifications of the array are private to the mapping."""
+    if not numpy.prod(handle["shape"]):
+        return numpy.empty(handle["shape"], handle["dtype"])
+    return numpy.memmap(f, handle["dtype"], mode="c", shape=handle["shape"])
+
+
+def load(handle):
+    """Returns a copy in private memory of the content of a segment."""
+    return numpy.fromfile(handle["file"], handle["dtype"]).reshape(
+        handle["shape"])
+
+
+def remove(handle):
+    try:
+        os.unlink(handle["file"])
+    except OSError:
+        # e.g. on Windows, where files that are mapped cannot be deleted.
+        # The file is removed with its directory.
+        logger.debug("failed to remove segment %s", handle["file"],
+                     exc_info=True)
+
+
+class SharedDatasets:
+    """Worker handlers serving the large arrays of a ``DatasetDB`` through
+    shared memory.
+
+    Segments are created on the first request for a dataset and shared by
+    all workers until the dataset is modified.
+
+    Workers store the arrays they set in a directory allocated for them by
+    ``make_worker_directory``, and ``update`` only accepts segments from
+    the directory of the worker that sends them, since it deletes them.
+    """
+    def __init__(self, dataset_db):
+        self.dataset_db = dataset_db
+        self.directory = make_directory()
+        self._segments = dict()
+        self._worker_directories = dict()  # rid -> directory
+        dataset_db.watchers.add(self._dataset_changed)
+
+    def close(self):
+        self.dataset_db.watchers.discard(self._dataset_changed)
+        self._segments = dict()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _dataset_changed(self, key):
+        try:
+            handle = self._segments.pop(key)
+        except KeyError:
+            pass
+        else:
+            remove(handle)
+
+    def get(self, key):
+        """Returns ``("shm", handle)`` for large arrays and ``("value",
+        value)`` for other datasets."""
+        try:
+            return "shm", self._segments[key]
+        except KeyError:
+            pass
+        value = self.dataset_db.get(key)
+        if is_shareable(value):
+            handle = store(self.directory, value)
+            self._segments[key] = handle
+            return "shm", handle
+        else:
+            return "value", value
+
+    def make_worker_directory(self, rid):
+        """Creates the directory in which the worker of experiment ``rid``
+        stores its segments, and returns its path. The worker deletes it
+        when it exits."""
+        for other_rid, directory in list(self._worker_directories.items()):
+            if not os.path.isdir(directory):
+                del self._worker_directories[other_rid]
+        directory = tempfile.mkdtemp(prefix="worker_", dir=self.directory)
+        self._worker_directories[rid] = directory
+        return directory
+    make_worker_directory.worker_pass_rid = True
+
+    def update(self, rid, mod):
+        """Applies a ``setitem`` mod whose value is a ``(persist, handle)``
+        pair, with the handle of a segment created by the worker in its
+        directory. The segment is deleted."""
+        persist, handle = mod["value"]
+        filename = os.path.realpath(handle["file"])
+        directory = self._worker_directories.get(rid)
+        if (directory is None
+                or os.path.dirname(filename) != os.path.realpath(directory)):
+            raise ValueError("segment {} is not in the directory of "
+                             "experiment {}".format(handle["file"], rid))
+        try:
+            value = load(handle)
+        finally:
+            remove({"file": filename})
+        mod = dict(mod)
+        mod["value"] = (persist, value)
+        self.dataset_db.update(mod)
+    update.worker_pass_rid = True
@@ -26,14 +26,43 @@ class WorkerError(Exception):
 
 
 class Worker:
-    def __init__(self, handlers=dict(), send_timeout=0.5):
+    """Controls a worker process.
+
+    If ``dataset_db`` is given, the worker process caches the datasets it
+    obtains through the ``get_dataset`` handler, and the worker pushes an
+    invalidation to it whenever one of them is modified in ``dataset_db``.
+
+    If the ``get_dataset_shm``, ``update_dataset_shm`` and
+    ``make_dataset_shm_directory`` handlers are present (see
+    ``artiq.master.shm.SharedDatasets``), the worker process uses them to
+    exchange large arrays through shared memory.
+
+    If the ``lend_core_connection`` and ``give_back_core_connection``
+    handlers are present (see ``artiq.master.core_pool.CoreConnectionPool``),
+    the drivers of the worker process borrow the connections to the core
+    devices kept open by the master.
+
+    Handlers may be coroutine functions, which is useful for those that
+    would otherwise block the event loop.
+    """
+    def __init__(self, handlers=dict(), send_timeout=0.5, dataset_db=None):
         self.handlers = handlers
         self.send_timeout = send_timeout
+        self.dataset_db = dataset_db
 
         self.rid = None
         self.process = None
         self.watchdogs = dict()  # wid -> expiration (using time.monotonic)
 
+        # stage -> {"wall": total time, "handlers": time spent serving
+        # worker requests}, None if profiling is disabled
+        self.profile = None
+        self._handler_time = 0.0
+        # time taken to spawn the worker process, None if not spawned yet
+        self.spawn_time = None
+        # datasets that the worker process may hold in its cache
+        self._cached_datasets = set()
+
         self.io_lock = asyncio.Lock()
         self.closed = asyncio.Event()
 
@@ -61,10 +90,12 @@ class Worker:
         try:
             if self.closed.is_set():
                 raise WorkerError("Attempting to create process after close")
+            t0 = time.monotonic()
             self.process = await asyncio.create_subprocess_exec(
                 sys.executable, "-m", "artiq.master.worker_impl",
                 str(log_level),
                 stdout=subprocess.PIPE, stdin=subprocess.PIPE)
+            self.spawn_time = time.monotonic() - t0
         finally:
             self.io_lock.release()
 
@@ -75,6 +106,8 @@ class Worker:
         This method should always be called by the user to clean up, even if
         build() or examine() raises an exception."""
         self.closed.set()
+        if self.dataset_db is not None:
+            self.dataset_db.watchers.discard(self._dataset_changed)
         await self.io_lock.acquire()
         try:
             if self.process is None:
@@ -145,6 +178,23 @@ class Worker:
             raise WorkerError("Worker sent invalid PYON data")
         return obj
 
+    def _dataset_changed(self, key):
+        if key not in self._cached_datasets:
+            return
+        self._cached_datasets.remove(key)
+        if (self.closed.is_set() or self.process is None
+                or self.process.returncode is not None):
+            return
+        # The worker process reads invalidations at any time, so they can
+        # be written without taking io_lock. The write is synchronous, so
+        # it cannot be interleaved with another message.
+        line = pyon.encode({"action": "invalidate_datasets", "keys": [key]})
+        try:
+            self.process.stdin.write((line + "\n").encode())
+        except:
+            logger.debug("failed to send dataset invalidation to worker"
+                         " (RID %s)", self.rid, exc_info=True)
+
     async def _handle_worker_requests(self):
         while True:
             try:
@@ -171,21 +221,30 @@ class Worker:
                 func = self.handlers[action]
             if getattr(func, "worker_pass_rid", False):
                 func = partial(func, self.rid)
+            if (action in ("get_dataset", "get_dataset_shm")
+                    and self.dataset_db is not None):
+                self._cached_datasets.add(obj["key"])
+            t0 = time.monotonic()
             try:
                 data = func(**obj)
+                if asyncio.iscoroutine(data):
+                    data = await data
                 reply = {"status": "ok", "data": data}
             except:
                 reply = {"status": "failed",
                          "message": traceback.format_exc()}
+            self._handler_time += time.monotonic() - t0
             await self.io_lock.acquire()
             try:
                 await self._send(reply)
             finally:
                 self.io_lock.release()
 
-    async def _worker_action(self, obj, timeout=None):
+    async def _worker_action(self, obj, timeout=None, stage=None):
         if timeout is not None:
             self.watchdogs[-1] = time.monotonic() + timeout
+        t0 = time.monotonic()
+        self._handler_time = 0.0
         try:
             await self.io_lock.acquire()
             try:
@@ -199,18 +258,32 @@ class Worker:
         finally:
             if timeout is not None:
                 del self.watchdogs[-1]
+            if self.profile is not None:
+                if stage is None:
+                    stage = obj["action"]
+                r = self.profile.setdefault(stage,
+                                            {"wall": 0.0, "handlers": 0.0})
+                r["wall"] += time.monotonic() - t0
+                r["handlers"] += self._handler_time
         return completed
 
     async def build(self, rid, pipeline_name, wd, expid, priority, timeout=15.0):
         self.rid = rid
+        if expid.get("profile", False):
+            self.profile = dict()
         await self._create_process(expid["log_level"])
+        if self.dataset_db is not None:
+            self.dataset_db.watchers.add(self._dataset_changed)
         await self._worker_action(
             {"action": "build",
              "rid": rid,
              "pipeline_name": pipeline_name,
              "wd": wd,
              "expid": expid,
-             "priority": priority},
+             "priority": priority,
+             "cache_datasets": self.dataset_db is not None,
+             "shm_datasets": "get_dataset_shm" in self.handlers,
+             "core_connection_pool": "lend_core_connection" in self.handlers},
             timeout)
 
     async def prepare(self):
@@ -227,7 +300,8 @@ class Worker:
         for wid, expiry in self.watchdogs:
             self.watchdogs[wid] += stop_duration
         completed = await self._worker_action({"status": "ok",
-                                               "data": request_termination})
+                                               "data": request_termination},
+                                              stage="run")
         if not completed:
             self.yield_time = time.monotonic()
         return completed
@@ -236,8 +310,12 @@ class Worker:
         await self._worker_action({"action": "analyze"})
 
     async def write_results(self, timeout=15.0):
-        await self._worker_action({"action": "write_results"},
-                                  timeout)
+        obj = {"action": "write_results"}
+        if self.profile is not None:
+            # the time of this stage is added to self.profile afterwards,
+            # and is only published on the schedule
+            obj["profile"] = self.profile
+        await self._worker_action(obj, timeout)
 
     async def examine(self, file, timeout=20.0):
         await self._create_process(logging.WARNING)
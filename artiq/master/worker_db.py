@@ -64,6 +64,16 @@ class DeviceManager:
             self.active_devices[name] = dev
             return dev
 
+    def write_hdf5(self, f):
+        """Lets the active local devices that have a ``write_hdf5`` method
+        (e.g. the core device driver) store data in the ``devices/<name>``
+        group of a results file."""
+        for name, dev in self.active_devices.items():
+            if isinstance(dev, (Client, BestEffortClient)):
+                continue
+            if hasattr(dev, "write_hdf5"):
+                dev.write_hdf5(f.require_group("devices/" + name))
+
     def close_devices(self):
         """Closes all active devices, in the opposite order as they were
         requested."""
@@ -1,18 +1,54 @@
 import sys
 import time
 import os
+import io
 import logging
+import threading
+import queue
+import shutil
+from copy import deepcopy
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
 
 from artiq.protocols import pyon
 from artiq.tools import file_import
 from artiq.master.worker_db import DeviceManager, DatasetManager, get_hdf5_output
+from artiq.master import shm
+from artiq.master.core_pool import BorrowedConnections
 from artiq.language.environment import is_experiment
 from artiq.language.core import set_watchdog_factory, TerminationRequested
 
 
+ipc_queue = queue.Queue()
+
+
+def ipc_reader():
+    # Runs in a separate thread so that the dataset invalidations pushed by
+    # the master are processed even while the experiment is not waiting for
+    # a message.
+    while True:
+        line = sys.__stdin__.readline()
+        if not line:
+            ipc_queue.put(EOFError("Connection to master closed"))
+            return
+        try:
+            obj = pyon.decode(line)
+        except Exception as e:
+            ipc_queue.put(e)
+            continue
+        if obj.get("action") == "invalidate_datasets":
+            parent_dataset_db.invalidate(obj["keys"])
+        else:
+            ipc_queue.put(obj)
+
+
 def get_object():
-    line = sys.__stdin__.readline()
-    return pyon.decode(line)
+    obj = ipc_queue.get()
+    if isinstance(obj, Exception):
+        raise obj
+    return obj
 
 
 def put_object(obj):
@@ -22,6 +58,102 @@ def put_object(obj):
     sys.__stdout__.flush()
 
 
+class StageProfiler:
+    """Measures where the time goes in each stage of an experiment.
+
+    For each stage, the wall clock time and the part of it spent waiting for
+    replies from the master (IPC) are recorded. ``tools`` may additionally
+    contain ``"cprofile"`` and/or ``"tracemalloc"`` to capture a profile
+    and the memory allocation statistics of each stage.
+
+    If tracing of memory allocations was already enabled (e.g. with
+    ``-X tracemalloc``), it is left enabled, the statistics are those of
+    the allocations made during the stage, and the peak is not recorded.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.tools = set()
+        self.ipc_wait = 0.0
+        self.results = dict()
+
+    def configure(self, profile):
+        """Enables the profiler according to the ``profile`` entry of the
+        expid: ``True`` selects all tools, a list selects some of them."""
+        self.enabled = bool(profile)
+        if profile is True:
+            self.tools = {"cprofile", "tracemalloc"}
+        elif profile:
+            self.tools = set(profile)
+        else:
+            self.tools = set()
+        self.results = dict()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        r = self.results.setdefault(name, {"wall": 0.0, "ipc_wait": 0.0})
+        profile = None
+        if "cprofile" in self.tools:
+            profile = cProfile.Profile()
+            profile.enable()
+        tracemalloc_started = False
+        if "tracemalloc" in self.tools:
+            if tracemalloc.is_tracing():
+                tracemalloc_start = tracemalloc.take_snapshot()
+            else:
+                tracemalloc.start()
+                tracemalloc_started = True
+        ipc_wait_start = self.ipc_wait
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            r["wall"] += time.monotonic() - t0
+            r["ipc_wait"] += self.ipc_wait - ipc_wait_start
+            if profile is not None:
+                profile.disable()
+                stream = io.StringIO()
+                stats = pstats.Stats(profile, stream=stream)
+                stats.sort_stats("cumulative").print_stats(50)
+                r["cprofile"] = stream.getvalue()
+            if "tracemalloc" in self.tools:
+                snapshot = tracemalloc.take_snapshot()
+                if tracemalloc_started:
+                    r["tracemalloc_peak"] = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    top = snapshot.statistics("lineno")[:20]
+                else:
+                    top = snapshot.compare_to(tracemalloc_start,
+                                              "lineno")[:20]
+                r["tracemalloc"] = "\n".join(str(stat) for stat in top)
+
+    def write_hdf5(self, f, master_profile):
+        group = f.create_group("profile")
+        for stage, r in self.results.items():
+            stage_group = group.create_group(stage)
+            for k, v in r.items():
+                if isinstance(v, str):
+                    dataset = stage_group.create_dataset(
+                        k, (), "S{}".format(len(v)))
+                    dataset[()] = v.encode()
+                else:
+                    stage_group[k] = v
+            stage_group["compute"] = r["wall"] - r["ipc_wait"]
+        for stage, r in master_profile.items():
+            if stage in group:
+                stage_group = group[stage]
+            else:
+                stage_group = group.create_group(stage)
+            for k, v in r.items():
+                stage_group["master_" + k] = v
+
+
+profiler = StageProfiler()
+
+
 class ParentActionError(Exception):
     pass
 
@@ -32,8 +164,10 @@ def make_parent_action(action, argnames, exception=ParentActionError):
         request = {"action": action}
         for argname, arg in zip(argnames, args):
             request[argname] = arg
+        t0 = time.monotonic()
         put_object(request)
         reply = get_object()
+        profiler.ipc_wait += time.monotonic() - t0
         if "action" in reply:
             if reply["action"] == "terminate":
                 sys.exit()
@@ -69,8 +203,107 @@ class ParentDeviceDB:
 
 
 class ParentDatasetDB:
-    get = make_parent_action("get_dataset", "key", KeyError)
-    update = make_parent_action("update_dataset", "mod")
+    """Read-through cache of the datasets of the master.
+
+    Entries are dropped when the master pushes invalidations for them (see
+    ``ipc_reader``) and when the experiment modifies them. Copies of the
+    cached values are returned, so that the experiment may modify them.
+
+    If ``shm`` is set, large arrays are exchanged with the master through
+    shared memory (see ``artiq.master.shm``). Instead of copies, new
+    copy-on-write mappings of their segments are returned.
+    """
+    _get = staticmethod(make_parent_action("get_dataset", "key", KeyError))
+    _update = staticmethod(make_parent_action("update_dataset", "mod"))
+    _get_shm = staticmethod(make_parent_action("get_dataset_shm", "key",
+                                               KeyError))
+    _update_shm = staticmethod(make_parent_action("update_dataset_shm",
+                                                  "mod"))
+    _make_shm_directory = staticmethod(make_parent_action(
+        "make_dataset_shm_directory", ""))
+
+    def __init__(self):
+        self.enabled = False
+        self.shm = False
+        self.shm_directory = None
+        self._lock = threading.Lock()
+        self._cache = dict()
+        # incremented by each invalidation, to detect those received while
+        # a value is being fetched
+        self._generation = 0
+
+    def _fetch(self, key):
+        # returns (segment, value), segment being (file, handle) for the
+        # arrays in shared memory and None otherwise
+        if self.shm:
+            kind, data = self._get_shm(key)
+            if kind == "shm":
+                try:
+                    f = shm.open_segment(data)
+                except FileNotFoundError:
+                    # The dataset has been modified since the master sent
+                    # the handle, and the segment unlinked.
+                    return None, self._get(key)
+                segment = f, data
+                return segment, shm.map_copy_on_write(*segment)
+            else:
+                return None, data
+        else:
+            return None, self._get(key)
+
+    def get(self, key):
+        if not self.enabled:
+            segment, value = self._fetch(key)
+            if segment is not None:
+                segment[0].close()
+            return value
+        with self._lock:
+            try:
+                segment, value = self._cache[key]
+            except KeyError:
+                generation = self._generation
+            else:
+                if segment is not None:
+                    return shm.map_copy_on_write(*segment)
+                return deepcopy(value)
+        segment, value = self._fetch(key)
+        with self._lock:
+            if self._generation == generation and key not in self._cache:
+                if segment is not None:
+                    self._cache[key] = (segment, None)
+                else:
+                    self._cache[key] = (None, deepcopy(value))
+            elif segment is not None:
+                segment[0].close()
+        return value
+
+    def update(self, mod):
+        if mod["path"]:
+            key = mod["path"][0]
+        else:
+            key = mod["key"]
+        self.invalidate([key])
+        if (self.shm and mod["action"] == "setitem" and not mod["path"]
+                and shm.is_shareable(mod["value"][1])):
+            if self.shm_directory is None:
+                self.shm_directory = self._make_shm_directory()
+            persist, value = mod["value"]
+            mod = dict(mod)
+            mod["value"] = (persist, shm.store(self.shm_directory, value))
+            self._update_shm(mod)
+        else:
+            self._update(mod)
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                segment, _ = self._cache.pop(key, (None, None))
+                if segment is not None:
+                    segment[0].close()
+
+
+parent_dataset_db = ParentDatasetDB()
 
 
 class Watchdog:
@@ -90,10 +323,23 @@ class Watchdog:
 set_watchdog_factory(Watchdog)
 
 
+borrowed_connections = BorrowedConnections(
+    make_parent_action("lend_core_connection", "host port path"),
+    make_parent_action("give_back_core_connection", "host port state"))
+
+
+def stage_completed():
+    # Other workers may use the core devices while this one is not
+    # executing a stage.
+    borrowed_connections.release_all()
+    put_object({"action": "completed"})
+
+
 class Scheduler:
     pause_noexc = staticmethod(make_parent_action("pause", ""))
 
     def pause(self):
+        borrowed_connections.release_all()
         if self.pause_noexc():
             raise TerminationRequested
 
@@ -170,7 +416,9 @@ def main():
 
     device_mgr = DeviceManager(ParentDeviceDB,
                                virtual_devices={"scheduler": Scheduler()})
-    dataset_mgr = DatasetManager(ParentDatasetDB)
+    dataset_mgr = DatasetManager(parent_dataset_db)
+
+    threading.Thread(target=ipc_reader, daemon=True).start()
 
     try:
         while True:
@@ -185,30 +433,44 @@ def main():
                     expf = os.path.join(obj["wd"], expid["file"])
                 else:
                     expf = expid["file"]
-                exp = get_exp(expf, expid["class_name"])
-                device_mgr.virtual_devices["scheduler"].set_run_info(
-                    obj["pipeline_name"], expid, obj["priority"])
-                exp_inst = exp(device_mgr, dataset_mgr,
-                    **expid["arguments"])
-                put_object({"action": "completed"})
+                parent_dataset_db.enabled = obj.get("cache_datasets", False)
+                parent_dataset_db.shm = obj.get("shm_datasets", False)
+                if obj.get("core_connection_pool", False):
+                    device_mgr.virtual_devices["core_connection_pool"] = \
+                        borrowed_connections
+                profiler.configure(expid.get("profile", False))
+                with profiler.stage("build"):
+                    exp = get_exp(expf, expid["class_name"])
+                    device_mgr.virtual_devices["scheduler"].set_run_info(
+                        obj["pipeline_name"], expid, obj["priority"])
+                    exp_inst = exp(device_mgr, dataset_mgr,
+                        **expid["arguments"])
+                stage_completed()
             elif action == "prepare":
-                exp_inst.prepare()
-                put_object({"action": "completed"})
+                with profiler.stage("prepare"):
+                    exp_inst.prepare()
+                stage_completed()
             elif action == "run":
-                exp_inst.run()
-                put_object({"action": "completed"})
+                with profiler.stage("run"):
+                    exp_inst.run()
+                stage_completed()
             elif action == "analyze":
-                exp_inst.analyze()
-                put_object({"action": "completed"})
+                with profiler.stage("analyze"):
+                    exp_inst.analyze()
+                stage_completed()
             elif action == "write_results":
                 f = get_hdf5_output(start_time, rid, exp.__name__)
                 try:
-                    dataset_mgr.write_hdf5(f)
-                    if "repo_rev" in expid:
-                        rr = expid["repo_rev"]
-                        dtype = "S{}".format(len(rr))
-                        dataset = f.create_dataset("repo_rev", (), dtype)
-                        dataset[()] = rr.encode()
+                    with profiler.stage("write_results"):
+                        dataset_mgr.write_hdf5(f)
+                        device_mgr.write_hdf5(f)
+                        if "repo_rev" in expid:
+                            rr = expid["repo_rev"]
+                            dtype = "S{}".format(len(rr))
+                            dataset = f.create_dataset("repo_rev", (), dtype)
+                            dataset[()] = rr.encode()
+                    if profiler.enabled:
+                        profiler.write_hdf5(f, obj.get("profile", dict()))
                 finally:
                     f.close()
                 put_object({"action": "completed"})
@@ -221,6 +483,8 @@ def main():
         logging.error("Worker terminating with exception", exc_info=True)
     finally:
         device_mgr.close_devices()
+        if parent_dataset_db.shm_directory is not None:
+            shutil.rmtree(parent_dataset_db.shm_directory, ignore_errors=True)
 
 
 if __name__ == "__main__":
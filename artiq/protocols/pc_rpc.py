@@ -421,11 +421,17 @@ class Server(_AsyncioServer):
         ``terminate`` method that unblocks any tasks waiting on
         ``wait_terminate``. This is useful to handle server termination
         requests from clients.
+
+    For each target, the server counts the calls and failed calls, and
+    accumulates the time spent executing them, in the ``call_stats``
+    dictionary.
     """
     def __init__(self, targets, description=None, builtin_terminate=False):
         _AsyncioServer.__init__(self)
         self.targets = targets
         self.description = description
+        self.call_stats = {k: {"calls": 0, "failures": 0, "time": 0.0}
+                           for k in targets.keys()}
         self.builtin_terminate = builtin_terminate
         if builtin_terminate:
             self._terminate_request = asyncio.Event()
@@ -489,7 +495,16 @@ class Server(_AsyncioServer):
                             obj = {"status": "ok", "ret": None}
                         else:
                             method = getattr(target, obj["name"])
-                            ret = method(*obj["args"], **obj["kwargs"])
+                            stats = self.call_stats[target_name]
+                            t0 = time.monotonic()
+                            try:
+                                ret = method(*obj["args"], **obj["kwargs"])
+                            except:
+                                stats["failures"] += 1
+                                raise
+                            finally:
+                                stats["calls"] += 1
+                                stats["time"] += time.monotonic() - t0
                             obj = {"status": "ok", "ret": ret}
                     else:
                         raise ValueError("Unknown action: {}"
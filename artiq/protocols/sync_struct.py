@@ -203,6 +203,8 @@ class Publisher(AsyncioServer):
         self.notifiers = notifiers
         self._recipients = {k: set() for k in notifiers.keys()}
         self._notifier_names = {id(v): k for k, v in notifiers.items()}
+        # notifier name -> number of bytes queued for subscribers
+        self.bytes_sent = {k: 0 for k in notifiers.keys()}
 
         for notifier in notifiers.values():
             notifier.publish = partial(self.publish, notifier)
@@ -225,7 +227,9 @@ class Publisher(AsyncioServer):
 
             obj = {"action": "init", "struct": notifier.read}
             line = pyon.encode(obj) + "\n"
-            writer.write(line.encode())
+            line = line.encode()
+            writer.write(line)
+            self.bytes_sent[notifier_name] += len(line)
 
             queue = asyncio.Queue()
             self._recipients[notifier_name].add(queue)
@@ -248,5 +252,13 @@ class Publisher(AsyncioServer):
         line = pyon.encode(mod) + "\n"
         line = line.encode()
         notifier_name = self._notifier_names[id(notifier)]
-        for recipient in self._recipients[notifier_name]:
+        recipients = self._recipients[notifier_name]
+        for recipient in recipients:
             recipient.put_nowait(line)
+        self.bytes_sent[notifier_name] += len(line)*len(recipients)
+
+    def get_queue_depths(self):
+        """Returns a dictionary giving, for each notifier, the list of the
+        numbers of mods waiting to be sent to each of its subscribers."""
+        return {k: [queue.qsize() for queue in v]
+                for k, v in self._recipients.items()}
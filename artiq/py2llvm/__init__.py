@@ -1,6 +1,16 @@
+import time
+
 from artiq.py2llvm.module import Module
 
-def get_runtime_binary(runtime, func_def):
+def get_runtime_binary(runtime, func_def, stats=None):
     module = Module(runtime)
+    t0 = time.monotonic()
     module.compile_function(func_def, dict())
-    return module.emit_object()
+    t1 = time.monotonic()
+    binary = module.emit_object()
+    t2 = time.monotonic()
+    if stats is not None:
+        stats["codegen_time"] = t1 - t0
+        stats["opt_time"] = module.opt_time
+        stats["emit_time"] = t2 - t1 - module.opt_time
+    return binary
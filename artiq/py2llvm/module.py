@@ -1,3 +1,5 @@
+import time
+
 import llvmlite_artiq.ir as ll
 import llvmlite_artiq.binding as llvm
 
@@ -14,12 +16,14 @@ class Module:
         fractions.init_module(self)
 
     def finalize(self):
+        t0 = time.monotonic()
         self.llvm_module_ref = llvm.parse_assembly(str(self.llvm_module))
         pmb = llvm.create_pass_manager_builder()
         pmb.opt_level = 2
         pm = llvm.create_module_pass_manager()
         pmb.populate(pm)
         pm.run(self.llvm_module_ref)
+        self.opt_time = time.monotonic() - t0
 
     def get_ee(self):
         self.finalize()
@@ -0,0 +1,254 @@
+import unittest
+import struct
+from fractions import Fraction
+
+import numpy
+
+from artiq.language.core import numpy_rpc, async_rpc
+from artiq.coredevice.comm_generic import (CommGeneric, _D2HMsgType,
+                                           pack_flash_record,
+                                           unpack_flash_records)
+from artiq.coredevice.runtime_exceptions import _RPCException
+from artiq.coredevice.rpc_wrapper import RPCMetrics
+
+
+class _Comm(CommGeneric):
+    # Replies LOAD_COMPLETED to every message.
+    def __init__(self):
+        self.sent = b""
+        self.received = b""
+        self.receives = 0
+        self.chunk_size = None
+
+    def open(self):
+        pass
+
+    def close(self):
+        self._end_session()
+
+    def receive(self, buffer):
+        self.receives += 1
+        if not self.received:
+            self.received = (struct.pack(">l", 0x5a5a5a5a)
+                             + struct.pack(">lB", 9,
+                                           _D2HMsgType.LOAD_COMPLETED.value))
+        n = min(len(buffer), len(self.received),
+                self.chunk_size or len(self.received))
+        buffer[:n], self.received = self.received[:n], self.received[n:]
+        return n
+
+    def write(self, data):
+        self.sent += data
+
+
+def _message(ty, payload=b""):
+    return (struct.pack(">l", 0x5a5a5a5a)
+            + struct.pack(">lB", 9 + len(payload), ty.value)
+            + payload)
+
+
+def _rpc_request(rpc_num, payload):
+    return _message(_D2HMsgType.RPC_REQUEST,
+                    struct.pack(">l", rpc_num) + payload + b"\x00")
+
+
+def _rpc_batch(rpcs):
+    return _message(_D2HMsgType.RPC_BATCH,
+                    struct.pack(">l", len(rpcs))
+                    + b"".join(struct.pack(">l", rpc_num) + payload + b"\x00"
+                               for rpc_num, payload in rpcs))
+
+
+def _rpc_list(elt_type_tag, fmt, elts):
+    return (b"l" + elt_type_tag + struct.pack(">l", len(elts))
+            + b"".join(struct.pack(fmt, *elt) for elt in elts))
+
+
+class CommGenericCase(unittest.TestCase):
+    def test_load_once(self):
+        comm = _Comm()
+        comm.load(b"kernel 1")
+        comm.load(b"kernel 1")
+        self.assertEqual(comm.sent.count(b"kernel 1"), 1)
+        comm.load(b"kernel 2")
+        comm.load(b"kernel 1")
+        self.assertEqual(comm.sent.count(b"kernel 1"), 2)
+        comm.close()
+        comm.load(b"kernel 1")
+        self.assertEqual(comm.sent.count(b"kernel 1"), 3)
+
+    def _serve_rpc(self, payload, arrays=False):
+        comm = _Comm()
+        comm.received = (_rpc_request(0, payload)
+                         + _message(_D2HMsgType.KERNEL_FINISHED))
+        received = []
+
+        def rpc(*args):
+            received.append(args)
+        if arrays:
+            rpc = numpy_rpc(rpc)
+        comm.serve({0: rpc}, dict())
+        return comm, received[0]
+
+    def test_rpc_lists(self):
+        payload = (_rpc_list(b"i", ">l", [(i, ) for i in range(1000)])
+                   + _rpc_list(b"I", ">q", [(1 << 40, ), (-1, )])
+                   + _rpc_list(b"f", ">d", [(0.5, ), (-2.25, )])
+                   + _rpc_list(b"b", "B", [(1, ), (0, )])
+                   + _rpc_list(b"F", ">qq", [(1, 3), (-2, 5)])
+                   + _rpc_list(b"i", ">l", []))
+        comm, args = self._serve_rpc(payload)
+        self.assertEqual(args, (list(range(1000)), [1 << 40, -1],
+                                [0.5, -2.25], [True, False],
+                                [Fraction(1, 3), Fraction(-2, 5)], []))
+        self.assertIs(type(args[0][0]), int)
+        self.assertIs(type(args[3][0]), bool)
+        self.assertEqual(comm.receives, 1)
+
+    def test_rpc_arrays(self):
+        payload = (_rpc_list(b"i", ">l", [(1, ), (-2, )])
+                   + _rpc_list(b"I", ">q", [(1 << 40, )])
+                   + _rpc_list(b"f", ">d", [(0.5, ), (-2.25, )])
+                   + _rpc_list(b"b", "B", [(1, ), (0, )])
+                   + _rpc_list(b"F", ">qq", [(1, 3)]))
+        _, args = self._serve_rpc(payload, arrays=True)
+        for arg, expected, dtype in zip(
+                args,
+                [[1, -2], [1 << 40], [0.5, -2.25], [True, False]],
+                [numpy.int32, numpy.int64, numpy.float64, numpy.bool_]):
+            self.assertIsInstance(arg, numpy.ndarray)
+            self.assertEqual(arg.dtype, dtype)
+            self.assertEqual(arg.tolist(), expected)
+        args[0][0] = 3  # writable
+        self.assertEqual(args[4], [Fraction(1, 3)])
+
+    def test_log(self):
+        comm = _Comm()
+        comm.chunk_size = 3
+        # garbage, including partial sync patterns
+        comm.received = (b"\x5a\x5a\x00\x5a\x5a\x5a\x01"
+                         + _message(_D2HMsgType.LOG_REPLY, b"ab\x00c\nd"))
+        self.assertEqual(comm.get_log(), "abc\nd")
+
+    def test_read_log(self):
+        comm = _Comm()
+        comm.received = _message(_D2HMsgType.LOG_READ_REPLY,
+                                 struct.pack(">L", 100) + b"abc\n")
+        self.assertEqual(comm.read_log(), ("abc\n", 104))
+        self.assertEqual(comm.sent[-4:], struct.pack(">L", 0))
+
+        comm.received = _message(_D2HMsgType.LOG_READ_REPLY,
+                                 struct.pack(">L", 104))
+        self.assertEqual(comm.read_log(104), ("", 104))
+        self.assertEqual(comm.sent[-4:], struct.pack(">L", 104))
+
+        # characters overwritten in the ring buffer
+        comm.received = _message(_D2HMsgType.LOG_READ_REPLY,
+                                 struct.pack(">L", 0xfffffffe) + b"defg")
+        with self.assertLogs("artiq.coredevice.comm_generic", "WARNING"):
+            self.assertEqual(comm.read_log(104), ("defg", 2))
+
+    def test_flash_storage(self):
+        comm = _Comm()
+        comm.received = _message(_D2HMsgType.FLASH_OK_REPLY)
+        comm.flash_storage_write_many([(b"a", b"1"), (b"bc", b"")])
+        self.assertEqual(comm.sent[-14:],
+                         b"\x00\x00\x00\x07a\x001\x00\x00\x00\x07bc\x00")
+
+        comm.received = _message(_D2HMsgType.FLASH_ERROR_REPLY)
+        with self.assertRaises(IOError):
+            comm.flash_storage_remove_many([b"a"])
+
+        records = (pack_flash_record(b"mac", b"02:00")
+                   + pack_flash_record(b"ip", b"\x00\x01"))
+        comm.received = _message(_D2HMsgType.FLASH_READ_ALL_REPLY, records)
+        self.assertEqual(comm.flash_storage_read_all(),
+                         {b"mac": b"02:00", b"ip": b"\x00\x01"})
+        comm.received = _message(_D2HMsgType.FLASH_READ_ALL_REPLY, records)
+        self.assertEqual(comm.flash_storage_list(), [b"ip", b"mac"])
+
+        image = records + b"\xff"*4
+        comm.received = _message(_D2HMsgType.FLASH_OK_REPLY)
+        comm.flash_storage_write_image(image)
+        self.assertTrue(comm.sent.endswith(image))
+        self.assertEqual(list(unpack_flash_records(image)),
+                         [(b"mac", b"02:00"), (b"ip", b"\x00\x01")])
+
+    def test_buffering(self):
+        # messages spanning the end of the receive buffer, and lists larger
+        # than the buffer
+        comm = _Comm()
+        comm.chunk_size = 1000
+        lists = [list(range(n, n + 1001)) for n in range(100)]
+        lists.append(list(range(100000)))
+        for elts in lists:
+            comm.received += _rpc_request(
+                0, _rpc_list(b"i", ">l", [(elt, ) for elt in elts]))
+        comm.received += _message(_D2HMsgType.KERNEL_FINISHED)
+        received = []
+        comm.serve({0: lambda l: received.append(l)}, dict())
+        self.assertEqual(received, lists)
+
+    def test_async_rpcs(self):
+        comm = _Comm()
+        received = []
+
+        def fn(n):
+            if n < 0:
+                raise ValueError
+            received.append(n)
+        rpc_map = {0: fn, 1: lambda: len(received)}
+
+        comm.received = (_rpc_batch([(0, b"i" + struct.pack(">l", i))
+                                     for i in range(3)])
+                         + _rpc_batch([(0, b"i" + struct.pack(">l", 3))])
+                         + _rpc_request(1, b"")
+                         + _message(_D2HMsgType.KERNEL_FINISHED))
+        comm.serve(rpc_map, dict())
+        self.assertEqual(received, [0, 1, 2, 3])
+        # the regular RPC is executed after the asynchronous ones
+        self.assertEqual(comm.sent[-8:], struct.pack(">ll", 0, 4))
+
+        # exceptions are reported to the kernel by the next regular RPC...
+        comm.received = (_rpc_batch([(0, b"i" + struct.pack(">l", -1)),
+                                     (0, b"i" + struct.pack(">l", 5))])
+                         + _rpc_request(1, b"")
+                         + _message(_D2HMsgType.KERNEL_FINISHED))
+        comm.serve(rpc_map, dict())
+        self.assertEqual(comm.sent[-8:],
+                         struct.pack(">ll", _RPCException.eid, 0))
+        self.assertEqual(received, [0, 1, 2, 3])
+
+        # ...or raised when the kernel finishes
+        comm.received = (_rpc_batch([(0, b"i" + struct.pack(">l", -1))])
+                         + _message(_D2HMsgType.KERNEL_FINISHED))
+        with self.assertRaises(ValueError):
+            comm.serve(rpc_map, dict())
+
+    def test_rpc_metrics(self):
+        comm = _Comm()
+
+        def fn(*args):
+            pass
+
+        @async_rpc
+        def async_fn(*args):
+            pass
+        comm.received = (_rpc_request(0, b"i" + struct.pack(">l", 1))
+                         + _rpc_request(0, _rpc_list(b"f", ">d", [(0.5, )]))
+                         + _rpc_batch([(1, b"i" + struct.pack(">l", 1))]*2)
+                         + _message(_D2HMsgType.KERNEL_FINISHED))
+        metrics = RPCMetrics(latency_budget=0.0)
+        with self.assertLogs("artiq.coredevice.rpc_wrapper", "WARNING") as cm:
+            comm.serve({0: fn, 1: async_fn}, dict(), metrics)
+        # one warning per RPC
+        self.assertEqual(len(cm.output), 1)
+
+        entry = metrics.entries[0]
+        self.assertEqual(entry["function"], fn.__qualname__)
+        self.assertEqual((entry["count"], entry["bytes"],
+                          entry["over_budget"]), (2, 29, 2))
+        self.assertGreater(entry["round_trip_time"], entry["host_time"])
+        entry = metrics.entries[1]
+        self.assertEqual((entry["count"], entry["bytes"],
+                          entry["round_trip_time"]), (2, 20, 0.0))
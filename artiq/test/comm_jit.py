@@ -0,0 +1,295 @@
+import unittest
+from fractions import Fraction
+
+import numpy
+import h5py
+
+from artiq.language.core import *
+from artiq.language.units import ns, us, MHz, GHz
+from artiq.coredevice import comm_jit
+from artiq.coredevice.core import Core
+from artiq.coredevice.ttl import TTLOut, TTLInOut
+from artiq.coredevice.dds import (DDSBus, AD9914, DDSTable,
+                                  PHASE_MODE_CONTINUOUS, PHASE_MODE_ABSOLUTE)
+from artiq.coredevice.runtime_exceptions import (RTIOUnderflow,
+                                                 DDSBatchError)
+from artiq.coredevice.histogram import Accumulator, Histogram
+
+
+class _UserException(Exception):
+    pass
+
+
+class _JITTest:
+    def __init__(self, dmgr):
+        self.core = dmgr.get("core")
+        self.ttl = TTLOut(dmgr, 2)
+        self.ttl_in = TTLInOut(dmgr, 3)
+        self.dds = AD9914(dmgr, 3*GHz, 4)
+        self.sweep = DDSTable(self.dds, numpy.linspace(100*MHz, 110*MHz, 5),
+                              amplitudes=[1.0, 0.5, 0.5, 0.5, 1.0])
+        self.dds_bus = DDSBus(dmgr)
+        self.dds_channels = [4, 5, 6, 7, 8]
+        self.dds_channels_short = [4, 5]
+        self.dds_channels_repeated = [4, 5, 6, 5, 8]
+        self.durations = numpy.array([1000, 2000, 3000], dtype=numpy.int32)
+        self.received = []
+        self.datasets = dict()
+        self.hist = Histogram(self, "hist", 4, lower=1, clamp=True)
+        self.acc = Accumulator(self, "acc")
+
+    def set_dataset(self, key, value, **kwargs):
+        self.datasets[key] = value
+
+    def receive(self, *args):
+        self.received.append(args)
+        return len(args)
+
+    @numpy_rpc
+    def receive_arrays(self, *args):
+        self.received.append(args)
+
+    @async_rpc
+    def receive_async(self, x):
+        self.received.append(x)
+
+    def fail(self):
+        raise _UserException
+
+    def serve_again(self):
+        # nested kernels are rejected without disturbing the running one
+        try:
+            self.core.comm.serve(dict(), dict())
+        except RuntimeError:
+            return 1
+        return 0
+
+    @kernel
+    def nested_serve(self):
+        self.receive(self.serve_again())
+
+    @kernel
+    def pulses(self):
+        for i in range(3):
+            self.ttl.pulse((i+1)*us)
+            delay(1*us)
+
+    @kernel
+    def rpc(self):
+        l = [0 for _ in range(3)]
+        for i in range(3):
+            l[i] = i + 1
+        lf = [0.5, 0.25]
+        n = self.receive(True, 42, int64(1) << 40, 1.5, Fraction(1, 3),
+                         l, lf)
+        self.receive(n)
+        self.receive_arrays(l, lf)
+
+    @kernel
+    def async_rpcs(self):
+        for i in range(3):
+            self.receive_async(i)
+        self.receive(4)
+
+    @kernel
+    def exceptions(self):
+        try:
+            self.fail()
+        except _UserException:
+            self.receive(1)
+        try:
+            raise _UserException
+        except _UserException:
+            self.receive(2)
+        self.fail()
+
+    @kernel
+    def underflow(self):
+        at_mu(int64(0))
+        self.ttl.on()
+
+    @kernel
+    def table(self):
+        for i in range(len(self.sweep.ftw)):
+            self.sweep.set(i)
+            delay(1*us)
+        for i in range(len(self.durations)):
+            delay_mu(int64(self.durations[i]))
+        self.receive(now_mu())
+
+    @kernel
+    def set_many(self):
+        self.dds_bus.set_many_mu(self.dds_channels, self.sweep.ftw,
+                                 self.sweep.pow, self.sweep.asf,
+                                 PHASE_MODE_ABSOLUTE)
+        delay(1*us)
+        # lists of different lengths
+        self.dds_bus.set_many_mu(self.dds_channels_short, self.sweep.ftw,
+                                 self.sweep.pow, self.sweep.asf)
+
+    @kernel
+    def set_many_repeated(self):
+        self.dds_bus.set_many_mu(self.dds_channels_repeated, self.sweep.ftw,
+                                 self.sweep.pow, self.sweep.asf)
+
+    @kernel
+    def count(self):
+        delay(50*ns)
+        self.ttl_in.gate_rising(10*us)
+        self.receive(self.ttl_in.count())
+
+    @kernel
+    def bulk_input(self):
+        t0 = now_mu()
+        self.ttl_in.gate_rising_mu(int64(10000))
+        offsets = [0 for _ in range(3)]
+        n = self.ttl_in.timestamps_mu(offsets, t0)
+        self.receive(n, offsets, self.ttl_in.count())
+
+        t0 = now_mu()
+        self.ttl_in.gate_rising_mu(int64(10000))
+        histogram = [0 for _ in range(4)]
+        n = self.ttl_in.histogram_mu(histogram, t0, 1000)
+        self.receive(n, histogram)
+
+    @kernel
+    def histogram(self):
+        for i in range(7):
+            self.hist.add(i)
+            self.acc.add(0.5*i)
+        self.hist.send()
+        self.acc.send()
+
+
+class JITCase(unittest.TestCase):
+    def setUp(self):
+        dmgr = dict()
+        dmgr["comm"] = comm_jit.Comm(dmgr)
+        dmgr["core"] = Core(dmgr, ref_period=1*ns)
+        self.comm = dmgr["comm"]
+        self.exp = _JITTest(dmgr)
+
+    def test_pulses(self):
+        self.exp.pulses()
+        events = self.comm.rtio.events
+        t0 = events[0][0]
+        self.assertEqual(
+            [(t - t0, channel, name, value)
+             for t, channel, name, value in events],
+            [(0, 2, "ttl_o", True), (1000, 2, "ttl_o", False),
+             (2000, 2, "ttl_o", True), (4000, 2, "ttl_o", False),
+             (5000, 2, "ttl_o", True), (8000, 2, "ttl_o", False)])
+        # the timeline continues across kernels
+        self.exp.pulses()
+        self.assertEqual(self.comm.rtio.events[6][0], t0 + 9000)
+
+    def test_rpc(self):
+        self.exp.rpc()
+        self.assertEqual(self.exp.received[:2], [
+            (True, 42, 1 << 40, 1.5, Fraction(1, 3), [1, 2, 3],
+             [0.5, 0.25]),
+            (7, )])
+        arrays = self.exp.received[2]
+        self.assertEqual(arrays[0].dtype, numpy.int32)
+        self.assertEqual(arrays[0].tolist(), [1, 2, 3])
+        self.assertEqual(arrays[1].tolist(), [0.5, 0.25])
+
+    def test_nested_serve(self):
+        self.exp.nested_serve()
+        self.assertEqual(self.exp.received, [(1, )])
+
+    def test_async_rpcs(self):
+        self.exp.async_rpcs()
+        self.assertEqual(self.exp.received, [0, 1, 2, (4, )])
+
+    def test_rpc_metrics(self):
+        self.exp.rpc()
+        self.exp.async_rpcs()
+        core = self.exp.core
+        entries = sorted(core.rpc_metrics.entries.values(),
+                         key=lambda entry: entry["function"])
+        self.assertEqual([(entry["function"], entry["count"])
+                          for entry in entries],
+                         [("_JITTest.receive", 1),
+                          ("_JITTest.receive_async", 3)])
+
+        f = h5py.File("rpc_metrics.h5", "w", driver="core",
+                      backing_store=False)
+        try:
+            core.write_hdf5(f)
+            metrics = f["rpc_metrics"][()]
+        finally:
+            f.close()
+        self.assertEqual(
+            [(row["kernel"], row["function"], row["count"])
+             for row in metrics],
+            [(b"_JITTest.rpc", b"_JITTest.receive", 2),
+             (b"_JITTest.rpc", b"_JITTest.receive_arrays", 1),
+             (b"_JITTest.async_rpcs", b"_JITTest.receive_async", 3),
+             (b"_JITTest.async_rpcs", b"_JITTest.receive", 1)])
+
+    def test_exceptions(self):
+        with self.assertRaises(_UserException):
+            self.exp.exceptions()
+        self.assertEqual(self.exp.received, [(1, ), (2, )])
+        # the runtime is in a clean state after an uncaught exception
+        self.exp.pulses()
+
+    def test_underflow(self):
+        self.comm.rtio.counter = 1000
+        with self.assertRaises(RTIOUnderflow) as cm:
+            self.exp.underflow()
+        self.assertEqual((cm.exception.p0, cm.exception.p1,
+                          cm.exception.p2), (0, 2, 1000))
+
+    def test_table(self):
+        self.comm.rtio.now = 0
+        self.exp.table()
+        events = self.comm.rtio.events
+        self.assertEqual([value for t, channel, name, value in events],
+                         [(ftw, 0, PHASE_MODE_CONTINUOUS, asf)
+                          for ftw, asf in zip(self.exp.sweep.ftw,
+                                              self.exp.sweep.asf)])
+        self.assertEqual(self.exp.received, [(11000, )])
+
+    def test_set_many(self):
+        self.comm.rtio.now = 0
+        sweep = self.exp.sweep
+        with self.assertRaises(DDSBatchError):
+            self.exp.set_many()
+        self.assertEqual(
+            self.comm.rtio.events,
+            [(0, channel, "dds", (ftw, pow, PHASE_MODE_ABSOLUTE, asf))
+             for channel, ftw, pow, asf in zip(self.exp.dds_channels,
+                                               sweep.ftw, sweep.pow,
+                                               sweep.asf)])
+
+    def test_set_many_repeated(self):
+        with self.assertRaises(DDSBatchError):
+            self.exp.set_many_repeated()
+        self.assertEqual(self.comm.rtio.events, [])
+
+    def test_bulk_input(self):
+        self.comm.rtio.now = 0
+        self.comm.rtio.inject_input(
+            3, [100, 200, 300, 400, 500,
+                10100, 11500, 11600, 13999, 14000, 19000])
+        self.exp.bulk_input()
+        self.assertEqual(self.exp.received, [
+            (3, [100, 200, 300], 2),
+            (6, [1, 2, 0, 1])])
+
+    def test_histogram(self):
+        self.exp.histogram()
+        counts = self.exp.datasets["hist"]
+        self.assertEqual(counts.dtype, numpy.int32)
+        self.assertEqual(counts.tolist(), [2, 1, 1, 3])
+        self.assertEqual(self.exp.hist.n, 7)
+        self.assertEqual(self.exp.datasets["acc"].tolist(), [7, 1.5, 1.0])
+
+    def test_input(self):
+        self.comm.rtio.now = 0
+        self.comm.rtio.inject_input(3, [100, 2000, 20000])
+        self.comm.rtio.inject_input(3, [10])
+        self.exp.count()
+        self.assertEqual(self.exp.received, [(2, )])
@@ -0,0 +1,36 @@
+import unittest
+import ast
+import tempfile
+import shutil
+import os
+
+from artiq.coredevice.compile_cache import CompileCache
+
+
+class CompileCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        f1 = ast.parse("def run():\n    x = 1").body[0]
+        f2 = ast.parse("def run():\n\n    x = 1").body[0]
+        f3 = ast.parse("def run():\n    x = 2").body[0]
+        key = CompileCache.key(f1, 1e-9, "or1k")
+        self.assertEqual(key, CompileCache.key(f2, 1e-9, "or1k"))
+        self.assertNotEqual(key, CompileCache.key(f3, 1e-9, "or1k"))
+        self.assertNotEqual(key, CompileCache.key(f1, 8e-9, "or1k"))
+        self.assertNotEqual(key, CompileCache.key(f1, 1e-9, "x86"))
+
+    def test_cache(self):
+        cache = CompileCache(self.tmpdir, max_entries=1)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", b"binary a")
+        cache.put("b", b"binary b")
+        self.assertEqual(cache.get("a"), b"binary a")
+        self.assertEqual(CompileCache(self.tmpdir).get("b"), b"binary b")
+        self.assertIsNone(CompileCache().get("b"))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ["a.elf", "b.elf"])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
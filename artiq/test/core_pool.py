@@ -0,0 +1,156 @@
+import unittest
+import asyncio
+import socket
+import struct
+import threading
+
+from artiq.coredevice.comm_generic import _H2DMsgType, _D2HMsgType
+from artiq.coredevice import comm_tcp
+from artiq.master import core_pool
+
+
+def _recv_exactly(sock, length):
+    r = b""
+    while len(r) < length:
+        data = sock.recv(length - len(r))
+        if not data:
+            raise EOFError
+        r += data
+    return r
+
+
+class _Device:
+    # Answers IDENT_REQUEST and SWITCH_CLOCK messages.
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(4)
+        self.port = self.listener.getsockname()[1]
+        self.connections = 0
+        self.requests = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+    def _serve(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve_connection, args=(sock, ),
+                             daemon=True).start()
+
+    def _reply(self, sock, ty, payload=b""):
+        sock.sendall(struct.pack(">llB", 0x5a5a5a5a, 9 + len(payload),
+                                 ty.value) + payload)
+
+    def _serve_connection(self, sock):
+        try:
+            _recv_exactly(sock, len(b"ARTIQ coredev\n"))
+            while True:
+                _, length, ty = struct.unpack(">llB",
+                                              _recv_exactly(sock, 9))
+                ty = _H2DMsgType(ty)
+                _recv_exactly(sock, length - 9)
+                self.requests.append(ty)
+                if ty == _H2DMsgType.IDENT_REQUEST:
+                    self._reply(sock, _D2HMsgType.IDENT_REPLY, b"AROR")
+                elif ty == _H2DMsgType.SWITCH_CLOCK:
+                    self._reply(sock, _D2HMsgType.CLOCK_SWITCH_COMPLETED)
+        except EOFError:
+            pass
+        finally:
+            sock.close()
+
+
+@unittest.skipUnless(core_pool.is_supported(),
+                     "no UNIX domain sockets on this platform")
+class CoreConnectionPoolCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.device = _Device()
+        self.pool = core_pool.CoreConnectionPool()
+        self.connections = core_pool.BorrowedConnections(
+            self._lend, self.pool.give_back)
+
+    def tearDown(self):
+        self.connections.release_all()
+        self.pool.close()
+        self.device.close()
+        self.loop.close()
+
+    def _lend(self, *args):
+        # the master calls the handler from its event loop
+        return self.loop.run_until_complete(self.pool.lend(*args))
+
+    def _comm(self):
+        dmgr = {"core_connection_pool": self.connections}
+        return comm_tcp.Comm(dmgr, "127.0.0.1", self.device.port)
+
+    def _session(self, comm):
+        comm.check_ident()
+        comm.switch_clock(False)
+
+    def test_reuse(self):
+        for i in range(3):
+            comm = self._comm()
+            self._session(comm)
+            self.connections.release_all()
+            self.assertFalse(hasattr(comm, "socket"))
+        self.assertEqual(self.device.connections, 1)
+        # the ident and clock are not requested again
+        self.assertEqual(self.device.requests, [
+            _H2DMsgType.IDENT_REQUEST, _H2DMsgType.SWITCH_CLOCK])
+
+        comm = self._comm()
+        comm.switch_clock(True)
+        self.assertEqual(self.device.requests[-1], _H2DMsgType.SWITCH_CLOCK)
+        self.assertEqual(len(self.device.requests), 3)
+
+    def test_lent(self):
+        comm1 = self._comm()
+        self._session(comm1)
+        # the connection is already lent, comm2 opens its own
+        comm2 = self._comm()
+        self._session(comm2)
+        self.assertFalse(comm2._borrowed)
+        self.assertEqual(self.device.connections, 2)
+        comm2.close()
+
+    def test_unknown_state(self):
+        comm = self._comm()
+        self._session(comm)
+        comm.run("kernel")
+        comm.close()
+        # a kernel was running, the connection has been closed
+        self._session(self._comm())
+        self.assertEqual(self.device.connections, 2)
+        self.assertEqual(self.device.requests[-2:], [
+            _H2DMsgType.IDENT_REQUEST, _H2DMsgType.SWITCH_CLOCK])
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0.05
+        self._session(self._comm())
+        self.connections.release_all()
+        self._session(self._comm())
+        self.connections.release_all()
+        self.assertEqual(self.device.connections, 1)
+        # the connection is closed, and the runtime can start the idle
+        # kernel
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+        self._session(self._comm())
+        self.assertEqual(self.device.connections, 2)
+
+    def test_borrower_died(self):
+        comm = self._comm()
+        self._session(comm)
+        # simulates the termination of the worker
+        self.connections._borrowers.pop(comm).close()
+        comm.socket.close()
+        del comm.socket
+        self._session(self._comm())
+        self.assertEqual(self.device.connections, 2)
@@ -0,0 +1,92 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+import numpy as np
+
+from artiq.protocols import pyon
+from artiq.master.databases import DatasetDB
+
+
+class DatasetDBCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.persist_file = os.path.join(self.tmpdir, "dataset_db.pyon")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def reload(self):
+        return DatasetDB(self.persist_file)
+
+    def test_journal(self):
+        ddb = self.reload()
+        ddb.set("a", 1, persist=True)
+        ddb.set("b", np.arange(10), persist=True)
+        ddb.set("c", 3)
+        ddb.save()
+        self.assertFalse(os.path.exists(self.persist_file))
+        self.assertTrue(os.path.exists(ddb.journal_file))
+
+        ddb.update({"action": "setitem", "path": [], "key": "a",
+                    "value": (True, 2)})
+        ddb.delete("b")
+        ddb.save()
+
+        ddb = self.reload()
+        self.assertEqual(ddb.data.read, {"a": (True, 2)})
+
+    def test_nested_mod(self):
+        ddb = self.reload()
+        ddb.set("l", [1, 2], persist=True)
+        ddb.update({"action": "append", "path": ["l", 1], "x": 3})
+        ddb.save()
+        ddb.update({"action": "append", "path": ["l", 1], "x": 4})
+        ddb.save()
+        self.assertEqual(self.reload().get("l"), [1, 2, 3, 4])
+
+    def test_unpersist(self):
+        ddb = self.reload()
+        ddb.set("a", 1, persist=True)
+        ddb.save()
+        ddb.set("a", 1, persist=False)
+        ddb.save()
+        self.assertEqual(self.reload().data.read, dict())
+
+    def test_compaction(self):
+        ddb = self.reload()
+        ddb.compact_threshold = 0
+        for i in range(10):
+            ddb.set("a", i, persist=True)
+            ddb.save()
+        self.assertEqual(pyon.load_file(self.persist_file), {"a": 9})
+        self.assertFalse(os.path.exists(ddb.journal_file))
+        self.assertEqual(self.reload().get("a"), 9)
+
+    def test_truncated_journal(self):
+        ddb = self.reload()
+        ddb.set("a", 1, persist=True)
+        ddb.save()
+        with open(ddb.journal_file, "a") as f:
+            f.write("{\"action\": \"setitem\", \"key\": \"a\", \"va")
+        ddb = self.reload()
+        self.assertEqual(ddb.get("a"), 1)
+        ddb.set("a", 2, persist=True)
+        ddb.save()
+        self.assertEqual(self.reload().get("a"), 2)
+
+    def test_journal_strings(self):
+        ddb = self.reload()
+        ddb.set("a", "x\ry\x0bz é", persist=True)
+        ddb.set("b", "é"*10, persist=True)
+        ddb.save()
+        with open(ddb.journal_file, "ab") as f:
+            f.write("{\"action\": \"setitem\", \"key\": \"é".encode())
+        ddb = self.reload()
+        self.assertEqual(ddb.get("a"), "x\ry\x0bz é")
+        ddb.set("c", 3, persist=True)
+        ddb.save()
+        ddb = self.reload()
+        self.assertEqual(ddb.get("b"), "é"*10)
+        self.assertEqual(ddb.get("c"), 3)
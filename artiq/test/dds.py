@@ -0,0 +1,63 @@
+import unittest
+from types import SimpleNamespace
+
+import numpy
+
+from artiq.language.units import MHz, GHz, ns
+from artiq.coredevice.dds import (AD9858, AD9914, DDSTable,
+                                  programming_cost)
+from artiq.coredevice.ttl import TTLClockGen
+
+
+class ConversionCase(unittest.TestCase):
+    def setUp(self):
+        dmgr = {"core": SimpleNamespace(ref_period=1*ns)}
+        self.ad9858 = AD9858(dmgr, 1*GHz, 0)
+        self.ad9914 = AD9914(dmgr, 3*GHz, 1)
+        self.clock = TTLClockGen(dmgr, 2)
+
+    def test_dds(self):
+        frequencies = numpy.linspace(0, 400*MHz, 1001)
+        turns = numpy.linspace(0, 1, 101)
+        amplitudes = numpy.linspace(0, 1, 101)
+        for dds in self.ad9858, self.ad9914:
+            ftw = dds.frequency_to_ftw_array(frequencies)
+            self.assertEqual(ftw.dtype, numpy.int32)
+            self.assertEqual(ftw.tolist(),
+                             [dds.frequency_to_ftw(f) for f in frequencies])
+            self.assertEqual(dds.turns_to_pow_array(turns).tolist(),
+                             [dds.turns_to_pow(t) for t in turns])
+            self.assertEqual(dds.amplitude_to_asf_array(amplitudes).tolist(),
+                             [dds.amplitude_to_asf(a) for a in amplitudes])
+
+    def test_ftw_wrap(self):
+        ftw = self.ad9858.frequency_to_ftw_array([750*MHz])
+        self.assertEqual(int(ftw[0]) & 0xffffffff,
+                         self.ad9858.frequency_to_ftw(750*MHz))
+
+    def test_ttl_clock(self):
+        frequencies = numpy.linspace(0, 50*MHz, 1001)
+        self.assertEqual(
+            self.clock.frequency_to_ftw_array(frequencies).tolist(),
+            [self.clock.frequency_to_ftw(f) for f in frequencies])
+
+    def test_table(self):
+        table = DDSTable(self.ad9914, [100*MHz, 200*MHz], phases=0.5)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.ftw, [self.ad9914.frequency_to_ftw(100*MHz),
+                                     self.ad9914.frequency_to_ftw(200*MHz)])
+        self.assertEqual(table.pow, [0x8000, 0x8000])
+        self.assertEqual(table.asf, [0x0fff, 0x0fff])
+        self.assertIs(type(table.ftw[0]), int)
+
+    def test_programming_cost(self):
+        self.assertEqual(programming_cost(AD9858, 1), (1, 9))
+        self.assertEqual(programming_cost(AD9914, 8), (8, 56))
+        # same phase mode as before, no configuration register writes
+        self.assertEqual(programming_cost(AD9914, 8, "set_many"), (1, 48))
+        self.assertEqual(programming_cost(AD9914, 8, "set_many",
+                                          onehot_sel=True), (1, 42))
+        self.assertEqual(programming_cost(AD9914, 8, "set_many",
+                                          phase_mode_changes=8), (1, 56))
+        with self.assertRaises(ValueError):
+            programming_cost(AD9914, 8, "batch")
@@ -29,5 +29,6 @@ class TypesCase(unittest.TestCase):
             d["f"+str(size)] = ty(42)
             d["f{}list".format(size)] = [ty(x) for x in range(3)]
 
-        with h5py.File("h5types.h5", "w") as f:
+        with h5py.File("h5types.h5", "w", driver="core",
+                       backing_store=False) as f:
             result_dict_to_hdf5(f, d)
@@ -0,0 +1,51 @@
+import unittest
+
+import numpy
+
+from artiq.coredevice.histogram import Accumulator, Histogram
+
+
+class _Environment:
+    def __init__(self):
+        self.datasets = dict()
+
+    def set_dataset(self, key, value, broadcast=False, persist=False,
+                    save=True):
+        self.datasets[key] = value
+
+
+class HistogramCase(unittest.TestCase):
+    def setUp(self):
+        self.env = _Environment()
+
+    def test_accumulator(self):
+        acc = Accumulator(self.env, "acc")
+        for value in 1, 2, 3, 6:
+            acc.add(value)
+        acc.send()
+        self.assertEqual(acc.n, 4)
+        self.assertEqual(acc.mean, 3.0)
+        self.assertAlmostEqual(acc.variance, 3.5)
+        self.assertEqual(self.env.datasets["acc"].tolist(), [4, 3.0, 3.5])
+        acc.reset()
+        self.assertEqual(acc.n, 0)
+
+    def test_histogram(self):
+        hist = Histogram(self.env, "hist", 4, lower=10, bin_width=5)
+        for value in 9, 10, 14, 15, 29, 30:
+            hist.add(value)
+        hist.send()
+        counts = self.env.datasets["hist"]
+        self.assertEqual(counts.dtype, numpy.int32)
+        self.assertEqual(counts.tolist(), [2, 1, 0, 1])
+        self.assertEqual(hist.n, 6)
+
+    def test_clamp(self):
+        hist = Histogram(self.env, "hist", 3, clamp=True)
+        for value in -1, 0, 2, 5:
+            hist.add(value)
+        self.assertEqual(hist.counts.tolist(), [2, 0, 2])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Histogram(self.env, "hist", 0)
@@ -0,0 +1,55 @@
+import unittest
+import asyncio
+
+from artiq.protocols import sync_struct
+from artiq.master.metrics import (Metrics, MetricsServer,
+                                  add_publisher_metrics)
+
+test_address = "::1"
+test_port = 7778
+
+
+class MetricsCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def test_notifier(self):
+        metrics = Metrics()
+        count = [0]
+        metrics.add_family("test_total", "counter", "Test counter.",
+                           lambda: [("", {"a": "x"}, count[0])])
+        metrics.update_notifier()
+        self.assertEqual(metrics.notifier.read, {"test_total{a=\"x\"}": 0})
+        count[0] = 10
+        metrics.update_notifier()
+        self.assertEqual(metrics.notifier.read["test_total{a=\"x\"}"], 10)
+        self.assertGreater(metrics.notifier.read["test_total_rate{a=\"x\"}"],
+                           0)
+
+    async def _do_test_http(self):
+        notifier = sync_struct.Notifier(dict())
+        publisher = sync_struct.Publisher({"test": notifier})
+        metrics = Metrics()
+        add_publisher_metrics(metrics, publisher)
+        server = MetricsServer(metrics)
+        await server.start(test_address, test_port)
+        try:
+            reader, writer = await asyncio.open_connection(test_address,
+                                                           test_port)
+            writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = (await reader.read()).decode()
+            writer.close()
+        finally:
+            await server.stop()
+        header, body = response.split("\r\n\r\n", 1)
+        self.assertTrue(header.startswith("HTTP/1.0 200 OK"))
+        self.assertIn("# TYPE artiq_publisher_bytes_total counter", body)
+        self.assertIn("artiq_publisher_subscribers{notifier=\"test\"} 0.0",
+                      body)
+
+    def test_http(self):
+        self.loop.run_until_complete(self._do_test_http())
+
+    def tearDown(self):
+        self.loop.close()
@@ -3,6 +3,8 @@ import logging
 import asyncio
 import sys
 import os
+import tempfile
+import shutil
 from time import time, sleep
 
 from artiq import *
@@ -65,6 +67,10 @@ def _get_basic_steps(rid, expid, priority=0, flush=False):
 
 class SchedulerCase(unittest.TestCase):
     def setUp(self):
+        # the workers write their results into the current directory
+        self.cwd = os.getcwd()
+        self.results_dir = tempfile.mkdtemp()
+        os.chdir(self.results_dir)
         if os.name == "nt":
             self.loop = asyncio.ProactorEventLoop()
         else:
@@ -199,3 +205,5 @@ class SchedulerCase(unittest.TestCase):
 
     def tearDown(self):
         self.loop.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.results_dir)
@@ -1,9 +1,24 @@
 import unittest
 import ast
+import os
+import time
+import tempfile
+import shutil
 
-from artiq import ns
+from artiq import ns, us
+from artiq.language.core import kernel, delay
 from artiq.coredevice import comm_dummy, core
 from artiq.transforms.unparse import unparse
+from artiq.transforms.inline import inline, _parse_cache
+from artiq.transforms.unroll_loops import unroll_loops
+from artiq.transforms.interleave import interleave
+from artiq.transforms.fold_constants import fold_constants
+from artiq.transforms.remove_inter_assigns import remove_inter_assigns
+from artiq.transforms.tools import count_all_nodes
+from artiq.tools import file_import
+from artiq.master.databases import DeviceDB, DatasetDB
+from artiq.master.worker_db import DeviceManager, DatasetManager
+from artiq.frontend.artiq_run import DummyScheduler
 
 
 optimize_in = """
@@ -33,6 +48,27 @@ def run():
         syscall('now_save', now)
 """
 
+# Each branch is only removed once the previous one has been, which takes
+# more rounds of the simplification passes than the fixed sequence of two
+# rounds that was used before.
+chained_branches_in = """
+
+def run():
+    mode = 1
+    if mode == 2:
+        mode = 3
+    a = mode
+    if a == 2:
+        a = 3
+    b = a
+    if b == 2:
+        b = 4
+    c = b
+    if c == 2:
+        c = 5
+    do_something(c)
+"""
+
 
 class OptimizeCase(unittest.TestCase):
     def test_optimize(self):
@@ -42,3 +78,340 @@ class OptimizeCase(unittest.TestCase):
         func_def = ast.parse(optimize_in).body[0]
         coredev.transform_stack(func_def, dict(), dict())
         self.assertEqual(unparse(func_def), optimize_out)
+
+    def test_chained_branches(self):
+        dmgr = dict()
+        dmgr["comm"] = comm_dummy.Comm(dmgr)
+        coredev = core.Core(dmgr, ref_period=1*ns)
+        func_def = ast.parse(chained_branches_in).body[0]
+        coredev.transform_stack(func_def, dict(), dict())
+        self.assertEqual(unparse(func_def),
+                         optimize_out.replace("do_something(344)",
+                                              "do_something(1)"))
+
+    def test_stats(self):
+        dmgr = dict()
+        dmgr["comm"] = comm_dummy.Comm(dmgr)
+        coredev = core.Core(dmgr, ref_period=1*ns)
+        func_def = ast.parse(optimize_in).body[0]
+        stats = []
+        coredev.transform_stack(func_def, dict(), dict(), stats=stats)
+        self.assertEqual(stats[0]["name"], "remove_inter_assigns_1")
+        self.assertTrue(all(s["time"] >= 0 for s in stats))
+        self.assertFalse(any("nodes_before" in s for s in stats))
+        # the last runs of the simplification passes that are run again
+        # after themselves reached the fixed point
+        for name in "remove_inter_assigns", "remove_dead_code":
+            last = [s for s in stats if s["name"].startswith(name)][-1]
+            self.assertFalse(last["changed"])
+
+    def test_stats_nodes(self):
+        dmgr = dict()
+        dmgr["comm"] = comm_dummy.Comm(dmgr)
+        coredev = core.Core(dmgr, ref_period=1*ns)
+        func_def = ast.parse(optimize_in).body[0]
+        nodes = count_all_nodes(func_def)
+        stats = []
+        coredev.transform_stack(func_def, dict(), dict(), stats=stats,
+                                count_nodes=True)
+        self.assertEqual(stats[0]["nodes_before"], nodes)
+        self.assertEqual(stats[-1]["nodes_after"], count_all_nodes(func_def))
+        for previous, s in zip(stats, stats[1:]):
+            self.assertEqual(s["nodes_before"], previous["nodes_after"])
+
+    def test_changed(self):
+        func_def = ast.parse("def run():\n"
+                             "    f(-1, int64(1), Fraction(1, 3), 1 < 2)\n"
+                             "    x = y\n"
+                             "    g(x)\n").body[0]
+        self.assertTrue(fold_constants(func_def))
+        # constants that fold into themselves are not a change
+        self.assertFalse(fold_constants(func_def))
+        self.assertTrue(remove_inter_assigns(func_def))
+        self.assertFalse(remove_inter_assigns(func_def))
+
+
+unroll_in = """
+
+def run():
+    for i in [Fraction(1, 2), 0.5]:
+        f(i)
+    for i in [Fraction(1, 2), Fraction(1, 4)]:
+        f(i)
+    for i in range(1, 10, 2):
+        f(i)
+        g(i)
+    for i in unroll(range(5), 1):
+        f(i)
+    for i in unroll(range(5), 2):
+        f(i)
+"""
+
+unroll_out = """
+
+def run():
+    for i in [Fraction(1, 2), 0.5]:
+        f(i)
+    i = Fraction(1, 2)
+    f(i)
+    i = Fraction(1, 4)
+    f(i)
+    for i_unroll0 in range(1, 9, 4):
+        i = i_unroll0
+        f(i)
+        g(i)
+        i = (i_unroll0 + 2)
+        f(i)
+        g(i)
+    i = 9
+    f(i)
+    g(i)
+    for i in range(5):
+        f(i)
+    for i_unroll1 in range(0, 4, 2):
+        i = i_unroll1
+        f(i)
+        i = (i_unroll1 + 1)
+        f(i)
+    i = 4
+    f(i)
+"""
+
+
+class UnrollCase(unittest.TestCase):
+    def test_unroll(self):
+        func_def = ast.parse(unroll_in).body[0]
+        self.assertTrue(unroll_loops(func_def, code_limit=9))
+        self.assertEqual(unparse(func_def), unroll_out)
+
+    def test_parallel(self):
+        func_def = ast.parse("""
+def run():
+    with parallel:
+        for i in range(100):
+            delay_mu(10)
+        for i in range(100):
+            f()
+""").body[0]
+        unroll_loops(func_def, code_limit=64)
+        loops = [node for node in ast.walk(func_def)
+                 if isinstance(node, ast.For)]
+        # only the loop that does not advance the timeline is kept, and
+        # partially unrolled
+        self.assertEqual(len(loops), 1)
+        self.assertFalse(any(isinstance(node, ast.Call)
+                             and node.func.id == "delay_mu"
+                             for node in ast.walk(loops[0])))
+
+    def test_attribute_target(self):
+        src = ("def run():\n"
+               "    for x.i in range(100):\n"
+               "        f(x.i)\n"
+               "    else:\n"
+               "        g()\n")
+        func_def = ast.parse(src).body[0]
+        self.assertFalse(unroll_loops(func_def, code_limit=64))
+        self.assertEqual(ast.dump(func_def),
+                         ast.dump(ast.parse(src).body[0]))
+
+    def test_invalid_hint(self):
+        for src in ["def run():\n    x = unroll(range(10))",
+                    "def run():\n    for i in unroll(l, 2):\n        f(i)",
+                    "def run():\n    for i in unroll([1, 2, 3], 2):\n"
+                    "        f(i)",
+                    "def run():\n    for x.i in unroll(range(10), 2):\n"
+                    "        f(x.i)"]:
+            func_def = ast.parse(src).body[0]
+            self.assertRaises(ValueError, unroll_loops, func_def)
+
+
+def _parallel_pulses(n):
+    # n TTL pulses starting 3 machine units apart, in separate branches
+    return "def run():\n    with parallel:\n" + "".join(
+        "        with sequential:\n"
+        "            delay_mu({})\n"
+        "            ttl_on({})\n"
+        "            delay_mu(10)\n"
+        "            ttl_off({})\n".format(3*i, i, i)
+        for i in range(n))
+
+
+interleave_out = """
+
+def run():
+    delay_mu(0)
+    ttl_on(0)
+    delay_mu(3)
+    ttl_on(1)
+    delay_mu(3)
+    ttl_on(2)
+    delay_mu(4)
+    ttl_off(0)
+    delay_mu(3)
+    ttl_off(1)
+    delay_mu(3)
+    ttl_off(2)
+"""
+
+
+class InterleaveCase(unittest.TestCase):
+    def test_interleave(self):
+        func_def = ast.parse(_parallel_pulses(3)).body[0]
+        interleave(func_def)
+        self.assertEqual(unparse(func_def), interleave_out)
+
+    def test_indeterminate(self):
+        func_def = ast.parse("""
+def run():
+    with parallel:
+        f()
+        at_mu(3)
+""").body[0]
+        interleave(func_def)
+        self.assertIsInstance(func_def.body[0], ast.With)
+
+
+class _InlineTest:
+    def __init__(self, core):
+        self.core = core
+
+    @kernel
+    def pulse(self, t):
+        delay(t*us)
+
+    @kernel
+    def run(self):
+        self.pulse(1)
+        self.pulse(2)
+        self.pulse(3)
+
+
+class InlineCase(unittest.TestCase):
+    def test_parse_cache(self):
+        dmgr = dict()
+        dmgr["comm"] = comm_dummy.Comm(dmgr)
+        coredev = core.Core(dmgr)
+        exp = _InlineTest(coredev)
+        k_function = _InlineTest.run.k_function_info.k_function
+        _parse_cache._entries.clear()
+        stats = dict()
+        func_def = inline(coredev, k_function, (exp, ), dict(), True,
+                          stats)[0]
+        self.assertEqual((stats["parse_cache_hits"],
+                          stats["parse_cache_misses"]), (2, 2))
+        stats = dict()
+        func_def2 = inline(coredev, k_function, (exp, ), dict(), True,
+                           stats)[0]
+        self.assertEqual((stats["parse_cache_hits"],
+                          stats["parse_cache_misses"]), (4, 0))
+        self.assertEqual(ast.dump(func_def), ast.dump(func_def2))
+
+
+class _PrecompileTest:
+    def __init__(self, core):
+        self.core = core
+        self.n = 10
+
+    @kernel
+    def first(self):
+        for i in range(self.n):
+            delay(1*us)
+
+    @kernel
+    def second(self, x):
+        delay(x*us)
+
+
+class PrecompileCase(unittest.TestCase):
+    def test_precompile(self):
+        dmgr = dict()
+        dmgr["comm"] = comm_dummy.Comm(dmgr)
+        coredev = core.Core(dmgr)
+        exp = _PrecompileTest(coredev)
+        stats = coredev.precompile([exp.first, (exp.second, (2, )),
+                                    (exp.second, (3, ))])
+        self.assertEqual([s["cache_hit"] for s in stats],
+                         [False, False, False])
+        self.assertEqual(len(coredev.compile_cache._entries), 3)
+        for k_args in (), (2, ), (3, ):
+            method = exp.second if k_args else exp.first
+            _, _, _, stats = coredev.compile(
+                method.k_function_info.k_function, (exp, ) + k_args, dict())
+            self.assertTrue(stats["cache_hit"])
+        self.assertEqual(coredev.precompile([exp.first])[0]["cache_hit"],
+                         True)
+        self.assertRaises(ValueError, coredev.precompile, [exp.__init__])
+
+        # the process pool is reused
+        pool = coredev._compile_pool
+        coredev.precompile([(exp.second, (4, )), (exp.second, (5, ))])
+        self.assertIs(coredev._compile_pool, pool)
+        coredev.close()
+        self.assertIsNone(coredev._compile_pool)
+
+
+examples = os.path.join(os.path.dirname(__file__),
+                        os.pardir, os.pardir, "examples", "master")
+
+
+@unittest.skipUnless(os.getenv("ARTIQ_BENCHMARK"), "no ARTIQ_BENCHMARK")
+class TransformBenchmark(unittest.TestCase):
+    """Measures the duration of the transform stack on the kernels of the
+    example experiments."""
+    experiments = [
+        ("dds_test.py", "DDSTest"),
+        ("mandelbrot.py", "Mandelbrot"),
+        ("photon_histogram.py", "PhotonHistogram"),
+        ("speed_benchmark.py", "_PayloadCoreSend100Ints"),
+        ("speed_benchmark.py", "_PayloadCorePrimes")
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.device_mgr = DeviceManager(
+            DeviceDB(os.path.join(examples, "device_db.pyon")),
+            virtual_devices={"scheduler": DummyScheduler()})
+        self.dataset_mgr = DatasetManager(
+            DatasetDB(os.path.join(self.tmpdir, "dataset_db.pyon")))
+
+    def tearDown(self):
+        self.device_mgr.close_devices()
+        shutil.rmtree(self.tmpdir)
+
+    def test_transform_stack(self):
+        for file, class_name in self.experiments:
+            module = file_import(os.path.join(examples, "repository", file))
+            exp = getattr(module, class_name)
+            exp_inst = exp(self.device_mgr, self.dataset_mgr,
+                           default_arg_none=True)
+            k_function = exp.run.k_function_info.k_function
+            best = None
+            for i in range(5):
+                func_def, rpc_map, exception_map = inline(
+                    exp_inst.core, k_function, [exp_inst], dict(), True)
+                stats = []
+                t0 = time.monotonic()
+                exp_inst.core.transform_stack(func_def, rpc_map,
+                                              exception_map, stats=stats)
+                t = time.monotonic() - t0
+                if best is None or t < best:
+                    best = t
+            print("{:25} {:8.1f}ms {:3d} passes {:6d} nodes".format(
+                class_name, best*1e3, len(stats), count_all_nodes(func_def)))
+
+    def test_parallel_pulses(self):
+        dmgr = dict()
+        dmgr["comm"] = comm_dummy.Comm(dmgr)
+        coredev = core.Core(dmgr, ref_period=1*ns)
+        for n in 100, 300, 1000:
+            func_def = ast.parse(_parallel_pulses(n)).body[0]
+            t0 = time.monotonic()
+            interleave(func_def)
+            t_interleave = time.monotonic() - t0
+            func_def = ast.parse(_parallel_pulses(n)).body[0]
+            t0 = time.monotonic()
+            coredev.transform_stack(func_def, dict(), dict())
+            t_stack = time.monotonic() - t0
+            print("{:4d} parallel pulses: interleave {:8.1f}ms, "
+                  "transform stack {:8.1f}ms".format(
+                      n, t_interleave*1e3, t_stack*1e3))
@@ -3,10 +3,19 @@ import logging
 import asyncio
 import sys
 import os
+import tempfile
+import shutil
+import tracemalloc
+import glob
 from time import sleep
 
+import numpy as np
+import h5py
+
 from artiq import *
 from artiq.master.worker import *
+from artiq.master.databases import DatasetDB
+from artiq.master.shm import SharedDatasets
 
 
 class SimpleExperiment(EnvExperiment):
@@ -44,6 +53,35 @@ class WatchdogTimeout(EnvExperiment):
             sleep(100.0)
 
 
+class DatasetCache(EnvExperiment):
+    def build(self):
+        self.setattr_device("scheduler")
+
+    def run(self):
+        for i in range(3):
+            assert self.get_dataset("a") == 1
+        self.set_dataset("a", 2, broadcast=True, save=False)
+        assert self.get_dataset("a") == 2
+        assert self.get_dataset("b") == 0
+        # modifies "b" in the master
+        self.scheduler.submit("main", dict(), 0, None, False)
+        for i in range(2):
+            assert self.get_dataset("b") == 5
+
+
+class SharedDataset(EnvExperiment):
+    def build(self):
+        pass
+
+    def run(self):
+        a = self.get_dataset("a")
+        assert (a == np.arange(100000)).all()
+        self.set_dataset("b", 2*a, broadcast=True)
+        # copy-on-write
+        a[0] = 42
+        assert self.get_dataset("a")[0] == 0
+
+
 class WatchdogTimeoutInBuild(EnvExperiment):
     def build(self):
         with watchdog(0.1*s):
@@ -59,24 +97,32 @@ async def _call_worker(worker, expid):
         await worker.prepare()
         await worker.run()
         await worker.analyze()
+        await worker.write_results()
     finally:
         await worker.close()
 
 
-def _run_experiment(class_name):
+def _run_experiment(class_name, worker=None, **expid_options):
     expid = {
         "log_level": logging.WARNING,
         "file": sys.modules[__name__].__file__,
         "class_name": class_name,
         "arguments": dict()
     }
+    expid.update(expid_options)
     loop = asyncio.get_event_loop()
-    worker = Worker(handlers={"log": lambda message: None})
+    if worker is None:
+        worker = Worker(handlers={"log": lambda message: None})
     loop.run_until_complete(_call_worker(worker, expid))
+    return worker
 
 
 class WorkerCase(unittest.TestCase):
     def setUp(self):
+        # the workers write their results into the current directory
+        self.cwd = os.getcwd()
+        self.results_dir = tempfile.mkdtemp()
+        os.chdir(self.results_dir)
         if os.name == "nt":
             self.loop = asyncio.ProactorEventLoop()
         else:
@@ -86,6 +132,124 @@ class WorkerCase(unittest.TestCase):
     def test_simple_run(self):
         _run_experiment("SimpleExperiment")
 
+    def test_profile(self):
+        worker = _run_experiment("WatchdogNoTimeout", profile=True)
+        stages = {"build", "prepare", "run", "analyze", "write_results"}
+        self.assertEqual(set(worker.profile.keys()), stages)
+        self.assertGreater(worker.profile["run"]["wall"], 0.9)
+        filename, = glob.glob(os.path.join("results", "*", "*", "*.h5"))
+        with h5py.File(filename, "r") as f:
+            self.assertEqual(set(f["profile"].keys()), stages)
+            self.assertIn("master_wall", f["profile"]["run"])
+            self.assertIn("wall", f["profile"]["write_results"])
+        self.assertIsNone(_run_experiment("SimpleExperiment").profile)
+
+    def test_profile_tracemalloc(self):
+        # not imported at the top: this module is also imported by the
+        # worker process, where worker_impl is __main__
+        from artiq.master.worker_impl import StageProfiler
+
+        profiler = StageProfiler()
+        profiler.configure(["tracemalloc"])
+        with profiler.stage("run"):
+            pass
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertIn("tracemalloc_peak", profiler.results["run"])
+
+        # tracing enabled outside the profiler is left enabled
+        tracemalloc.start()
+        try:
+            with profiler.stage("analyze"):
+                pass
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+        self.assertNotIn("tracemalloc_peak", profiler.results["analyze"])
+
+    def test_dataset_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ddb = DatasetDB(os.path.join(tmpdir, "dataset_db.pyon"))
+            ddb.set("a", 1)
+            ddb.set("b", 0)
+            fetched = []
+            def get_dataset(key):
+                fetched.append(key)
+                return ddb.get(key)
+            handlers = {
+                "log": lambda message: None,
+                "get_dataset": get_dataset,
+                "update_dataset": ddb.update,
+                "scheduler_submit": lambda **kwargs: ddb.set("b", 5)
+            }
+            worker = Worker(handlers, dataset_db=ddb)
+            _run_experiment("DatasetCache", worker)
+            self.assertEqual(fetched, ["a", "a", "b", "b"])
+            self.assertEqual(ddb.watchers, set())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_shared_dataset(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ddb = DatasetDB(os.path.join(tmpdir, "dataset_db.pyon"))
+            shared_datasets = SharedDatasets(ddb)
+            ddb.set("a", np.arange(100000))
+            handlers = {
+                "log": lambda message: None,
+                "get_dataset_shm": shared_datasets.get,
+                "update_dataset_shm": shared_datasets.update,
+                "make_dataset_shm_directory":
+                    shared_datasets.make_worker_directory
+            }
+            worker = Worker(handlers, dataset_db=ddb)
+            _run_experiment("SharedDataset", worker)
+            self.assertTrue((ddb.get("b") == 2*np.arange(100000)).all())
+            self.assertEqual(ddb.get("a")[0], 0)
+            self.assertEqual(len(os.listdir(shared_datasets.directory)), 1)
+            ddb.set("a", 0)
+            self.assertEqual(os.listdir(shared_datasets.directory), [])
+            shared_datasets.close()
+            self.assertFalse(os.path.exists(shared_datasets.directory))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_shared_dataset_foreign_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ddb = DatasetDB(os.path.join(tmpdir, "dataset_db.pyon"))
+            shared_datasets = SharedDatasets(ddb)
+            victim = os.path.join(tmpdir, "victim")
+            open(victim, "w").close()
+            own = shared_datasets.make_worker_directory(1)
+            other = shared_datasets.make_worker_directory(2)
+            os.symlink(victim, os.path.join(own, "link"))
+            for filename in [victim, os.path.join(own, "link"),
+                             os.path.join(other, "segment"),
+                             os.path.join(own, "..", "..", "victim")]:
+                mod = {"action": "setitem", "path": [], "key": "a",
+                       "value": (False, {"file": filename, "dtype": "<i8",
+                                         "shape": (0, )})}
+                with self.assertRaises(ValueError):
+                    shared_datasets.update(1, mod)
+            self.assertTrue(os.path.exists(victim))
+            shared_datasets.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_shared_dataset_unlinked(self):
+        # not imported at the top: this module is also imported by the
+        # worker process, where worker_impl is __main__
+        from artiq.master.worker_impl import ParentDatasetDB
+
+        # the master has deleted the segment after sending its handle
+        ddb = ParentDatasetDB()
+        ddb.shm = True
+        ddb._get_shm = lambda key: ("shm", {"file": "/nonexistent",
+                                            "dtype": "<i8", "shape": (3, )})
+        ddb._get = lambda key: np.arange(3)
+        self.assertEqual(ddb.get("a").tolist(), [0, 1, 2])
+
     def test_exception(self):
         with self.assertRaises(WorkerError):
             _run_experiment("ExceptionTermination")
@@ -103,3 +267,5 @@ class WorkerCase(unittest.TestCase):
 
     def tearDown(self):
         self.loop.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.results_dir)
@@ -45,6 +45,17 @@ _ast_boolops = {
 
 
 class _ConstantFolder(ast.NodeTransformer):
+    def __init__(self):
+        self.changed = False
+
+    def replace(self, node, result):
+        # Folding constants (e.g. int64(1) or -1) may yield the same tree,
+        # which must not be reported as a change.
+        result = ast.copy_location(result, node)
+        if ast.dump(result) != ast.dump(node):
+            self.changed = True
+        return result
+
     def visit_UnaryOp(self, node):
         self.generic_visit(node)
         try:
@@ -59,7 +70,7 @@ class _ConstantFolder(ast.NodeTransformer):
             result = value_to_ast(op(operand))
         except:
             return node
-        return ast.copy_location(result, node)
+        return self.replace(node, result)
 
     def visit_BinOp(self, node):
         self.generic_visit(node)
@@ -75,7 +86,7 @@ class _ConstantFolder(ast.NodeTransformer):
             result = value_to_ast(op(left, right))
         except:
             return node
-        return ast.copy_location(result, node)
+        return self.replace(node, result)
 
     def visit_Compare(self, node):
         self.generic_visit(node)
@@ -100,7 +111,7 @@ class _ConstantFolder(ast.NodeTransformer):
                     else ast.copy_location(value_to_ast(operand), node)
                     for operand in operands]
         if len(operands) == 1:
-            return operands[0]
+            return self.replace(node, operands[0])
         else:
             node.left = operands[0]
             node.right = operands[1:]
@@ -123,6 +134,8 @@ class _ConstantFolder(ast.NodeTransformer):
                     new_values.append(value_c)
         new_values = [v if isinstance(v, ast.AST) else value_to_ast(v)
                       for v in new_values]
+        if len(new_values) < len(node.values):
+            self.changed = True
         if len(new_values) > 1:
             node.values = new_values
             return node
@@ -147,10 +160,12 @@ class _ConstantFolder(ast.NodeTransformer):
                 except NotConstant:
                     return node
             result = value_to_ast(constant_ops[fn](*args))
-            return ast.copy_location(result, node)
+            return self.replace(node, result)
         else:
             return node
 
 
 def fold_constants(node):
-    _ConstantFolder().visit(node)
+    constant_folder = _ConstantFolder()
+    constant_folder.visit(node)
+    return constant_folder.changed
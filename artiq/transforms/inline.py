@@ -1,8 +1,12 @@
+import os
+import time
 import inspect
+import linecache
 import textwrap
 import ast
 import types
 import builtins
+import weakref
 from fractions import Fraction
 from collections import OrderedDict
 from functools import partial
@@ -112,6 +116,53 @@ def get_function_args(func_args, func_tr, args, kwargs):
     return r
 
 
+class _ParseCache:
+    """Cache of the source of the functions being inlined, keyed on the
+    function and the modification time of the file that contains it.
+
+    Retrieving the source with ``inspect.getsource`` is an order of
+    magnitude slower than parsing it, and a function (e.g. a driver method)
+    is typically inlined at many call sites. The source is parsed again for
+    each call site, which is faster than copying a cached AST and provides
+    a new tree that the inliner is free to modify.
+    """
+    def __init__(self):
+        # function -> (mtime, source, duration of the initial retrieval)
+        self._entries = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+
+    def parse(self, func):
+        try:
+            mtime = os.stat(func.__code__.co_filename).st_mtime
+        except (AttributeError, OSError):
+            mtime = None
+        try:
+            entry_mtime, source, retrieval_time = self._entries[func]
+        except KeyError:
+            pass
+        else:
+            if mtime is not None and entry_mtime == mtime:
+                self.hits += 1
+                self.time_saved += retrieval_time
+                return ast.parse(source).body[0]
+        if mtime is not None:
+            # Read the file into the line cache first, so that the
+            # retrieval time does not include the initial read, which is
+            # shared by all the functions of a file.
+            linecache.getlines(func.__code__.co_filename)
+        t0 = time.monotonic()
+        source = textwrap.dedent(inspect.getsource(func))
+        retrieval_time = time.monotonic() - t0
+        self.misses += 1
+        if mtime is not None:
+            self._entries[func] = mtime, source, retrieval_time
+        return ast.parse(source).body[0]
+
+_parse_cache = _ParseCache()
+
+
 # args/kwargs can contain values or AST nodes
 def get_inline(core, attribute_namespace, in_use_names, retval_name, mappers,
                func, args, kwargs):
@@ -119,7 +170,7 @@ def get_inline(core, attribute_namespace, in_use_names, retval_name, mappers,
     func_tr = Function(core,
                        global_namespace, attribute_namespace, in_use_names,
                        retval_name, mappers)
-    func_def = ast.parse(textwrap.dedent(inspect.getsource(func))).body[0]
+    func_def = _parse_cache.parse(func)
 
     # Initialize arguments.
     # The local namespace is empty so code_visit will always resolve
@@ -313,7 +364,10 @@ class Function:
             return ast.copy_location(ast.Name(retval_name_m, ast.Load()),
                                      node)
         else:
-            arg1 = ast.copy_location(ast.Str("rpc"), node)
+            if getattr(func, "async_rpc", False):
+                arg1 = ast.copy_location(ast.Str("rpc_async"), node)
+            else:
+                arg1 = ast.copy_location(ast.Str("rpc"), node)
             arg2 = ast.copy_location(
                 value_to_ast(self.mappers.rpc.encode(func)), node)
             node.args[0:0] = [arg1, arg2]
@@ -520,7 +574,11 @@ def get_attr_writeback(attribute_namespace, rpc_mapper, loc_node):
     return attr_writeback
 
 
-def inline(core, k_function, k_args, k_kwargs, with_attr_writeback):
+def inline(core, k_function, k_args, k_kwargs, with_attr_writeback,
+           stats=None):
+    cache_hits = _parse_cache.hits
+    cache_misses = _parse_cache.misses
+    time_saved = _parse_cache.time_saved
     # OrderedDict prevents non-determinism in attribute init
     attribute_namespace = OrderedDict()
     # NOTE: in_use_names will be mutated. Do not mutate embeddable_func_names!
@@ -545,4 +603,9 @@ def inline(core, k_function, k_args, k_kwargs, with_attr_writeback):
         func_def.body += get_attr_writeback(attribute_namespace, mappers.rpc,
                                             func_def)
 
+    if stats is not None:
+        stats["parse_cache_hits"] = _parse_cache.hits - cache_hits
+        stats["parse_cache_misses"] = _parse_cache.misses - cache_misses
+        stats["parse_time_saved"] = _parse_cache.time_saved - time_saved
+
     return func_def, mappers.rpc.get_map(), mappers.exception.get_map()
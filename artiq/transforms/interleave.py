@@ -1,5 +1,5 @@
 import ast
-import types
+import heapq
 
 from artiq.transforms.tools import *
 
@@ -26,6 +26,18 @@ def _get_duration(stmt):
             return 0
         else:
             return -1
+    elif isinstance(stmt, (ast.For, ast.While)):
+        # loops that have not been unrolled
+        if (all(_get_duration(s) == 0 for s in stmt.body)
+                and all(_get_duration(s) == 0 for s in stmt.orelse)):
+            return 0
+        else:
+            return -1
+    elif isinstance(stmt, ast.With):
+        if all(_get_duration(s) == 0 for s in stmt.body):
+            return 0
+        else:
+            return -1
     elif isinstance(stmt, ast.Call):
         name = stmt.func.id
         assert(name != "delay")
@@ -46,50 +58,52 @@ def _get_duration(stmt):
 def _interleave_timelines(timelines):
     r = []
 
-    current_stmts = []
-    for stmts in timelines:
+    # The heap contains the next statement of each timeline, keyed on the
+    # time at which it ends and on the index of the timeline. Statements
+    # that end at the same time are executed together, in timeline order.
+    heap = []
+    for index, stmts in enumerate(timelines):
         it = iter(stmts)
         try:
             stmt = next(it)
         except StopIteration:
             pass
         else:
-            current_stmts.append(types.SimpleNamespace(
-                delay=_get_duration(stmt), stmt=stmt, it=it))
+            duration = _get_duration(stmt)
+            if duration < 0:
+                # contains statement(s) with indeterminate duration
+                return None
+            heap.append((duration, index, stmt, it))
+    heapq.heapify(heap)
 
-    while current_stmts:
-        dt = min(stmt.delay for stmt in current_stmts)
-        if dt < 0:
-            # contains statement(s) with indeterminate duration
-            return None
-        if dt > 0:
-            # advance timeline by dt
-            for stmt in current_stmts:
-                stmt.delay -= dt
-                if stmt.delay == 0:
-                    ref_stmt = stmt.stmt
+    now = 0
+    while heap:
+        t = heap[0][0]
+        ready = []
+        while heap and heap[0][0] == t:
+            ready.append(heapq.heappop(heap))
+        if t > now:
+            # advance timeline to the end of the next delay(s)
             delay_stmt = ast.copy_location(
                 ast.Expr(ast.Call(
                     func=ast.Name("delay_mu", ast.Load()),
-                    args=[value_to_ast(dt)], keywords=[])),
-                ref_stmt)
+                    args=[value_to_ast(t - now)], keywords=[])),
+                ready[-1][2])
             r.append(delay_stmt)
+            now = t
         else:
-            for stmt in current_stmts:
-                if stmt.delay == 0:
-                    r.append(stmt.stmt)
-        # discard executed statements
-        exhausted_list = []
-        for stmt_i, stmt in enumerate(current_stmts):
-            if stmt.delay == 0:
-                try:
-                    stmt.stmt = next(stmt.it)
-                except StopIteration:
-                    exhausted_list.append(stmt_i)
-                else:
-                    stmt.delay = _get_duration(stmt.stmt)
-        for offset, i in enumerate(exhausted_list):
-            current_stmts.pop(i-offset)
+            for _, _, stmt, _ in ready:
+                r.append(stmt)
+        # move to the next statement of each timeline
+        for _, index, _, it in ready:
+            try:
+                stmt = next(it)
+            except StopIteration:
+                continue
+            duration = _get_duration(stmt)
+            if duration < 0:
+                return None
+            heapq.heappush(heap, (now + duration, index, stmt, it))
 
     return r
 
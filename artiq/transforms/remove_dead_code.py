@@ -15,6 +15,7 @@ class _SourceLister(ast.NodeVisitor):
 class _DeadCodeRemover(ast.NodeTransformer):
     def __init__(self, kept_targets):
         self.kept_targets = kept_targets
+        self.changed = False
 
     def visit_Assign(self, node):
         new_targets = []
@@ -23,6 +24,7 @@ class _DeadCodeRemover(ast.NodeTransformer):
                     or target.id in self.kept_targets):
                 new_targets.append(target)
         if not new_targets and is_ref_transparent(node.value)[0]:
+            self.changed = True
             return None
         else:
             return node
@@ -31,6 +33,7 @@ class _DeadCodeRemover(ast.NodeTransformer):
         if (isinstance(node.target, ast.Name)
                 and node.target.id not in self.kept_targets
                 and is_ref_transparent(node.value)[0]):
+            self.changed = True
             return None
         else:
             return node
@@ -38,6 +41,7 @@ class _DeadCodeRemover(ast.NodeTransformer):
     def visit_If(self, node):
         self.generic_visit(node)
         if isinstance(node.test, ast.NameConstant):
+            self.changed = True
             if node.test.value:
                 return node.body
             else:
@@ -48,6 +52,7 @@ class _DeadCodeRemover(ast.NodeTransformer):
     def visit_While(self, node):
         self.generic_visit(node)
         if isinstance(node.test, ast.NameConstant) and not node.test.value:
+            self.changed = True
             return node.orelse
         else:
             return node
@@ -56,4 +61,6 @@ class _DeadCodeRemover(ast.NodeTransformer):
 def remove_dead_code(func_def):
     sl = _SourceLister()
     sl.visit(func_def)
-    _DeadCodeRemover(sl.sources).visit(func_def)
+    dead_code_remover = _DeadCodeRemover(sl.sources)
+    dead_code_remover.visit(func_def)
+    return dead_code_remover.changed
@@ -22,6 +22,7 @@ class _InterAssignRemover(ast.NodeTransformer):
         # i.e. when x is modified, dependencies[x] is the set of names that
         # cannot be replaced anymore
         self.dependencies = defaultdict(set)
+        self.changed = False
 
     def invalidate(self, name):
         try:
@@ -35,9 +36,12 @@ class _InterAssignRemover(ast.NodeTransformer):
     def visit_Name(self, node):
         if isinstance(node.ctx, ast.Load):
             try:
-                return deepcopy(self.replacements[node.id])
+                replacement = deepcopy(self.replacements[node.id])
             except KeyError:
                 return node
+            if ast.dump(replacement) != ast.dump(node):
+                self.changed = True
+            return replacement
         else:
             self.modified_names.add(node.id)
             self.invalidate(node.id)
@@ -57,6 +61,7 @@ class _InterAssignRemover(ast.NodeTransformer):
         return node
 
     def visit_AugAssign(self, node):
+        self.changed = True
         left = deepcopy(node.target)
         left.ctx = ast.Load()
         newnode = ast.copy_location(
@@ -146,4 +151,6 @@ class _InterAssignRemover(ast.NodeTransformer):
 
 
 def remove_inter_assigns(func_def):
-    _InterAssignRemover().visit(func_def)
+    inter_assign_remover = _InterAssignRemover()
+    inter_assign_remover.visit(func_def)
+    return inter_assign_remover.changed
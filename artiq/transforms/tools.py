@@ -1,6 +1,8 @@
 import ast
 from fractions import Fraction
 
+import numpy
+
 from artiq.language import core as core_language
 from artiq.language import units
 
@@ -9,7 +11,7 @@ embeddable_funcs = (
     core_language.delay_mu, core_language.at_mu, core_language.now_mu,
     core_language.delay,
     core_language.seconds_to_mu, core_language.mu_to_seconds,
-    core_language.syscall, core_language.watchdog,
+    core_language.syscall, core_language.watchdog, core_language.unroll,
     range, bool, int, float, round, len,
     core_language.int64, core_language.round64,
     Fraction, core_language.EncodedException
@@ -37,6 +39,17 @@ class NotASTRepresentable(Exception):
 
 
 def value_to_ast(value):
+    if isinstance(value, numpy.generic):
+        # e.g. elements of arrays computed on the host
+        if isinstance(value, numpy.int64):
+            value = core_language.int64(int(value))
+        else:
+            value = value.item()
+    elif isinstance(value, numpy.ndarray) and value.ndim == 1:
+        if value.dtype == numpy.int64:
+            value = [core_language.int64(elt) for elt in value.tolist()]
+        else:
+            value = value.tolist()
     if isinstance(value, core_language.int64):  # must be before int
         return ast.Call(
             func=ast.Name("int64", ast.Load()),
@@ -1,7 +1,38 @@
+"""
+This transform unrolls ``for`` loops over iterables whose value is known at
+compile time, using a simple cost model:
+
+* a loop whose body advances the timeline and that is inside a ``parallel``
+  block must be unrolled for ``interleave`` to merge its events with the
+  other statements of the block. Such loops are fully unrolled as long as
+  the generated code has less than ``timeline_limit`` statements, and are
+  never partially unrolled.
+* other loops only gain the loop counter update and branch of each
+  iteration (a few instructions), while the kernel CPU has a small
+  direct-mapped instruction cache that a large unrolled body would thrash.
+  They are fully unrolled if the generated code has less than
+  ``code_limit`` statements, and loops over a ``range`` are otherwise
+  partially unrolled by the largest factor that stays within this limit
+  (including the unrolled remaining iterations), unless their body
+  contains other loops or their target is not a simple name.
+
+Both limits default to 500 statements, the full-unroll limit used before
+the cost model. Lowering ``code_limit`` to e.g. 64 statements (roughly 1KiB
+of or1k code) keeps unrolled loops within the instruction cache. Raising
+``timeline_limit`` lets ``interleave`` handle longer loops in ``parallel``
+blocks, at the cost of proportionally larger kernels.
+
+The ``unroll`` function of the core language overrides the cost model for
+a given loop.
+"""
+
 import ast
 from copy import deepcopy
+from fractions import Fraction
 
-from artiq.transforms.tools import eval_ast, value_to_ast
+from artiq.language.core import int64
+from artiq.transforms.tools import (eval_ast, eval_constant, value_to_ast,
+                                    NotConstant)
 
 
 def _count_stmts(node):
@@ -44,39 +75,197 @@ def _loop_breakable(node):
         return False
 
 
+def _has_timeline_effect(stmts):
+    for stmt in stmts:
+        for node in ast.walk(stmt):
+            if (isinstance(node, ast.Call)
+                    and isinstance(node.func, ast.Name)
+                    and node.func.id in ("delay_mu", "delay", "at_mu")):
+                return True
+    return False
+
+
+def _has_loops(stmts):
+    # the loop overhead saved by unrolling is negligible in front of the
+    # execution time of an inner loop
+    return any(isinstance(node, (ast.For, ast.While))
+               for stmt in stmts for node in ast.walk(stmt))
+
+
+def _is_unroll_hint(node):
+    return (isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "unroll")
+
+
+# types of the iteration values of unrolled loops
+_unrollable_types = {int, int64, float, Fraction, bool}
+_eval_symdict = {"Fraction": Fraction, "int64": int64}
+
+
 class _LoopUnroller(ast.NodeTransformer):
-    def __init__(self, limit):
-        self.limit = limit
+    def __init__(self, in_use_names, timeline_limit, code_limit):
+        self.in_use_names = in_use_names
+        self.timeline_limit = timeline_limit
+        self.code_limit = code_limit
+        self.in_parallel = 0
+        self.changed = False
+
+    def _new_name(self, base):
+        i = 0
+        while True:
+            name = "{}_unroll{}".format(base, i)
+            if name not in self.in_use_names:
+                self.in_use_names.add(name)
+                return name
+            i += 1
+
+    def visit_With(self, node):
+        parallel = (isinstance(node.items[0].context_expr, ast.Name)
+                    and node.items[0].context_expr.id == "parallel")
+        if parallel:
+            self.in_parallel += 1
+        self.generic_visit(node)
+        if parallel:
+            self.in_parallel -= 1
+        return node
+
+    def visit_Call(self, node):
+        if _is_unroll_hint(node):
+            raise ValueError("unroll() can only be used as the iterable "
+                             "of a for loop")
+        self.generic_visit(node)
+        return node
+
+    def _get_hint(self, node):
+        args = list(node.iter.args)
+        args += [kw.value for kw in node.iter.keywords]
+        if not 1 <= len(args) <= 2:
+            raise ValueError("unroll() takes an iterable and an optional "
+                             "factor")
+        node.iter = args[0]
+        if len(args) == 1:
+            return None
+        try:
+            factor = eval_constant(args[1])
+        except NotConstant:
+            raise ValueError("unroll() factor must be a constant")
+        if factor is not None and (not isinstance(factor, int)
+                                   or factor < 1):
+            raise ValueError("unroll() factor must be a positive integer")
+        return factor
 
     def visit_For(self, node):
+        if _is_unroll_hint(node.iter):
+            hinted = True
+            factor = self._get_hint(node)
+        else:
+            hinted = False
         self.generic_visit(node)
+        if hinted and factor == 1:
+            return node
+
         try:
-            it = eval_ast(node.iter)
+            it = eval_ast(node.iter, dict(_eval_symdict))
+            length = len(it)
         except:
+            if hinted:
+                raise ValueError("unroll() requires a constant iterable")
+            return node
+        if not length:
+            self.changed = True
+            return node.orelse
+        if isinstance(it, range):
+            types = {int}
+        else:
+            types = {type(value) for value in it}
+        if (_loop_breakable(node.body)
+                or len(types) != 1
+                or not types <= _unrollable_types):
+            if hinted:
+                raise ValueError("loop cannot be unrolled")
             return node
-        l_it = len(it)
-        if l_it:
-            if (not _loop_breakable(node.body)
-                    and l_it*_count_stmts(node.body) < self.limit):
-                replacement = []
-                for i in it:
-                    if not isinstance(i, int):
-                        replacement = None
-                        break
-                    replacement.append(ast.copy_location(
-                        ast.Assign(targets=[node.target],
-                                   value=value_to_ast(i)),
-                        node))
-                    replacement += deepcopy(node.body)
-                if replacement is not None:
-                    return replacement
-                else:
+
+        body_size = _count_stmts(node.body)
+        if not hinted:
+            if self.in_parallel and _has_timeline_effect(node.body):
+                # partial unrolling does not help interleaving
+                if length*body_size >= self.timeline_limit:
                     return node
+                factor = None
+            elif length*body_size < self.code_limit:
+                factor = None
             else:
-                return node
+                # the remaining iterations are unrolled after the loop,
+                # which at most doubles the size of the code
+                factor = self.code_limit//(2*body_size)
+                if (factor < 2 or not isinstance(it, range)
+                        or not isinstance(node.target, ast.Name)
+                        or _has_loops(node.body)):
+                    return node
+        elif factor is not None and factor < length:
+            if not isinstance(it, range):
+                raise ValueError("partial unrolling is only supported "
+                                 "for range() iterables")
+            if not isinstance(node.target, ast.Name):
+                raise ValueError("partial unrolling requires a simple "
+                                 "loop variable")
+
+        self.changed = True
+        if factor is None or factor >= length:
+            return self._unroll(node, it) + node.orelse
         else:
-            return node.orelse
+            return self._unroll_partially(node, it, factor) + node.orelse
+
+    def _unroll(self, node, values):
+        r = []
+        for value in values:
+            r.append(ast.copy_location(
+                ast.Assign(targets=[deepcopy(node.target)],
+                           value=value_to_ast(value)),
+                node))
+            r += deepcopy(node.body)
+        return r
+
+    def _unroll_partially(self, node, it, factor):
+        # for j in range(start, start + n*step, factor*step):
+        #     i = j
+        #     body
+        #     i = j + step
+        #     body
+        #     ...
+        # followed by the remaining iterations
+        n = len(it) - len(it) % factor
+        counter = self._new_name(node.target.id)
+        body = []
+        for i in range(factor):
+            if i:
+                value = ast.BinOp(left=ast.Name(counter, ast.Load()),
+                                  op=ast.Add(),
+                                  right=value_to_ast(i*it.step))
+            else:
+                value = ast.Name(counter, ast.Load())
+            body.append(ast.copy_location(
+                ast.Assign(targets=[ast.Name(node.target.id, ast.Store())],
+                           value=value),
+                node))
+            body += deepcopy(node.body)
+        loop = ast.copy_location(
+            ast.For(target=ast.Name(counter, ast.Store()),
+                    iter=ast.Call(
+                        func=ast.Name("range", ast.Load()),
+                        args=[value_to_ast(it.start),
+                              value_to_ast(it.start + n*it.step),
+                              value_to_ast(factor*it.step)],
+                        keywords=[]),
+                    body=body, orelse=[]),
+            node)
+        return [loop] + self._unroll(node, it[n:])
 
 
-def unroll_loops(node, limit):
-    _LoopUnroller(limit).visit(node)
+def unroll_loops(func_def, timeline_limit=500, code_limit=500):
+    in_use_names = {node.id for node in ast.walk(func_def)
+                    if isinstance(node, ast.Name)}
+    unroller = _LoopUnroller(in_use_names, timeline_limit, code_limit)
+    unroller.visit(func_def)
+    return unroller.changed
@@ -1,4 +1,5 @@
 from artiq import *
+from artiq.coredevice.histogram import Histogram
 
 
 class PhotonHistogram(EnvExperiment):
@@ -20,6 +21,9 @@ class PhotonHistogram(EnvExperiment):
         self.setattr_dataset("detect_f", 220*MHz)
         self.setattr_dataset("detect_t", 100*us)
 
+        self.hist = Histogram(self, "cooling_photon_histogram", self.nbins,
+                              clamp=True)
+
     @kernel
     def program_cooling(self):
         with self.dds_bus.batch:
@@ -50,17 +54,15 @@ class PhotonHistogram(EnvExperiment):
     def run(self):
         self.program_cooling()
 
-        hist = [0 for _ in range(self.nbins)]
         total = 0
-
         for i in range(self.repeats):
             n = self.cool_detect()
-            if n >= self.nbins:
+            self.hist.add(n)
+            if n > self.nbins - 1:
                 n = self.nbins - 1
-            hist[n] += 1
             total += n
 
-        self.set_dataset("cooling_photon_histogram", hist)
+        self.hist.send()
         self.set_dataset("ion_present", total > 5*self.repeats,
                          broadcast=True)
 
@@ -65,9 +65,9 @@ class TDR(EnvExperiment):
         with parallel:
             self.pmt0.gate_both_mu(2*p)
             self.ttl2.pulse_mu(p)
+        ti = [0 for i in range(2)]
+        if self.pmt0.timestamps_mu(ti, t0) < len(t):
+            raise PulseNotReceivedError
         for i in range(len(t)):
-            ti = self.pmt0.timestamp_mu()
-            if ti <= 0:
-                raise PulseNotReceivedError
-            t[i] += ti - t0
+            t[i] += ti[i]
         self.pmt0.count()  # flush
@@ -33,6 +33,16 @@
         now += DURATION_WRITE; \
     } while(0)
 
+/* Whether the phase accumulator of each channel is cleared on FUD, as last
+ * written into the configuration register (PHASE_CLEAR_UNKNOWN after
+ * initialization). */
+enum {
+    PHASE_CLEAR_UNKNOWN = 0,
+    PHASE_CLEAR_OFF = 1,
+    PHASE_CLEAR_ON = 2
+};
+static char phase_clear[DDS_CHANNEL_COUNT];
+
 void dds_init_all(void)
 {
     int i;
@@ -54,6 +64,8 @@ void dds_init(long long int timestamp, int channel)
 
     now = timestamp - DURATION_INIT;
 
+    if((unsigned int)channel < DDS_CHANNEL_COUNT)
+        phase_clear[channel] = PHASE_CLEAR_UNKNOWN;
 #ifdef DDS_ONEHOT_SEL
     channel = 1 << channel;
 #endif
@@ -102,22 +114,32 @@ void dds_init(long long int timestamp, int channel)
  * to continuous phase mode. */
 static unsigned int continuous_phase_comp[DDS_CHANNEL_COUNT];
 
-static void dds_set_one(long long int now, long long int ref_time, unsigned int channel,
-    unsigned int ftw, unsigned int pow, int phase_mode, unsigned int amplitude)
+static unsigned int channel_select(unsigned int channel)
 {
-    unsigned int channel_enc;
-
-	if(channel >= DDS_CHANNEL_COUNT) {
-		log("Attempted to set invalid DDS channel");
-		return;
-	}
 #ifdef DDS_ONEHOT_SEL
-    channel_enc = 1 << channel;
+    return 1 << channel;
 #else
-    channel_enc = channel;
+    return channel;
 #endif
-    DDS_WRITE(DDS_GPIO, channel_enc << 1);
+}
+
+static int phase_clear_for(int phase_mode)
+{
+    return phase_mode == PHASE_MODE_CONTINUOUS ? PHASE_CLEAR_OFF : PHASE_CLEAR_ON;
+}
+
+/* Number of writes of dds_program */
+static int program_writes(int write_cfr)
+{
+    return DURATION_PROGRAM/DURATION_WRITE - 1 - !write_cfr;
+}
 
+/* Programs the selected channel (frequency, phase and amplitude), for
+ * a FUD issued at fud_time. Returns the time after the last write. */
+static long long int dds_program(long long int now, long long int fud_time,
+    long long int ref_time, unsigned int channel, unsigned int ftw,
+    unsigned int pow, int phase_mode, unsigned int amplitude, int write_cfr)
+{
 #ifdef DDS_AD9858
     DDS_WRITE(DDS_FTW0, ftw & 0xff);
     DDS_WRITE(DDS_FTW1, (ftw >> 8) & 0xff);
@@ -134,32 +156,35 @@ static void dds_set_one(long long int now, long long int ref_time, unsigned int
      * to DDS SYSCLK, and divided by an integer DDS_RTIO_CLK_RATIO.
      */
     if(phase_mode == PHASE_MODE_CONTINUOUS) {
-        /* Do not clear phase accumulator on FUD */
+        if(write_cfr) {
+            /* Do not clear phase accumulator on FUD */
 #ifdef DDS_AD9858
-        DDS_WRITE(DDS_CFR2, 0x00);
+            DDS_WRITE(DDS_CFR2, 0x00);
 #endif
 #ifdef DDS_AD9914
-        /* Disable autoclear phase accumulator and enables OSK. */
-        DDS_WRITE(DDS_CFR1L, 0x0108);
+            /* Disable autoclear phase accumulator and enables OSK. */
+            DDS_WRITE(DDS_CFR1L, 0x0108);
 #endif
+        }
         pow += continuous_phase_comp[channel];
     } else {
-        long long int fud_time;
-
-        /* Clear phase accumulator on FUD */
+        if(write_cfr) {
+            /* Clear phase accumulator on FUD */
 #ifdef DDS_AD9858
-        DDS_WRITE(DDS_CFR2, 0x40);
+            DDS_WRITE(DDS_CFR2, 0x40);
 #endif
 #ifdef DDS_AD9914
-        /* Enable autoclear phase accumulator and enables OSK. */
-        DDS_WRITE(DDS_CFR1L, 0x2108);
+            /* Enable autoclear phase accumulator and enables OSK. */
+            DDS_WRITE(DDS_CFR1L, 0x2108);
 #endif
-        fud_time = now + 2*DURATION_WRITE;
+        }
         pow -= (ref_time - fud_time)*DDS_RTIO_CLK_RATIO*ftw >> (32-DDS_POW_WIDTH);
         if(phase_mode == PHASE_MODE_TRACKING)
             pow += ref_time*DDS_RTIO_CLK_RATIO*ftw >> (32-DDS_POW_WIDTH);
         continuous_phase_comp[channel] = pow;
     }
+    if(write_cfr)
+        phase_clear[channel] = phase_clear_for(phase_mode);
 
 #ifdef DDS_AD9858
     DDS_WRITE(DDS_POW0, pow & 0xff);
@@ -171,6 +196,22 @@ static void dds_set_one(long long int now, long long int ref_time, unsigned int
 #ifdef DDS_AD9914
     DDS_WRITE(DDS_ASF, amplitude);
 #endif
+    return now;
+}
+
+static void dds_set_one(long long int now, long long int ref_time, unsigned int channel,
+    unsigned int ftw, unsigned int pow, int phase_mode, unsigned int amplitude)
+{
+    long long int fud_time;
+
+	if(channel >= DDS_CHANNEL_COUNT) {
+		log("Attempted to set invalid DDS channel");
+		return;
+	}
+    fud_time = now + DURATION_PROGRAM;
+    DDS_WRITE(DDS_GPIO, channel_select(channel) << 1);
+    now = dds_program(now, fud_time, ref_time, channel, ftw, pow, phase_mode,
+                      amplitude, 1);
     DDS_WRITE(DDS_FUD, 0);
 }
 
@@ -234,3 +275,80 @@ void dds_set(long long int timestamp, int channel,
                     amplitude);
     }
 }
+
+void dds_set_many(long long int timestamp, struct int_list *channels,
+    struct int_list *ftws, struct int_list *pows, int phase_mode,
+    struct int_list *amplitudes)
+{
+    long long int now, fud_time;
+    unsigned int channel;
+    int i, n, writes, write_cfr;
+    char listed[DDS_CHANNEL_COUNT];
+#ifdef DDS_ONEHOT_SEL
+    unsigned int selected;
+#endif
+
+    if(batch_mode)
+        exception_raise(EID_DDS_BATCH_ERROR);
+    n = channels->length;
+    if((ftws->length != n) || (pows->length != n) || (amplitudes->length != n))
+        exception_raise(EID_DDS_BATCH_ERROR);
+    if(n == 0)
+        return;
+
+    /* Count the writes to end with a FUD at timestamp. The configuration
+     * register is only written when the phase mode of the channel changes.
+     * With one-hot channel selection, all the channels are updated by a
+     * single FUD. A channel listed twice would change the number of writes
+     * once programmed, and is rejected. */
+    for(i=0;i<DDS_CHANNEL_COUNT;i++)
+        listed[i] = 0;
+    writes = 0;
+    for(i=0;i<n;i++) {
+        channel = channels->values[i];
+        if(channel >= DDS_CHANNEL_COUNT) {
+            log("Attempted to set invalid DDS channel");
+            return;
+        }
+        if(listed[channel])
+            exception_raise(EID_DDS_BATCH_ERROR);
+        listed[channel] = 1;
+        write_cfr = phase_clear[channel] != phase_clear_for(phase_mode);
+        writes += 1 + program_writes(write_cfr);
+#ifndef DDS_ONEHOT_SEL
+        writes++; /* FUD */
+#endif
+    }
+#ifdef DDS_ONEHOT_SEL
+    writes++; /* selection of all the channels */
+#else
+    writes--; /* last FUD at timestamp */
+#endif
+
+    rtio_chan_sel_write(RTIO_DDS_CHANNEL);
+    now = timestamp - writes*DURATION_WRITE;
+#ifdef DDS_ONEHOT_SEL
+    selected = 0;
+#endif
+    for(i=0;i<n;i++) {
+        channel = channels->values[i];
+        write_cfr = phase_clear[channel] != phase_clear_for(phase_mode);
+        DDS_WRITE(DDS_GPIO, channel_select(channel) << 1);
+#ifdef DDS_ONEHOT_SEL
+        fud_time = timestamp;
+        selected |= channel_select(channel);
+#else
+        fud_time = now + program_writes(write_cfr)*DURATION_WRITE;
+#endif
+        now = dds_program(now, fud_time, timestamp, channel,
+                          ftws->values[i], pows->values[i], phase_mode,
+                          amplitudes->values[i], write_cfr);
+#ifndef DDS_ONEHOT_SEL
+        DDS_WRITE(DDS_FUD, 0);
+#endif
+    }
+#ifdef DDS_ONEHOT_SEL
+    DDS_WRITE(DDS_GPIO, selected << 1);
+    DDS_WRITE(DDS_FUD, 0);
+#endif
+}
@@ -5,6 +5,8 @@
 #include <generated/csr.h>
 #include <generated/mem.h>
 
+#include "rtio.h"
+
 /* Maximum number of commands in a batch */
 #define DDS_MAX_BATCH 16
 
@@ -60,5 +62,8 @@ void dds_batch_enter(long long int timestamp);
 void dds_batch_exit(void);
 void dds_set(long long int timestamp, int channel,
     unsigned int ftw, unsigned int pow, int phase_mode, unsigned int amplitude);
+void dds_set_many(long long int timestamp, struct int_list *channels,
+    struct int_list *ftws, struct int_list *pows, int phase_mode,
+    struct int_list *amplitudes);
 
 #endif /* __DDS_H */
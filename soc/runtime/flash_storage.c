@@ -300,4 +300,71 @@ void fs_remove(char *key)
     fs_write(key, NULL, 0);
 }
 
+static int check_records(char *records, unsigned int len)
+{
+    struct iter_state is;
+    struct record record;
+    int fatal = 0;
+
+    record_iter_init(&is, records, len);
+    while(record_iter_next(&is, &record, &fatal));
+    return !fatal;
+}
+
+int fs_write_many(char *records, unsigned int len)
+{
+    struct iter_state is;
+    struct record record;
+
+    /* Check all the records before writing any of them. */
+    if(!check_records(records, len)) {
+        log("Invalid records in flash storage write request");
+        return 0;
+    }
+
+    record_iter_init(&is, records, len);
+    while(record_iter_next(&is, &record, NULL))
+        if(!fs_write(record.key, record.value, record.value_len))
+            return 0;
+    return 1;
+}
+
+unsigned int fs_read_all(char *buffer, unsigned int buf_len)
+{
+    unsigned int read_length = 0;
+    struct iter_state is;
+    struct record record, following_record;
+    int fatal = 0;
+
+    record_iter_init(&is, STORAGE_ADDRESS, STORAGE_SIZE);
+    while(record_iter_next(&is, &record, &fatal)) {
+        /* Only the last record of each key is valid. */
+        if(is_empty(&record)
+           || key_exists(&is.buffer[is.seek], record.key, STORAGE_ADDRESS + STORAGE_SIZE, 1, &following_record))
+            continue;
+        if(record.size > buf_len - read_length)
+            break;
+        memcpy(&buffer[read_length], record.raw_record, record.size);
+        read_length += record.size;
+    }
+
+    if(fatal)
+        log("fatal error: flash storage might be corrupted");
+
+    return read_length;
+}
+
+int fs_write_image(char *image, unsigned int len)
+{
+    if(len > STORAGE_SIZE || !check_records(image, len)) {
+        log("Invalid flash storage image");
+        return 0;
+    }
+
+    fs_erase();
+    write_to_flash((unsigned int)STORAGE_ADDRESS, (unsigned char *)image, len);
+    flush_cpu_dcache();
+    return 1;
+}
+
 #endif /* CSR_SPIFLASH_BASE && SPIFLASH_PAGE_SIZE */
@@ -10,4 +10,9 @@ void fs_erase(void);
 int fs_write(char *key, void *buffer, unsigned int buflen);
 unsigned int fs_read(char *key, void *buffer, unsigned int buflen, unsigned int *remain);
 
+/* Records in the format of the flash storage (and of artiq_mkfs images) */
+int fs_write_many(char *records, unsigned int len);
+unsigned int fs_read_all(char *buffer, unsigned int buf_len);
+int fs_write_image(char *image, unsigned int len);
+
 #endif /* __FLASH_STORAGE_H */
@@ -14,6 +14,7 @@ services = [
         ("watchdog_clear", "watchdog_clear"),
 
         ("rpc", "rpc"),
+        ("rpc_async", "rpc_async"),
 
         ("rtio_get_counter", "rtio_get_counter"),
 
@@ -21,12 +22,16 @@ services = [
         ("ttl_set_oe", "ttl_set_oe"),
         ("ttl_set_sensitivity", "ttl_set_sensitivity"),
         ("ttl_get", "ttl_get"),
+        ("ttl_count", "ttl_count"),
+        ("ttl_get_many", "ttl_get_many"),
+        ("ttl_histogram", "ttl_histogram"),
         ("ttl_clock_set", "ttl_clock_set"),
 
         ("dds_init", "dds_init"),
         ("dds_batch_enter", "dds_batch_enter"),
         ("dds_batch_exit", "dds_batch_exit"),
         ("dds_set", "dds_set"),
+        ("dds_set_many", "dds_set_many"),
     ]),
 
     ("eh", [
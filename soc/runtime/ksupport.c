@@ -9,7 +9,7 @@
 
 /* for the prototypes for watchdog_set() and watchdog_clear() */
 #include "clock.h"
-/* for the prototype for rpc() */
+/* for the prototypes for rpc() and rpc_async() */
 #include "session.h"
 /* for the prototype for log() */
 #include "log.h"
@@ -147,6 +147,19 @@ int rpc(int rpc_num, ...)
     return retval;
 }
 
+void rpc_async(int rpc_num, ...)
+{
+    struct msg_rpc_request request;
+
+    /* The comms CPU copies the arguments before acknowledging the
+     * message, and does not reply. */
+    request.type = MESSAGE_TYPE_RPC_ASYNC_REQUEST;
+    request.rpc_num = rpc_num;
+    va_start(request.args, rpc_num);
+    mailbox_send_and_wait(&request);
+    va_end(request.args);
+}
+
 void log(const char *fmt, ...)
 {
     struct msg_log request;
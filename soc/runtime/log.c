@@ -7,6 +7,15 @@
 
 static int buffer_index;
 static char buffer[LOG_BUFFER_SIZE];
+/* number of characters written since the start, modulo 2^32 */
+static unsigned int buffer_total;
+
+static void log_putc(char c)
+{
+    buffer[buffer_index] = c;
+    buffer_index = (buffer_index + 1) % LOG_BUFFER_SIZE;
+    buffer_total++;
+}
 
 void log_va(const char *fmt, va_list args)
 {
@@ -14,12 +23,9 @@ void log_va(const char *fmt, va_list args)
     int i, len;
 
     len = vscnprintf(outbuf, sizeof(outbuf), fmt, args);
-    for(i=0;i<len;i++) {
-        buffer[buffer_index] = outbuf[i];
-        buffer_index = (buffer_index + 1) % LOG_BUFFER_SIZE;
-    }
-    buffer[buffer_index] = '\n';
-    buffer_index = (buffer_index + 1) % LOG_BUFFER_SIZE;
+    for(i=0;i<len;i++)
+        log_putc(outbuf[i]);
+    log_putc('\n');
 
 #ifdef CSR_ETHMAC_BASE
     /* Since main comms are over ethernet, the serial port
@@ -47,3 +53,27 @@ void log_get(char *outbuf)
         j = (j + 1) % LOG_BUFFER_SIZE;
     }
 }
+
+/* Copies to outbuf (of size LOG_BUFFER_SIZE) the characters written since
+ * the offset, counted from the start of the log. Returns their number, and
+ * sets *start to the offset of the first one, which is after the requested
+ * offset if characters have been overwritten in the meantime.
+ */
+int log_get_since(unsigned int offset, unsigned int *start, char *outbuf)
+{
+    unsigned int available, count;
+    int i, j;
+
+    available = buffer_total < LOG_BUFFER_SIZE ? buffer_total : LOG_BUFFER_SIZE;
+    count = buffer_total - offset;
+    if(count > available)
+        count = available;
+    *start = buffer_total - count;
+
+    j = (buffer_index + LOG_BUFFER_SIZE - count) % LOG_BUFFER_SIZE;
+    for(i=0;i<count;i++) {
+        outbuf[i] = buffer[j];
+        j = (j + 1) % LOG_BUFFER_SIZE;
+    }
+    return count;
+}
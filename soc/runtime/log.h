@@ -9,5 +9,6 @@ void log_va(const char *fmt, va_list args);
 void log(const char *fmt, ...);
 
 void log_get(char *outbuf);
+int log_get_since(unsigned int offset, unsigned int *start, char *outbuf);
 
 #endif /* __LOG_H */
@@ -14,6 +14,7 @@ enum {
     MESSAGE_TYPE_WATCHDOG_CLEAR,
     MESSAGE_TYPE_RPC_REQUEST,
     MESSAGE_TYPE_RPC_REPLY,
+    MESSAGE_TYPE_RPC_ASYNC_REQUEST,
     MESSAGE_TYPE_LOG,
 
     MESSAGE_TYPE_BRG_READY,
@@ -65,6 +66,7 @@ struct msg_watchdog_clear {
     int id;
 };
 
+/* also used for MESSAGE_TYPE_RPC_ASYNC_REQUEST */
 struct msg_rpc_request {
     int type;
     int rpc_num;
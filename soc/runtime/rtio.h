@@ -10,6 +10,12 @@
 #define RTIO_I_STATUS_EMPTY 1
 #define RTIO_I_STATUS_OVERFLOW 2
 
+/* List of integers passed by kernels */
+struct int_list {
+    int length;
+    int values[];
+};
+
 void rtio_init(void);
 long long int rtio_get_counter(void);
 void rtio_process_exceptional_status(int status, long long int timestamp, int channel);
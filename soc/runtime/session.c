@@ -57,6 +57,16 @@ static void submit_output(int len)
 
 static int user_kernel_state;
 
+/* Asynchronous RPC requests from the kernel are accumulated in the output
+ * buffer, and sent to the host in a single message when the kernel sends
+ * another message, when the buffer is full, or when no request has been
+ * added for ASYNC_RPC_BATCH_MS.
+ */
+#define ASYNC_RPC_BATCH_MS 1
+static int async_batch_len; /* 0 when there is no pending batch */
+static int async_batch_count;
+static long long int async_batch_last_ms;
+
 enum {
     USER_KERNEL_NONE = 0,
     USER_KERNEL_LOADED,
@@ -70,6 +80,7 @@ void session_start(void)
     memset(&buffer_out[4], 0, 4);
     kloader_stop();
     user_kernel_state = USER_KERNEL_NONE;
+    async_batch_len = 0;
     now = -1;
 }
 
@@ -94,7 +105,13 @@ enum {
     REMOTEMSG_TYPE_FLASH_READ_REQUEST,
     REMOTEMSG_TYPE_FLASH_WRITE_REQUEST,
     REMOTEMSG_TYPE_FLASH_ERASE_REQUEST,
-    REMOTEMSG_TYPE_FLASH_REMOVE_REQUEST
+    REMOTEMSG_TYPE_FLASH_REMOVE_REQUEST,
+
+    REMOTEMSG_TYPE_LOG_READ_REQUEST,
+
+    REMOTEMSG_TYPE_FLASH_WRITE_MANY_REQUEST,
+    REMOTEMSG_TYPE_FLASH_READ_ALL_REQUEST,
+    REMOTEMSG_TYPE_FLASH_WRITE_IMAGE_REQUEST
 };
 
 /* device to host */
@@ -115,7 +132,13 @@ enum {
 
     REMOTEMSG_TYPE_FLASH_READ_REPLY,
     REMOTEMSG_TYPE_FLASH_OK_REPLY,
-    REMOTEMSG_TYPE_FLASH_ERROR_REPLY
+    REMOTEMSG_TYPE_FLASH_ERROR_REPLY,
+
+    REMOTEMSG_TYPE_RPC_BATCH,
+
+    REMOTEMSG_TYPE_LOG_READ_REPLY,
+
+    REMOTEMSG_TYPE_FLASH_READ_ALL_REPLY
 };
 
 static int check_flash_storage_key_len(char *key, unsigned int key_len)
@@ -140,6 +163,20 @@ static int process_input(void)
             log_get(&buffer_out[9]);
             submit_output(9 + LOG_BUFFER_SIZE);
             break;
+        case REMOTEMSG_TYPE_LOG_READ_REQUEST: {
+            unsigned int offset, start;
+            int count;
+
+#if (LOG_BUFFER_SIZE + 13) > BUFFER_OUT_SIZE
+#error Output buffer cannot hold the log buffer
+#endif
+            memcpy(&offset, &buffer_in[9], 4);
+            count = log_get_since(offset, &start, &buffer_out[13]);
+            buffer_out[8] = REMOTEMSG_TYPE_LOG_READ_REPLY;
+            memcpy(&buffer_out[9], &start, 4);
+            submit_output(13 + count);
+            break;
+        }
         case REMOTEMSG_TYPE_IDENT_REQUEST:
             buffer_out[8] = REMOTEMSG_TYPE_IDENT_REPLY;
             buffer_out[9] = 'A';
@@ -280,6 +317,32 @@ static int process_input(void)
             submit_output(9);
             break;
         }
+        case REMOTEMSG_TYPE_FLASH_WRITE_MANY_REQUEST:
+        case REMOTEMSG_TYPE_FLASH_WRITE_IMAGE_REQUEST: {
+            unsigned int len;
+            int ret;
+
+            len = get_in_packet_len() - 9;
+            if(buffer_in[8] == REMOTEMSG_TYPE_FLASH_WRITE_MANY_REQUEST)
+                ret = fs_write_many(&buffer_in[9], len);
+            else
+                ret = fs_write_image(&buffer_in[9], len);
+
+            if(ret)
+                buffer_out[8] = REMOTEMSG_TYPE_FLASH_OK_REPLY;
+            else
+                buffer_out[8] = REMOTEMSG_TYPE_FLASH_ERROR_REPLY;
+            submit_output(9);
+            break;
+        }
+        case REMOTEMSG_TYPE_FLASH_READ_ALL_REQUEST: {
+            unsigned int ret;
+
+            buffer_out[8] = REMOTEMSG_TYPE_FLASH_READ_ALL_REPLY;
+            ret = fs_read_all(&buffer_out[9], sizeof(buffer_out) - 9);
+            submit_output(9 + ret);
+            break;
+        }
         default:
             return 0;
     }
@@ -423,15 +486,18 @@ static int add_rpc_value(int bi, int type_tag, void *value)
     return bi - obi;
 }
 
-static int send_rpc_request(int rpc_num, va_list args)
+/* Appends an RPC request (number, arguments and end marker) to the output
+ * buffer at bi. Returns the new value of bi, -1 if the output buffer is too
+ * small or -2 if the arguments are invalid.
+ */
+static int add_rpc_request(int bi, int rpc_num, va_list args)
 {
     int r;
-    int bi = 8;
     int type_tag;
     void *v;
 
-    buffer_out[bi++] = REMOTEMSG_TYPE_RPC_REQUEST;
-
+    if((bi + 4) > BUFFER_OUT_SIZE)
+        return -1;
     memcpy(&buffer_out[bi], &rpc_num, 4);
     bi += 4;
 
@@ -441,21 +507,72 @@ static int send_rpc_request(int rpc_num, va_list args)
         else {
             v = va_arg(args, void *);
             if(!kloader_validate_kpointer(v))
-                return 0;
+                return -2;
         }
         r = add_rpc_value(bi, type_tag, v);
         if(r < 0)
-            return 0;
+            return -1;
         bi += r;
     }
     if((bi + 1) > BUFFER_OUT_SIZE)
-        return 0;
+        return -1;
     buffer_out[bi++] = 0;
 
+    return bi;
+}
+
+static int send_rpc_request(int rpc_num, va_list args)
+{
+    int bi;
+
+    buffer_out[8] = REMOTEMSG_TYPE_RPC_REQUEST;
+    bi = add_rpc_request(9, rpc_num, args);
+    if(bi < 0)
+        return 0;
+
     submit_output(bi);
     return 1;
 }
 
+static void flush_async_batch(void)
+{
+    if(async_batch_len) {
+        memcpy(&buffer_out[9], &async_batch_count, 4);
+        submit_output(async_batch_len);
+        async_batch_len = 0;
+    }
+}
+
+/* Returns 1 if the request has been added to the batch, 0 if the batch
+ * must be sent first or -1 in case of error.
+ */
+static int add_async_rpc_request(int rpc_num, va_list args)
+{
+    int bi;
+    va_list args_copy;
+
+    if(!async_batch_len) {
+        buffer_out[8] = REMOTEMSG_TYPE_RPC_BATCH;
+        async_batch_len = 9 + 4;
+        async_batch_count = 0;
+    }
+    /* the arguments are read again if the request is retried */
+    va_copy(args_copy, args);
+    bi = add_rpc_request(async_batch_len, rpc_num, args_copy);
+    va_end(args_copy);
+
+    if(bi >= 0) {
+        async_batch_len = bi;
+        async_batch_count++;
+        async_batch_last_ms = clock_get_ms();
+        return 1;
+    }
+    if((bi == -1) && (async_batch_count > 0))
+        return 0;
+    async_batch_len = 0;
+    return -1;
+}
+
 /* assumes output buffer is empty when called */
 static int process_kmsg(struct msg_base *umsg)
 {
@@ -467,6 +584,13 @@ static int process_kmsg(struct msg_base *umsg)
         log("Received unexpected message from kernel CPU while not in running state");
         return 0;
     }
+    if(async_batch_len && (umsg->type != MESSAGE_TYPE_RPC_ASYNC_REQUEST)) {
+        /* Send the pending asynchronous RPC requests first. The message
+         * stays in the mailbox and is processed again once they have been
+         * transmitted. */
+        flush_async_batch();
+        return 1;
+    }
 
     switch(umsg->type) {
         case MESSAGE_TYPE_FINISHED:
@@ -474,6 +598,8 @@ static int process_kmsg(struct msg_base *umsg)
             submit_output(9);
 
             kloader_stop();
+            /* The kernel stays loaded: the host may run it again with
+             * REMOTEMSG_TYPE_RUN_KERNEL without sending the object again. */
             user_kernel_state = USER_KERNEL_LOADED;
             mailbox_acknowledge();
             break;
@@ -515,6 +641,21 @@ static int process_kmsg(struct msg_base *umsg)
             mailbox_acknowledge();
             break;
         }
+        case MESSAGE_TYPE_RPC_ASYNC_REQUEST: {
+            struct msg_rpc_request *msg = (struct msg_rpc_request *)umsg;
+            int r;
+
+            r = add_async_rpc_request(msg->rpc_num, msg->args);
+            if(r < 0)
+                return 0;
+            if(r == 0)
+                /* the batch is full, the request is processed again once
+                 * it has been transmitted */
+                flush_async_batch();
+            else
+                mailbox_acknowledge();
+            break;
+        }
         default: {
             log("Received invalid message type from kernel CPU");
             return 0;
@@ -557,7 +698,9 @@ void session_poll(void **data, int *len)
                 *len = -1;
                 return;
             }
-        }
+        } else if(async_batch_len
+                  && (clock_get_ms() - async_batch_last_ms >= ASYNC_RPC_BATCH_MS))
+            flush_async_batch();
         l = get_out_packet_len();
     }
 
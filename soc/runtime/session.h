@@ -10,5 +10,6 @@ void session_ack_data(int len);
 void session_ack_mem(int len);
 
 int rpc(int rpc_num, ...);
+void rpc_async(int rpc_num, ...);
 
 #endif /* __SESSION_H */
@@ -57,6 +57,48 @@ long long int ttl_get(int channel, long long int time_limit)
     return r;
 }
 
+int ttl_count(int channel, long long int time_limit)
+{
+    int count;
+
+    count = 0;
+    while(ttl_get(channel, time_limit) >= 0)
+        count++;
+    return count;
+}
+
+int ttl_get_many(int channel, long long int time_limit,
+    long long int reference, struct int_list *offsets)
+{
+    long long int timestamp;
+    int count;
+
+    count = 0;
+    while(count < offsets->length) {
+        timestamp = ttl_get(channel, time_limit);
+        if(timestamp < 0)
+            break;
+        offsets->values[count++] = timestamp - reference;
+    }
+    return count;
+}
+
+int ttl_histogram(int channel, long long int time_limit,
+    long long int reference, int bin_width, struct int_list *histogram)
+{
+    long long int offset;
+    int count;
+
+    count = 0;
+    while((offset = ttl_get(channel, time_limit)) >= 0) {
+        count++;
+        offset -= reference;
+        if((offset >= 0) && (offset < (long long int)bin_width*histogram->length))
+            histogram->values[offset/bin_width]++;
+    }
+    return count;
+}
+
 void ttl_clock_set(long long int timestamp, int channel, int ftw)
 {
     rtio_chan_sel_write(channel);
@@ -1,10 +1,17 @@
 #ifndef __TTL_H
 #define __TTL_H
 
+#include "rtio.h"
+
 void ttl_set_o(long long int timestamp, int channel, int value);
 void ttl_set_oe(long long int timestamp, int channel, int oe);
 void ttl_set_sensitivity(long long int timestamp, int channel, int sensitivity);
 long long int ttl_get(int channel, long long int time_limit);
+int ttl_count(int channel, long long int time_limit);
+int ttl_get_many(int channel, long long int time_limit,
+    long long int reference, struct int_list *offsets);
+int ttl_histogram(int channel, long long int time_limit,
+    long long int reference, int bin_width, struct int_list *histogram);
 void ttl_clock_set(long long int timestamp, int channel, int ftw);
 
 #endif /* __TTL_H */